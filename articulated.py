@@ -0,0 +1,320 @@
+"""
+Articulated Body Solver
+
+Reduced-coordinate alternative to the penalty spring-dampers of
+interaction.revolute.RevoluteJoint. The joints are enforced exactly:
+the state is the floating-base pose of the root body (the trunk) plus
+one angle per revolute joint, and the equations of motion are solved in
+O(n) with Featherstone's articulated body algorithm, written for
+planar spatial vectors in world coordinates <1>.
+
+With the joint springs gone, the time step is no longer limited by the
+joint stiffness. The joint limit torques are integrated implicitly on
+their own joint <2>, and the ground contact spring-dampers and sliding
+friction on the body they act on <3>. Measured on config.human_model
+(5 s, with or without the stance controller and hull contacts) the
+solver stays stable up to dt = 5e-3 and diverges at dt = 1e-2. Over
+the first 0.8 s the trunk height deviates from a run at dt = 1e-4 by
+1-20 cm at dt = 1e-3 to 2e-3, and by up to half a meter beyond.
+
+The solver is attached like the integrators in integrators.py,
+
+    rbs.integrator = ArticulatedBodySolver(rbs)
+
+and simulation.run then only passes the applied joint torques to the
+joints (RevoluteJoint.set_torque) instead of evaluating their springs.
+Body poses and velocities are written back after every step, so ground
+contacts, recorders and the animation work unchanged.
+
+"""
+
+import math
+
+from bodies import Body
+
+
+# planar spatial inertia (about the world origin) of a body with mass m
+# and moment of inertia In about its center of mass (cx, cz)
+def spatial_inertia(m, In, cx, cz):
+    return [[In + m * (cx * cx + cz * cz), -m * cz, m * cx],
+            [-m * cz, m, 0.0],
+            [m * cx, 0.0, m]]
+
+
+# spatial motion cross product v x u, for v = (w, vx, vz)
+def cross_motion(v, u):
+    return (0.0, v[2] * u[0] - v[0] * u[2], v[0] * u[1] - v[1] * u[0])
+
+
+# spatial force cross product v x* f, for f = (n, fx, fz)
+def cross_force(v, f):
+    return (v[1] * f[2] - v[2] * f[1], -v[0] * f[2], v[0] * f[1])
+
+
+def mat_vec(A, v):
+    return [A[0][0] * v[0] + A[0][1] * v[1] + A[0][2] * v[2],
+            A[1][0] * v[0] + A[1][1] * v[1] + A[1][2] * v[2],
+            A[2][0] * v[0] + A[2][1] * v[1] + A[2][2] * v[2]]
+
+
+def dot(u, v):
+    return u[0] * v[0] + u[1] * v[1] + u[2] * v[2]
+
+
+# solve A x = b for a symmetric positive definite 3x3 matrix A
+def solve3(A, b):
+    a, d, e = A[0]
+    _, c, f = A[1]
+    _, _, i = A[2]
+    co_a, co_d, co_e = c * i - f * f, e * f - d * i, d * f - c * e
+    det = a * co_a + d * co_d + e * co_e
+    if not det > 0.0 or math.isinf(det):
+        raise ValueError('articulated inertia of the root is singular or '
+                         'not finite (det %g), the state has diverged' % det)
+    return [(co_a * b[0] + co_d * b[1] + co_e * b[2]) / det,
+            (co_d * b[0] + (a * i - e * e) * b[1] + (d * e - a * f) * b[2]) / det,
+            (co_e * b[0] + (d * e - a * f) * b[1] + (a * c - d * d) * b[2]) / det]
+
+
+######################################################################
+class ArticulatedBodySolver():
+    """
+    Reduced-coordinate forward dynamics of a rigid body system whose
+    revolute joints form a tree, with body_list[0] as floating base.
+
+    Every joint must have the body closer to the root as its base body.
+    Joint angles and rates are those of RevoluteJoint, q = p_mate - p_base.
+    The generalized joint force is the joint limit torque minus the
+    applied joint torque, the same pair of torques that
+    RevoluteJoint.update puts on the base and mate sites.
+    """
+
+    reduced_coordinates = True  # joints are not updated by simulation.run
+    STATE = ('q_dot',)  # solver state besides the bodies and joints
+
+    # constructor
+    def __init__(self, rbs):
+        self.rbs = rbs
+        bodies = rbs.body_list
+        index = {id(body): ix for ix, body in enumerate(bodies)}
+
+        # parent joint of every body but the root
+        self.parent_joint = [None] * len(bodies)
+        for joint in rbs.joint_list:
+            ix = index[id(joint.mate_body)]
+            if ix == 0 or self.parent_joint[ix] is not None:
+                raise ValueError('joint %s: body %s already has a parent joint'
+                                 % (joint.name, joint.mate_body.name))
+            self.parent_joint[ix] = joint
+        self.parent = [None if joint is None else index[id(joint.base_body)]
+                       for joint in self.parent_joint]
+
+        # bodies ordered from the root outwards
+        self.order = [0]
+        for ix in self.order:
+            self.order += [child for child, parent in enumerate(self.parent)
+                           if parent == ix]
+        if len(self.order) != len(bodies):
+            raise ValueError('the joints of %s do not form a tree rooted at %s'
+                             % (rbs.name, bodies[0].name))
+
+        # bodies of the ground contacts and of the contact set bodies
+        self.contact_body = [index[id(contact.base_body)]
+                             for contact in rbs.contact_list]
+        self.contact_set_bodies = [
+            [index[id(body)] for body in contact_set.bodies]
+            for contact_set in rbs.contact_sets]
+
+        # joint sites carry no penalty forces any more
+        for joint in rbs.joint_list:
+            for site in (joint.base, joint.mate):
+                site.fx = site.fz = site.tau = 0.0
+
+        # enforce the joints on the initial state
+        self.q_dot = [0.0] * len(bodies)
+        for ix in self.order[1:]:
+            self.q_dot[ix] = bodies[ix].vp - bodies[self.parent[ix]].vp
+        self.forward_kinematics()
+
+    # poses and velocities of all bodies from the root body state and
+    # the joint angles and rates
+    def forward_kinematics(self):
+        bodies = self.rbs.body_list
+        bodies[0].update_site_coords()
+
+        for ix in self.order[1:]:
+            joint, parent, body = self.parent_joint[ix], bodies[self.parent[ix]], bodies[ix]
+            base, mate = joint.base, joint.mate
+
+            body.p = parent.p + joint.q
+            body.vp = parent.vp + self.q_dot[ix]
+            body.update_site_coords()
+
+            # the joint point is shared by the base and mate sites
+            body.x = parent.x + base.x_b2w - mate.x_b2w
+            body.z = parent.z + base.z_b2w - mate.z_b2w
+            body.vx = parent.vx - parent.vp * base.z_b2w + body.vp * mate.z_b2w
+            body.vz = parent.vz + parent.vp * base.x_b2w - body.vp * mate.x_b2w
+
+    # site positions and velocities in world frame and force derivatives
+    # (see GroundContact.force_derivatives) of the ground contacts of
+    # every body
+    def contact_springs(self):
+        bodies = self.rbs.body_list
+        springs = [[] for _ in bodies]
+        for ix, contact in zip(self.contact_body, self.rbs.contact_list):
+            if contact.contact is True:
+                springs[ix].append(
+                    (contact.base_x, contact.base_z) + contact.site_velocity()
+                    + contact.force_derivatives(sliding_friction=True))
+        for set_bodies, contact_set in zip(self.contact_set_bodies,
+                                           self.rbs.contact_sets):
+            for jx, x_b2w, z_b2w, vx, vz, derivatives \
+                    in contact_set.force_derivatives(sliding_friction=True):
+                body = bodies[set_bodies[jx]]
+                springs[set_bodies[jx]].append(
+                    (body.x + x_b2w, body.z + z_b2w, vx, vz) + derivatives)
+        return springs
+
+    # integrate the equations of motion by one time step
+    def integrate(self, dt):
+        bodies = self.rbs.body_list
+        order, parent = self.order, self.parent
+        n = len(bodies)
+        v, c, S = [None] * n, [None] * n, [None] * n
+        IA, pA = [None] * n, [None] * n
+        U, D, u = [None] * n, [0.0] * n, [0.0] * n
+        springs = self.contact_springs()
+
+        # pass 1: spatial velocities, velocity-product accelerations and
+        # bias forces, outwards from the root
+        for ix in order:
+            body = bodies[ix]
+            joint = self.parent_joint[ix]
+            if joint is None:
+                v[ix] = (body.vp, body.vx + body.vp * body.z,
+                         body.vz - body.vp * body.x)
+            else:
+                rx = body.x + joint.mate.x_b2w  # joint point in world frame
+                rz = body.z + joint.mate.z_b2w
+                S[ix] = (1.0, rz, -rx)
+                q_dot = self.q_dot[ix]
+                vj = (q_dot, rz * q_dot, -rx * q_dot)
+                vp = v[parent[ix]]
+                v[ix] = (vp[0] + vj[0], vp[1] + vj[1], vp[2] + vj[2])
+                c[ix] = cross_motion(v[ix], vj)
+
+            # external loads: site loads and gravity, about the origin
+            n_ext, fx_ext, fz_ext = -body.x * body.m * Body.g, 0.0, -body.m * Body.g
+            for site in body.sites:
+                sx, sz = body.x + site.x_b2w, body.z + site.z_b2w
+                n_ext += site.tau + sx * site.fz - sz * site.fx
+                fx_ext += site.fx
+                fz_ext += site.fz
+
+            I = spatial_inertia(body.m, body.In, body.x, body.z)
+            bias = cross_force(v[ix], mat_vec(I, v[ix]))
+
+            # contact forces linearized over the step, <3>
+            for sx, sz, vx, vz, cx_pos, cx_vel, cz_pos, cz_vel in springs[ix]:
+                cx = dt * dt * cx_pos + dt * cx_vel
+                cz = dt * dt * cz_pos + dt * cz_vel
+                if cx > 0.0:
+                    cx = cx_pos = 0.0  # would lower the inertia
+                if cz > 0.0:
+                    cz = cz_pos = 0.0
+                I[0][0] -= cx * sz * sz + cz * sx * sx
+                I[0][1] += cx * sz
+                I[1][0] += cx * sz
+                I[0][2] -= cz * sx
+                I[2][0] -= cz * sx
+                I[1][1] -= cx
+                I[2][2] -= cz
+                fx, fz = dt * cx_pos * vx, dt * cz_pos * vz
+                n_ext += sx * fz - sz * fx
+                fx_ext += fx
+                fz_ext += fz
+
+            IA[ix] = I
+            pA[ix] = [bias[0] - n_ext, bias[1] - fx_ext, bias[2] - fz_ext]
+
+        # pass 2: articulated inertias and bias forces, inwards
+        for ix in reversed(order[1:]):
+            joint, s, q_dot = self.parent_joint[ix], S[ix], self.q_dot[ix]
+            I, p = IA[ix], pA[ix]
+
+            # limit torque linearized over the step, <2>
+            tau_lim = joint.limit_torque(joint.q, q_dot)
+            d_q, d_q_dot = joint.limit_torque_derivatives(joint.q, q_dot)
+
+            U[ix] = Us = mat_vec(I, s)
+            D[ix] = Ds = dot(s, Us) - dt * d_q_dot - dt * dt * d_q
+            u[ix] = us = tau_lim + dt * d_q * q_dot - joint.tau - dot(s, p)
+
+            Ia = [[I[r][k] - Us[r] * Us[k] / Ds for k in range(3)]
+                  for r in range(3)]
+            Iac = mat_vec(Ia, c[ix])
+            pa = [p[r] + Iac[r] + Us[r] * us / Ds for r in range(3)]
+
+            Ip, pp = IA[parent[ix]], pA[parent[ix]]
+            for r in range(3):
+                pp[r] += pa[r]
+                for k in range(3):
+                    Ip[r][k] += Ia[r][k]
+
+        # pass 3: accelerations, outwards
+        a = [None] * n
+        a[0] = [-x for x in solve3(IA[0], pA[0])]
+        q_ddot = [0.0] * n
+        for ix in order[1:]:
+            ap = a[parent[ix]]
+            ap = [ap[r] + c[ix][r] for r in range(3)]
+            q_ddot[ix] = (u[ix] - dot(U[ix], ap)) / D[ix]
+            a[ix] = [ap[r] + S[ix][r] * q_ddot[ix] for r in range(3)]
+
+        # semi-implicit Euler step of the root (center of mass
+        # acceleration from the spatial one, <1>) and the joints
+        root = bodies[0]
+        w_dot, ax, az = a[0]
+        ax += -w_dot * root.z - root.vp * root.vz
+        az += w_dot * root.x + root.vp * root.vx
+
+        root.vx += ax * dt
+        root.vz += az * dt
+        root.vp += w_dot * dt
+        root.x += root.vx * dt
+        root.z += root.vz * dt
+        root.p += root.vp * dt
+
+        for ix in order[1:]:
+            joint = self.parent_joint[ix]
+            self.q_dot[ix] += q_ddot[ix] * dt
+            joint.q += self.q_dot[ix] * dt
+
+        self.forward_kinematics()
+
+
+######################################################################
+
+# <1>: Planar spatial vectors are (w, vx, vz) for motion and (n, fx, fz)
+# for force, both referred to the world origin. A body with center of
+# mass c and velocity v_c moves with spatial velocity
+# (w, v_c + w*(c_z, -c_x)), and a revolute joint at world point r has the
+# motion subspace S = (1, r_z, -r_x). The spatial acceleration a = (w_dot,
+# a_O) of the root converts back to the center of mass acceleration as
+# a_c = a_O + w_dot x c + w x v_c.
+
+# <2>: The limit torque is linearized about the current joint angle and
+# rate, tau_lim(q + dt*q_dot', q_dot') with q_dot' = q_dot + dt*q_ddot.
+# Its q_ddot terms move into the joint's articulated inertia D (like an
+# armature), so the stiff limit stays stable at large time steps.
+
+# <3>: Likewise a contact force f(r, v_r) at the site r is linearized as
+# f + dt*c_pos*v_r' + c_vel*(v_r' - v_r) with v_r' = v_r + dt*G*a and
+# G = ((-r_z, 1, 0), (r_x, 0, 1)) mapping the spatial acceleration a of
+# the body to the site (velocity product terms neglected, as in
+# integrators.LinearlyImplicitEuler). The a terms add
+# -G^T (dt^2*c_pos + dt*c_vel) G to the spatial inertia of the body,
+# the rest dt*c_pos*v_r to its external load. Sliding friction enters
+# as a damper (see GroundContact.sliding_damper), and directions whose
+# linearization would lower the inertia stay explicit.
@@ -0,0 +1,319 @@
+"""
+Benchmarks
+
+Measures the step rate (calls per second) of the components of the
+physics loop, body integration, site coordinates, joints, contacts in
+contact and in flight, the controller and the recorder, and of whole
+simulations of human_model and of chains and ensembles of several
+sizes. Results are written as JSON and compared against a baseline,
+e.g.
+
+    python benchmark.py --save-baseline          # store a baseline first
+    python benchmark.py                          # run, compare with baseline
+    python benchmark.py --only joint --out joints.json
+
+No baseline is shipped: it has to be recorded locally with
+--save-baseline, on the machine and Python/NumPy versions (recorded
+with the results) the comparison will run on, before a comparison
+means anything.
+
+Every rate is divided by the rate of a fixed pure-Python calibration
+loop timed right before it in the same process, so slowdowns of the
+whole machine (other processes, frequency scaling) cancel out and the
+comparison is made on these relative rates <1>. A benchmark is
+reported as a regression when its relative rate drops by more than the
+tolerance (default 50 %, above the drift of up to 40 % seen between
+runs of raw rates on shared hosts) below the baseline; the script then
+exits with status 1. Every benchmark is run several times (--runs),
+and rates are medians over the runs and over the repeats within one.
+
+"""
+
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from body_system import RigidBodySystem
+from config import human_model, HUMAN_MODEL_PARAMS
+from control import StanceController
+from ensemble import Ensemble
+from interaction.contact import GroundContact
+from interaction.revolute import RevoluteJoint
+from recorder import Recorder
+from simulation import run
+
+DT = 1e-4
+BODY_COUNTS = (4, 16, 64)
+ENSEMBLE_SIZES = (1, 16, 256)
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'benchmark_baseline.json')
+
+
+# chain of n links of 0.5 m hanging from the first one, with a ground
+# contact at the lower end of the last link, in contact if grounded
+def chain_system(n, grounded=False):
+    rbs = RigidBodySystem(name='chain of %d' % n)
+    top = 0.5 * n - 0.005 if grounded else 0.5 * n + 1.0
+    for ix in range(n):
+        body = rbs.add_body('link %d' % ix, mass=5.0, moment_of_inertia=0.1,
+                            x=0.0, z=top - 0.25 - 0.5 * ix, p=0.0,
+                            vx=0.0, vz=0.0, vp=0.0)
+        body.add_site('top', x_b=0.0, z_b=0.25)
+        body.add_site('bottom', x_b=0.0, z_b=-0.25)
+        body.update_site_coords()
+
+    bodies = rbs.body_list
+    rbs.joint_list = [
+        RevoluteJoint('joint %d' % ix, base, base.sites[1], mate, mate.sites[0],
+                      -2.0, 2.0, 5 * math.pi / 180, 5000 ** 2 / 80, 5000,
+                      180 / math.pi)
+        for ix, (base, mate) in enumerate(zip(bodies, bodies[1:]))]
+    contact_params = {name: HUMAN_MODEL_PARAMS[name] for name in
+                      ('stiffness_x', 'max_vx', 'stiffness_z', 'max_vz',
+                       'mu_slide', 'v_transition', 'mu_stick')}
+    rbs.contact_list = [GroundContact('end contact', bodies[-1],
+                                      bodies[-1].sites[1], **contact_params)]
+    return rbs
+
+
+# median rate [calls/s] of calling fn number times, over repeat repeats
+def rate(fn, number, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append(time.perf_counter() - start)
+    return number / statistics.median(times)
+
+
+# calibration workload: float arithmetic, attribute access and a call,
+# like one update of a body or joint
+class CalibrationBody():
+    def __init__(self):
+        self.x, self.vx, self.fx = 0.0, 1.0, 0.5
+
+    def integrate(self, dt):
+        self.vx += self.fx * dt
+        self.x += self.vx * dt
+        self.fx = -math.sin(self.x)
+
+
+# rate of the calibration loop [calls/s] on this machine at this moment
+def calibration_rate(repeat=5):
+    body = CalibrationBody()
+    return rate(lambda: body.integrate(DT), 20000, repeat)
+
+
+# component benchmarks: name -> (setup() returning fn, number of calls)
+def components():
+    def body_integrate():
+        body = human_model().body_list[1]
+        return lambda: body.integrate(DT)
+
+    def site_coords():
+        body = human_model().body_list[1]
+        return body.update_site_coords
+
+    def joint_update():
+        joint = human_model().joint_list[1]
+        return lambda: joint.update(DT, 0.0)
+
+    def contact(grounded):
+        def setup():
+            rbs = chain_system(1, grounded)
+            contact = rbs.contact_list[0]
+            return lambda: contact.update(DT, 0.0)
+        return setup
+
+    def controller_update():
+        controller = StanceController(0.1, 1.5, -0.8, 0.5)
+        state = {'t': 0.0}
+
+        def update():
+            state['t'] += DT
+            controller.update(state['t'], DT, 0.1, 1.5, -0.8, 0.5)
+        return update
+
+    def recorder_sample():
+        rbs = human_model()
+        recorder = Recorder(DT, 1.0)
+        recorder.add_joints(rbs)
+        recorder.add_contacts(rbs)
+        recorder.add_bodies(rbs)
+        sample = recorder.sampler(1)
+
+        def update():
+            if recorder.count[1] == len(recorder.t[1]):
+                recorder.count[1] = 0  # reuse the buffers
+            sample(0.0, rbs)
+        return update
+
+    return {
+        'body_integrate': (body_integrate, 20000),
+        'body_update_site_coords': (site_coords, 20000),
+        'joint_update': (joint_update, 20000),
+        'contact_update_in_contact': (contact(True), 20000),
+        'contact_update_in_flight': (contact(False), 20000),
+        'controller_update': (controller_update, 20000),
+        'recorder_sample': (recorder_sample, 5000),
+    }
+
+
+# steps per second of whole simulations
+def simulations():
+    def human_loop(controller):
+        def bench():
+            rbs = human_model()
+            ctrl = StanceController.from_system(rbs) if controller else None
+            result = run(rbs, DT, 0.5, controller=ctrl)
+            return result['steps'] / result['wall_time']
+        return bench
+
+    def chain_loop(n):
+        def bench():
+            rbs = chain_system(n, grounded=True)
+            result = run(rbs, DT, 0.1)
+            return result['steps'] / result['wall_time']
+        return bench
+
+    def ensemble_loop(size):
+        def bench():
+            ensemble = Ensemble.from_variants(human_model, [{}] * size)
+            steps = 200
+            start = time.perf_counter()
+            for _ in range(steps):
+                ensemble.step(DT)
+            return steps / (time.perf_counter() - start)
+        return bench
+
+    benches = {'human_model_loop': human_loop(False),
+               'human_model_loop_controller': human_loop(True)}
+    benches.update(('chain_%d_bodies_loop' % n, chain_loop(n))
+                   for n in BODY_COUNTS)
+    benches.update(('ensemble_%d_step' % size, ensemble_loop(size))
+                   for size in ENSEMBLE_SIZES)
+    return benches
+
+
+# run all benchmarks whose name contains only (all if None), runs
+# times each after a calibration. Returns the median rates, rates
+# relative to the calibration loop and calibration rates, with the
+# machine they ran on
+def run_benchmarks(only=None, repeat=5, runs=3, verbose=False):
+    benches = {name: (lambda setup=setup, number=number:
+                      rate(setup(), number, repeat))
+               for name, (setup, number) in components().items()}
+    benches.update((name, lambda bench=bench: statistics.median(
+        bench() for _ in range(min(repeat, 3))))
+        for name, bench in simulations().items())
+
+    results, relative, calibration = {}, {}, {}
+    for name, bench in benches.items():
+        if only is None or only in name:
+            samples = [(calibration_rate(repeat), bench())
+                       for _ in range(runs)]
+            calibration[name] = statistics.median(c for c, _ in samples)
+            results[name] = statistics.median(r for _, r in samples)
+            relative[name] = statistics.median(r / c for c, r in samples)
+            if verbose:
+                print('%-32s %12.0f steps/s %10.4f relative'
+                      % (name, results[name], relative[name]))
+
+    return {'machine': {'platform': platform.platform(),
+                        'processor': platform.processor(),
+                        'python': platform.python_version(),
+                        'numpy': np.__version__},
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'unit': 'steps/s',
+            'results': results,
+            'calibration': calibration,
+            'relative': relative}
+
+
+# compare results with a baseline on their relative rates. Returns
+# rows (name, rate, baseline rate, ratio of the relative rates, status)
+# with status 'regression' for ratios below 1 - tolerance, 'faster'
+# above 1 + tolerance, 'new' without baseline
+def compare(results, baseline, tolerance=0.5):
+    rows = []
+    for name, value in results['results'].items():
+        base = baseline['results'].get(name)
+        base_relative = baseline.get('relative', {}).get(name)
+        if base_relative is None:
+            rows.append((name, value, base, None, 'new'))
+            continue
+        ratio = results['relative'][name] / base_relative
+        status = 'regression' if ratio < 1 - tolerance \
+            else 'faster' if ratio > 1 + tolerance else 'ok'
+        rows.append((name, value, base, ratio, status))
+    return rows
+
+
+# print rows of compare() as a table
+def print_comparison(rows):
+    print('%-32s %12s %12s %7s  %s' % ('benchmark', 'steps/s', 'baseline',
+                                       'ratio*', 'status'))
+    for name, value, base, ratio, status in rows:
+        print('%-32s %12.0f %12s %7s  %s'
+              % (name, value, '-' if base is None else '%.0f' % base,
+                 '-' if ratio is None else '%.2f' % ratio, status))
+    print('* of the rates relative to the calibration loop')
+
+
+def save(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--out', default='benchmark_results.json',
+                        help='JSON file for the results')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='JSON file of the baseline')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown')
+    parser.add_argument('--only', default=None,
+                        help='run only benchmarks containing this string')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=3,
+                        help='calibrated runs per benchmark')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only, args.repeat, args.runs, verbose=True)
+    save(results, args.baseline if args.save_baseline else args.out)
+
+    if args.save_baseline is False:
+        print()
+        if os.path.exists(args.baseline) is False:
+            print('No baseline at %s, record one on this machine with '
+                  '--save-baseline' % args.baseline)
+            sys.exit(0)
+        rows = compare(results, load(args.baseline), args.tolerance)
+        print_comparison(rows)
+        if any(row[4] == 'regression' for row in rows):
+            sys.exit(1)
+
+
+######################################################################
+
+# <1>: Load that changes while the benchmarks run is only cancelled if
+# it also hits the calibration loop, which is why the loop is timed
+# again before every benchmark. Relative rates compare across runs on
+# one machine, not across machines, Python or NumPy versions.
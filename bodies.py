@@ -145,6 +145,63 @@ class Body():
         return x_w, z_w
 
 
+######################################################################
+# property forwarding an attribute of a body or site view to its
+# entry in the arrays of the owning SystemState
+def state_property(name):
+    def fget(self):
+        return getattr(self._state, name)[self._ix]
+
+    def fset(self, value):
+        getattr(self._state, name)[self._ix] = value
+
+    return property(fget, fset)
+
+
+class SiteView(Site):
+    """
+    Connection site whose coordinates and loads are stored in the
+    arrays of a SystemState instead of as separate floats.
+    """
+
+    x_b, z_b = state_property('x_b'), state_property('z_b')
+    x_b2w, z_b2w = state_property('x_b2w'), state_property('z_b2w')
+    fx, fz = state_property('fx'), state_property('fz')
+    tau = state_property('tau')
+
+    # constructor
+    def __init__(self, state, body_ix, name, x_b, z_b):
+        self._state = state
+        self._ix = state.add_site(body_ix)
+        super().__init__(name, x_b, z_b)
+
+
+######################################################################
+class BodyView(Body):
+    """
+    Rigid body whose state is a view into the arrays of a SystemState.
+    The body behaves like a regular Body, but the system integrates
+    all views of a state in a single vectorized update.
+    """
+
+    x, z, p = state_property('x'), state_property('z'), state_property('p')
+    vx, vz = state_property('vx'), state_property('vz')
+    vp = state_property('vp')
+    m, In = state_property('m'), state_property('In')
+
+    # constructor
+    def __init__(self, state, name, mass, moment_of_inertia,
+                 x, z, p, vx, vz, vp):
+        self._state = state
+        self._ix = state.add_body()
+        super().__init__(name, mass, moment_of_inertia,
+                         x, z, p, vx, vz, vp)
+
+    # create and add connection site to the body
+    def add_site(self, name, x_b, z_b):
+        self.sites.append(SiteView(self._state, self._ix, name, x_b, z_b))
+
+
 ######################################################################
 
 # <1>: The transformed coordinates are stored at the sites and later
@@ -1,19 +1,39 @@
-from bodies import Body, Anchor
+from bodies import Body, BodyView, Anchor
+from integrators import SCHEMES
+from state import SystemState
 
 
 class RigidBodySystem():
     """
     Class for a rigid body system
+
+    With array_state=True the bodies are created as views into a
+    structure-of-arrays SystemState owned by the system, and the
+    equations of motion of all bodies are integrated in one vectorized
+    update instead of body by body. The fixed overhead of the array
+    updates makes this slower for small systems like the human model,
+    it pays off from some 50 bodies on (see simulation.py).
+
+    An integrator assigned to rbs.integrator, or selected by name with
+    set_integrator (see integrators.py), replaces the explicit
+    Body.integrate update.
     """
 
     # Constructor of class
-    def __init__(self, number_of_bodies=None, name=''):
+    def __init__(self, number_of_bodies=None, name='', array_state=False):
 
         self.name = name
         self.anchor = None       # special body that does not move
         self.body_list = []     # rigid bodies that move
         self.joint_list = []    # joints that connect between bodies
         self.contact_list = []  # contact points for ground interaction
+        self.contact_sets = []  # vectorized sets of many contact points
+        self.muscle_banks = []  # vectorized banks of muscles
+
+        self.state = None  # optional array-backed state of all bodies
+        self.integrator = None  # optional replacement for the explicit update
+        if array_state is True:
+            self.state = SystemState()
 
     # add anchor to rigid body system
     def add_anchor(self, name, x, z, p):
@@ -23,9 +43,40 @@ class RigidBodySystem():
     # add body to rigid body system list
     def add_body(self, name, mass, moment_of_inertia,
                  x, z, p, vx, vz, vp):
-        self.body_list.append(Body(name, mass, moment_of_inertia,
-                                   x, z, p, vx, vz, vp))
+        if self.state is None:
+            body = Body(name, mass, moment_of_inertia, x, z, p, vx, vz, vp)
+        else:
+            body = BodyView(self.state, name, mass, moment_of_inertia,
+                            x, z, p, vx, vz, vp)
+        self.body_list.append(body)
 
         return self.body_list[-1]  # return body
 
-######################################################################
\ No newline at end of file
+    # map body coords of all sites into world frame coords
+    def update_site_coords(self):
+        if self.state is None:
+            for body in self.body_list:
+                body.update_site_coords()
+        else:
+            self.state.update_site_coords()
+
+    # select an integration scheme by name (see integrators.SCHEMES),
+    # None for the explicit update of the bodies
+    def set_integrator(self, scheme):
+        if scheme is not None and scheme not in SCHEMES:
+            raise ValueError('unknown integration scheme %s, choose from %s'
+                             % (scheme, ', '.join(SCHEMES)))
+        self.integrator = None if scheme is None else SCHEMES[scheme](self)
+        return self.integrator
+
+    # integrate equations of motion of all bodies by one time step
+    def integrate(self, dt):
+        if self.integrator is not None:
+            self.integrator.integrate(dt)
+        elif self.state is None:
+            for body in self.body_list:
+                body.integrate(dt)
+        else:
+            self.state.integrate(dt)
+
+######################################################################
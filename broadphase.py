@@ -0,0 +1,135 @@
+"""
+Contact Broadphase
+
+Skips ground contact updates in flight. After a contact (or contact
+set) has been updated and is out of contact, the height of its sites
+above the highest ground point and their vertical velocity bound the
+earliest time at which any of them can touch down,
+
+    z(t) >= z + vz*t - max_accel*t^2/2
+
+for a site accelerating downwards at most with max_accel. Until then
+the contact cannot touch down, so its update (the narrowphase) would
+only confirm that it is out of contact and is skipped, e.g.
+
+    broadphase = ImpactBroadphase(rbs)
+    summary = run(rbs, dt, t_stop, controller=controller,
+                  broadphase=broadphase)
+    summary['skipped_fraction']   # contact updates saved
+
+The bound holds only as far as max_accel does. Contact rebound, joint
+limits and the stiff penalty joints accelerate light bodies far beyond
+gravity for a few steps, so the default is well above the largest site
+accelerations of the hopping model <1>. Since the bound grows only with
+the square root of the height, a high max_accel still skips most
+updates of a long flight. Contacts closer to the ground than
+min_clearance are never skipped, and max_skip caps how long a contact
+is left alone. While a contact is skipped its reporting attributes
+(base_x, base_z, ground_height) keep their last values.
+
+"""
+
+import math
+
+from interaction.contact import ContactSet
+from terrain import Terrain
+
+
+######################################################################
+class ImpactBroadphase():
+    """
+    Time-to-impact culling of the ground contacts (rbs.contact_list)
+    and contact sets (rbs.contact_sets) of a system.
+
+    max_accel [m/s^2] bounds the downward acceleration of the contact
+    sites, min_clearance [m] is the height above ground below which a
+    contact is updated every step, and max_skip [s] the time a contact
+    is skipped in one go. evaluated and skipped count the contact
+    updates done and saved.
+
+    The wake times refer to the simulation time of the system, so a
+    broadphase has to be replaced after restoring a snapshot.
+    """
+
+    # constructor
+    def __init__(self, rbs, max_accel=1e6, min_clearance=0.0,
+                 max_skip=0.02):
+        if max_accel <= 0.0:
+            raise ValueError('max_accel must be positive')
+        self.rbs = rbs
+        self.max_accel = max_accel
+        self.min_clearance = min_clearance
+        self.max_skip = max_skip
+
+        self.contacts = list(rbs.contact_list) + list(rbs.contact_sets)
+        self.wake_time = [-math.inf] * len(self.contacts)  # next update due
+
+        self.evaluated = 0
+        self.skipped = 0
+
+    # fraction of all contact updates that were skipped
+    @property
+    def skipped_fraction(self):
+        total = self.evaluated + self.skipped
+        return self.skipped / total if total > 0 else 0.0
+
+    # lower bound of the time until a site at height above ground,
+    # moving down with v_down, can touch down, capped at max_skip
+    def time_to_impact(self, height, v_down):
+        return min(self.max_skip, 2.0 * height / (
+            v_down + math.sqrt(v_down * v_down + 2.0 * self.max_accel * height)))
+
+    # update the contacts at time t that can touch down by now. updates
+    # replaces the update functions of the contacts (one per contact,
+    # in the order of contacts), e.g. with timed ones
+    def update(self, t, dt, ground_height, updates=None):
+        if isinstance(ground_height, Terrain):
+            highest = ground_height.z_max
+        else:
+            highest = ground_height
+
+        for ix, contact in enumerate(self.contacts):
+            if t < self.wake_time[ix]:
+                self.skipped += 1
+                continue
+
+            if updates is None:
+                contact.update(dt, ground_height)
+            else:
+                updates[ix](dt, ground_height)
+            self.evaluated += 1
+
+            # lowest site and fastest downward site velocity out of
+            # contact, which bound the impact time of every site
+            if isinstance(contact, ContactSet):
+                if contact.batch.contact.any():
+                    continue
+                height = float(contact.batch.base_z.min()) - highest
+                v_down = -float(contact.batch.site_velocity(contact)[1].min())
+            else:
+                if contact.contact is True:
+                    continue
+                height = contact.base_z - highest
+                v_down = -contact.site_velocity()[1]
+
+            if height > self.min_clearance:
+                self.wake_time[ix] = t + self.time_to_impact(height,
+                                                             max(0.0, v_down))
+
+    # counters as a dict, e.g. for run summaries
+    def summary(self):
+        return {'contact_updates': self.evaluated,
+                'skipped_updates': self.skipped,
+                'skipped_fraction': self.skipped_fraction}
+
+
+######################################################################
+
+# <1>: With StanceController, downward accelerations of the ball of the
+# foot reach 2e5 m/s^2 in flight, at heights of several centimeters,
+# when the joint springs rebound after liftoff and at joint limits; a
+# bound of 20 g already skips touchdowns there. With the default the
+# trajectories of culled runs are identical to those of plain runs. A
+# contact skipped past its true touchdown is updated at its wake time
+# at the latest and then starts with a deeper penetration, i.e. a
+# stiffer first contact force.
@@ -10,7 +10,9 @@ configured by the user in this file.
 import math
 from body_system import RigidBodySystem
 from interaction.revolute import RevoluteJoint
-from interaction.contact import GroundContact
+from interaction.contact import GroundContact, ContactSet
+from interaction.params_storage import muscle_params, nervous_params
+from muscle import MuscleBank
 
 # transforms coordinates of point in frame B to frame A
 # rA = rAB + Cab*rB
@@ -22,36 +24,34 @@ def transform_point(pos_ab, angle_ab, pos_b):
     return x_a, z_a
 
 
-def human_model():
+pi = math.pi
 
-    pi = math.pi
+# default parameters of the hopping model. Any of them can be
+# overridden by keyword when calling human_model()
+HUMAN_MODEL_PARAMS = dict(
+    damping=5000,  # can go down to 2000 and then have dt=3e-4, spring damper constraint force damping coefficient
+    stiffness=None,  # None: damping**2 / 80, corresponding to critical damping as we dont want oscillations
+    k_lim=1 * 180/pi,  # [Nm/rad] mechanical limits stiffness
+    q_dot_max=5 * pi/180,  # [rad/s] mechanical limits damping
 
-    # parameters
-    NAME = 'Human Hopping Model'
-
-    DAMPING = 5000  # can go down to 2000 and then have dt=3e-4, spring damper constraint force damping coefficient
-    STIFFNESS = 1 * DAMPING**2 / 80 # stiffness corresponding to critical damping as we dont want oscillations
-    k_lim = 1 * 180/pi;    # [Nm/rad] mechanical limits stiffness
-    q_dot_max = 5 * pi/180;  # [rad/s] mechanical limits damping
-
-    x0 = 0  # inital forward (along horizontal axis) position of trunk CoM
-    h0 = 3.4  # initial height (along vertical axis)
+    x0=0,  # inital forward (along horizontal axis) position of trunk CoM
+    h0=3.4,  # initial height (along vertical axis)
 
-    initial_trunk_lean = -5 * pi / 180  # This angle is wrt global frame (not a joint angle!). 
-                                        # note that negative angle is clockwise, measured from x-axis of global to x_tr
-    initial_hip_angle = 30 * pi / 180  # all other angles are the joint angles, defined in the folowing way:
-    initial_knee_angle = -45 * pi / 180  # eg, thigh.p - trunk.p = initial_hip_angle (hip angle = p_mate - p_base)
-    initial_ankle_angle = 90 * pi / 180 # here mate is the body that rotates when the joint is moved
+    initial_trunk_lean=-5 * pi / 180,  # This angle is wrt global frame (not a joint angle!).
+                                       # note that negative angle is clockwise, measured from x-axis of global to x_tr
+    initial_hip_angle=30 * pi / 180,  # all other angles are the joint angles, defined in the folowing way:
+    initial_knee_angle=-45 * pi / 180,  # eg, thigh.p - trunk.p = initial_hip_angle (hip angle = p_mate - p_base)
+    initial_ankle_angle=90 * pi / 180,  # here mate is the body that rotates when the joint is moved
 
     # joint angle limits
-    q_max_hip = 100*pi/180
-    q_min_hip = -30*pi/180
+    q_max_hip=100*pi/180,
+    q_min_hip=-30*pi/180,
 
-    q_max_knee = 0.01
-    q_min_knee = -160*pi/180
+    q_max_knee=0.01,
+    q_min_knee=-160*pi/180,
 
-    q_max_ankle = 120*pi/180
-    q_min_ankle = 0.01
+    q_max_ankle=120*pi/180,
+    q_min_ankle=0.01,
 
     # q_max_hip = 35*pi/180  # tight joints, just used for testing.
     # q_min_hip = 25*pi/180
@@ -62,8 +62,75 @@ def human_model():
     # q_max_ankle = 95*pi/180
     # q_min_ankle = 85*pi/180
 
+    # ground contact of the ball of the foot
+    stiffness_x=4000.0,
+    max_vx=0.1,
+    stiffness_z=80000.0,
+    max_vz=0.1,
+    mu_slide=0.6,
+    v_transition=0.01,
+    mu_stick=0.8,
+
+    # contact points on the hull vertices of trunk, thigh and shank and
+    # at the heel, e.g. for falls (same contact parameters as the ball)
+    hull_contacts=False,
+
+    # drive the joints with the leg muscles of LEG_MUSCLES
+    muscles=False,
+)
+
+# single-joint leg muscles, roughly after Geyer and Herr (2010):
+# joint, moment arm d [m] (positive for muscles that increase the
+# joint angle), F_max [N], l_opt [m], tendon rest length [m], v_max
+# [l_opt/s], force feedback gain [1/F_max] and feedback delay [s]. The
+# forces are doubled for the two legs, like the segment masses
+LEG_MUSCLES = dict(
+    HFL=('hip', 0.08, 2 * 2000, 0.11, 0.10, 12, 0.0, 0.005),    # hip flexors
+    GLU=('hip', -0.08, 2 * 1500, 0.11, 0.13, 12, 0.0, 0.005),   # gluteus
+    HAM=('hip', -0.08, 2 * 3000, 0.10, 0.31, 12, 0.0, 0.005),   # hamstrings
+    VAS=('knee', 0.06, 2 * 6000, 0.08, 0.23, 12, 1.15, 0.01),   # vasti
+    BFSH=('knee', -0.04, 2 * 350, 0.12, 0.10, 12, 0.0, 0.01),   # biceps femoris short head
+    SOL=('ankle', -0.05, 2 * 4000, 0.04, 0.26, 6, 1.2, 0.02),   # soleus
+    GAS=('ankle', -0.05, 2 * 1500, 0.05, 0.40, 12, 1.1, 0.02),  # gastrocnemius
+    TA=('ankle', 0.04, 2 * 800, 0.06, 0.24, 12, 0.0, 0.02),     # tibialis anterior
+)
+
+
+# build the hopping model. With array_state=True the body states are
+# stored in a vectorized SystemState (see body_system.py). Keyword
+# overrides replace entries of HUMAN_MODEL_PARAMS
+def human_model(array_state=False, **overrides):
+
+    unknown = set(overrides) - set(HUMAN_MODEL_PARAMS)
+    if unknown:
+        raise TypeError('unknown human_model parameters: %s'
+                        % ', '.join(sorted(unknown)))
+    params = dict(HUMAN_MODEL_PARAMS, **overrides)
+
+    # parameters
+    NAME = 'Human Hopping Model'
+
+    DAMPING = params['damping']
+    STIFFNESS = params['stiffness']
+    if STIFFNESS is None:
+        STIFFNESS = 1 * DAMPING**2 / 80
+    k_lim = params['k_lim']
+    q_dot_max = params['q_dot_max']
+
+    x0 = params['x0']
+    h0 = params['h0']
+
+    initial_trunk_lean = params['initial_trunk_lean']
+    initial_hip_angle = params['initial_hip_angle']
+    initial_knee_angle = params['initial_knee_angle']
+    initial_ankle_angle = params['initial_ankle_angle']
+
+    q_max_hip, q_min_hip = params['q_max_hip'], params['q_min_hip']
+    q_max_knee, q_min_knee = params['q_max_knee'], params['q_min_knee']
+    q_max_ankle, q_min_ankle = params['q_max_ankle'], params['q_min_ankle']
+
     # create empty rigid body system
-    rbs = RigidBodySystem(NAME)
+    rbs = RigidBodySystem(name=NAME, array_state=array_state)
 
     # add segments
     # (2x normal values for leg segment masses to account for two legs)
@@ -140,11 +207,36 @@ def human_model():
     rbs.joint_list = [hip, knee, ankle]
 
     # create ground contact points
-    ball = GroundContact('ball contact', foot, foot.sites[1],
-                         stiffness_x=4000.0, max_vx=0.1,
-                         stiffness_z=80000.0, max_vz=0.1,
-                         mu_slide=0.6, v_transition=0.01,
-                         mu_stick=0.8)
+    contact_params = {name: params[name] for name in
+                      ('stiffness_x', 'max_vx', 'stiffness_z', 'max_vz',
+                       'mu_slide', 'v_transition', 'mu_stick')}
+    ball = GroundContact('ball contact', foot, foot.sites[1], **contact_params)
     rbs.contact_list = [ball]
 
+    # muscles at their optimal length in the initial posture
+    if params['muscles'] is True:
+        joints = {joint.name: joint for joint in rbs.joint_list}
+        muscles = []
+        for joint, d, F_max, l_opt, l_rest, v_max, G, delay \
+                in LEG_MUSCLES.values():
+            joint = joints[joint]
+            muscles.append((joint,
+                            muscle_params(l_ref_mtc=l_opt + l_rest,
+                                          q_ref_mtc=joint.q, d=d,
+                                          F_max=F_max, l_opt=l_opt,
+                                          w=0.56, c=math.log(0.05),
+                                          v_max=v_max * l_opt, N=1.5, K=5.0,
+                                          l_rest=l_rest, e_ref_see=0.04),
+                            nervous_params(tau=0.01, delP=delay,
+                                           stim0=0.01, G=G / F_max,
+                                           l_off=0.0)))
+        rbs.muscle_banks = [MuscleBank('leg muscles', muscles)]
+
+    if params['hull_contacts'] is True:
+        heel = [(foot, -0.01, 0.125), (foot, 0.01, 0.125)]
+        rbs.contact_sets = [ContactSet.from_hulls('hull contacts',
+                                                  [trunk, thigh, shank],
+                                                  extra_points=heel,
+                                                  **contact_params)]
+
     return rbs
\ No newline at end of file
@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 pi = math.pi
 
 
@@ -28,7 +30,23 @@ class StanceController():
     qk0 = 120 * pi / 180
     k_gas = 3000
 
-    def __init__(self, trunk_lean, qa, qk, qh):
+    # names of the gains and references that can be set per instance
+    GAINS = ('qa_ref', 'k_a', 'qk_ref', 'k_k', 'q_lean_ref', 'k_lean',
+             'k_lean_vel', 'r0', 'qa0', 'qk0', 'k_gas')
+
+    # attributes that change while the controller runs (see snapshot.py)
+    STATE = ('q_lean', 'qa', 'qk', 'qh', 'control_time_step',
+             'next_update_time', 'last_time', 'tau_a', 'tau_k', 'tau_h',
+             'dtau_a', 'dtau_k', 'dtau_h')
+
+    def __init__(self, trunk_lean, qa, qk, qh, **gains):
+        unknown = set(gains) - set(self.GAINS)
+        if unknown:
+            raise TypeError('unknown StanceController gains: %s'
+                            % ', '.join(sorted(unknown)))
+        for name, value in gains.items():
+            setattr(self, name, value)  # overrides class default
+
         self.q_lean = trunk_lean
 
         self.qa = qa
@@ -43,9 +61,39 @@ class StanceController():
         self.tau_k = 0.0
         self.tau_h = 0.0
 
+        self.dtau_a = 0.0  # torque rates between control updates
+        self.dtau_k = 0.0
+        self.dtau_h = 0.0
+
+    # create controller for a human_model system from its current state
+    @classmethod
+    def from_system(cls, rbs, **gains):
+        trunk = rbs.body_list[0]
+        hip, knee, ankle = rbs.joint_list
+        return cls(trunk.p, ankle.q, knee.q, hip.q, **gains)
+
+    # evaluate the controller on a human_model system. Torques are only
+    # applied while the foot is in ground contact and are returned in
+    # the order of rbs.joint_list (hip, knee, ankle)
+    def system_update(self, t, dt, rbs):
+        trunk = rbs.body_list[0]
+        hip, knee, ankle = rbs.joint_list
+        if rbs.contact_list[0].contact is True:
+            return self.update(t, dt, trunk.p, ankle.q, knee.q, hip.q)
+        return 0.0, 0.0, 0.0
+
+    # torque rates [Nm/s] of system_update between control updates, in
+    # the order of rbs.joint_list, for run() with a control_period
+    def system_rates(self, rbs):
+        if rbs.contact_list[0].contact is True:
+            return self.dtau_h, self.dtau_k, self.dtau_a
+        return 0.0, 0.0, 0.0
+
     def update(self, t, dt, q_lean, qa, qk, qh):
 
-        if t >= self.next_update_time:
+        # half a step of tolerance, as t and next_update_time are sums
+        # of different time steps
+        if t >= self.next_update_time - 0.5 * dt:
 
             # fix control time step if too small
             if self.control_time_step < dt:
@@ -99,3 +147,117 @@ class StanceController():
             tau_a = self.tau_a + delta_t * self.dtau_a
 
         return tau_h, tau_k, tau_a
+
+
+######################################################################
+class StanceControllerBatch():
+    """
+    Batched equivalent of StanceController. A batch evaluates M gain
+    sets against the M systems of an ensemble.Ensemble in one
+    vectorized pass, including the linear torque interpolation between
+    control updates.
+
+    The gains (see StanceController.GAINS) are given per batch entry as
+    arrays of shape (M,) or as scalars; missing gains take the
+    StanceController defaults. The state arrays (q_lean, tau_a,
+    next_update_time, ...) have shape (M,).
+
+    The update reproduces StanceController.system_update element by
+    element.
+    """
+
+    STATE = StanceController.STATE
+
+    # constructor
+    def __init__(self, trunk_lean, qa, qk, qh, **gains):
+        unknown = set(gains) - set(StanceController.GAINS)
+        if unknown:
+            raise TypeError('unknown StanceController gains: %s'
+                            % ', '.join(sorted(unknown)))
+
+        self.q_lean = np.array(trunk_lean, dtype=float)
+        shape = self.q_lean.shape
+        for name in StanceController.GAINS:
+            value = gains.get(name, getattr(StanceController, name))
+            setattr(self, name, np.array(
+                np.broadcast_to(np.asarray(value, dtype=float), shape)))
+
+        self.qa = np.array(qa, dtype=float)
+        self.qk = np.array(qk, dtype=float)
+        self.qh = np.array(qh, dtype=float)
+
+        self.control_time_step = np.full(shape, 0.001)
+        self.next_update_time = np.zeros(shape)
+        self.last_time = np.zeros(shape)
+
+        for name in ('tau_a', 'tau_k', 'tau_h', 'dtau_a', 'dtau_k', 'dtau_h'):
+            setattr(self, name, np.zeros(shape))
+
+    # create controllers for an ensemble of human_model systems from
+    # its current state, e.g. from_ensemble(ens, k_a=np.linspace(2, 4, M))
+    @classmethod
+    def from_ensemble(cls, ensemble, **gains):
+        q = ensemble.joints.q  # hip, knee, ankle
+        return cls(ensemble.p[:, 0], q[:, 2], q[:, 1], q[:, 0], **gains)
+
+    # number of gain sets in the batch
+    def __len__(self):
+        return len(self.q_lean)
+
+    # evaluate the controllers on an ensemble of human_model systems.
+    # Torques are only applied while the foot is in ground contact and
+    # are returned with shape (M, 3) in the order of rbs.joint_list
+    # (hip, knee, ankle)
+    def system_update(self, t, dt, ensemble):
+        q = ensemble.joints.q
+        return self.update(t, dt, ensemble.p[:, 0], q[:, 2], q[:, 1],
+                           q[:, 0], ensemble.contacts.contact[:, 0])
+
+    # torques of all controllers, zero where active is False
+    def update(self, t, dt, q_lean, qa, qk, qh, active=True):
+        active = np.broadcast_to(active, self.q_lean.shape)
+
+        # controllers due for an update, with the tolerance of
+        # StanceController.update
+        due = active & (t >= self.next_update_time - 0.5 * dt)
+        if due.any():
+            control_time_step = np.where(
+                due, np.maximum(self.control_time_step, dt),
+                self.control_time_step)
+            self.control_time_step = control_time_step
+
+            # lean, ankle and knee velocities
+            dq_lean = (q_lean - self.q_lean) / control_time_step
+            dqa = (qa - self.qa) / control_time_step
+            dqk = (qk - self.qk) / control_time_step
+
+            # compute torques (the gastroc spring of StanceController is
+            # not applied there either)
+            tau_a = self.k_a * (self.qa_ref - qa) - 10 * dqa
+            tau_k = self.k_k * (self.qk_ref - qk) - 10 * dqk
+            tau_h = self.k_lean * (self.q_lean_ref - q_lean) \
+                + self.k_lean_vel * (0 - dq_lean)
+
+            self.q_lean = np.where(due, q_lean, self.q_lean)
+            self.qa = np.where(due, qa, self.qa)
+            self.qk = np.where(due, qk, self.qk)
+            self.qh = np.where(due, qh, self.qh)
+
+            for name, tau in (('a', tau_a), ('k', tau_k), ('h', tau_h)):
+                old = getattr(self, 'tau_' + name)
+                setattr(self, 'dtau_' + name, np.where(
+                    due, (tau - old) / control_time_step,
+                    getattr(self, 'dtau_' + name)))
+                setattr(self, 'tau_' + name, np.where(due, tau, old))
+
+            self.last_time = np.where(due, t, self.last_time)
+            self.next_update_time = np.where(
+                due, t + control_time_step, self.next_update_time)
+
+        # propagate linear torque change based on last velocity; zero
+        # for the controllers that have just been updated
+        delta_t = t - self.last_time
+        tau = np.stack([self.tau_h + delta_t * self.dtau_h,
+                        self.tau_k + delta_t * self.dtau_k,
+                        self.tau_a + delta_t * self.dtau_a], axis=-1)
+        return np.where(active[:, None], tau, 0.0)
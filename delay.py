@@ -0,0 +1,100 @@
+"""
+Delay Lines
+
+Delayed copies of feedback signals, e.g. the muscle force, length and
+velocity seen by a reflex after the neural delay nervous_params.delP.
+Every signal has its own delay; its past values are kept in a
+preallocated circular buffer sampled at a fixed period, so writing a
+sample and reading all delayed values both cost O(1) per signal,
+however long the delays are, e.g.
+
+    lines = DelayLines(delays=[0.005, 0.02], period=1e-4, channels=3)
+    lines.push(values, dt)      # values of shape (channels, signals)
+    delayed = lines.read()      # shape (channels, signals)
+
+Delays that fall between two samples are linearly interpolated <1>.
+Steps dt other than the sample period (e.g. from adaptive.AdaptiveStepper)
+are resampled onto the fixed sample times by linear interpolation.
+
+"""
+
+import math
+
+import numpy as np
+
+
+class DelayLines():
+    """
+    Circular buffers of channels x signals values, with one delay [s]
+    per signal (shared by its channels) and samples every period [s].
+
+    initial fills the history before the first sample, either a scalar
+    or an array of shape (channels, signals).
+    """
+
+    STATE = ('buffer', 'head', 'phase', 'last')  # see snapshot.py
+
+    # constructor
+    def __init__(self, delays, period, channels=1, initial=0.0):
+        self.delays = np.array(delays, dtype=float)
+        if np.any(self.delays < 0.0):
+            raise ValueError('delays must not be negative')
+        self.period = float(period)
+        n = len(self.delays)
+
+        # enough samples for the longest delay and its interpolation
+        max_delay = float(self.delays.max()) if n > 0 else 0.0
+        self.depth = int(math.ceil(max_delay / self.period)) + 2
+        self.buffer = np.empty((self.depth, channels, n))
+        self.buffer[:] = initial
+        self.head = 0  # row of the newest sample
+        self.phase = 0.0  # time since the newest sample [s]
+        self.last = self.buffer[0].copy()  # latest pushed values
+
+        self.columns = np.arange(n)
+
+    # number of delayed signals
+    def __len__(self):
+        return len(self.delays)
+
+    # advance by dt to the current values of shape (channels, signals);
+    # writes a sample at every sample time passed
+    def push(self, values, dt):
+        values = np.asarray(values, dtype=float)
+        phase = self.phase + dt
+        while phase >= self.period:
+            phase -= self.period
+            # sample time lies phase before now, between last and values
+            weight = phase / dt
+            self.head = (self.head + 1) % self.depth
+            self.buffer[self.head] = values + weight * (self.last - values)
+        self.phase = phase
+        self.last = values
+
+    # values of all signals one delay before now, shape (channels, signals)
+    def read(self):
+        # delay in samples before the newest one
+        back = np.maximum(self.delays - self.phase, 0.0) / self.period
+        ix = back.astype(np.intp)
+        frac = back - ix
+        rows = (self.head - ix) % self.depth
+        newer = self.buffer[rows, :, self.columns]
+        older = self.buffer[(rows - 1) % self.depth, :, self.columns]
+
+        # delays shorter than the time since the newest sample lie
+        # between the current values and that sample
+        recent = self.delays < self.phase
+        if recent.any():
+            older[recent] = newer[recent]
+            newer[recent] = self.last.T[recent]
+            frac[recent] = self.delays[recent] / self.phase
+        return (newer + frac[:, None] * (older - newer)).T
+
+
+######################################################################
+
+# <1>: With steps equal to the sample period the phase stays zero, the
+# newest sample is the current value and a delay of zero returns it
+# unchanged. The buffer holds ceil(max_delay/period) + 2 samples, one
+# more than the longest delay and its older interpolation neighbour
+# need, so a sample is never overwritten while it can still be read.
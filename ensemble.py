@@ -0,0 +1,201 @@
+import time
+
+import numpy as np
+from state import SystemState
+from interaction.revolute import RevoluteJointBatch
+from interaction.contact import GroundContactBatch
+
+
+class Ensemble(SystemState):
+    """
+    Ensemble of N variants of one rigid body system stepped in lockstep.
+
+    All variants must share the same topology (bodies, sites, joints
+    and contacts in the same order) but may differ in any parameter
+    and initial condition, e.g. systems built by human_model() with
+    different keyword overrides. Body states are stored as arrays of
+    shape (N, bodies), site coordinates and loads as (N, sites), and
+    joints and contacts are updated by RevoluteJointBatch and
+    GroundContactBatch instead of one object at a time. run() steps
+    all variants under a batched controller, e.g. one gain set per
+    variant in a control.StanceControllerBatch.
+    """
+
+    # constructor
+    def __init__(self, systems):
+        super().__init__()
+        self.systems = list(systems)
+        ref = self.systems[0]
+        self.check_topology(ref, self.systems)
+
+        # body states and inertial properties, shape (N, bodies)
+        for name in ('x', 'z', 'p', 'vx', 'vz', 'vp', 'm', 'In'):
+            setattr(self, name, np.array(
+                [[getattr(b, name) for b in rbs.body_list]
+                 for rbs in self.systems], dtype=float))
+
+        # sites in body order, shape (N, sites)
+        site_index = {}
+        site_body = []
+        for ix, body in enumerate(ref.body_list):
+            for site in body.sites:
+                site_index[id(site)] = len(site_body)
+                site_body.append(ix)
+        self.site_body = np.array(site_body, dtype=np.intp)
+
+        for name in ('x_b', 'z_b', 'x_b2w', 'z_b2w', 'fx', 'fz', 'tau'):
+            setattr(self, name, np.array(
+                [[getattr(s, name) for b in rbs.body_list for s in b.sites]
+                 for rbs in self.systems], dtype=float))
+
+        # site-to-body incidence, used to sum site loads per body
+        self.incidence = np.zeros((len(site_body), len(ref.body_list)))
+        self.incidence[np.arange(len(site_body)), self.site_body] = 1.0
+
+        body_index = {id(b): ix for ix, b in enumerate(ref.body_list)}
+
+        def stack(items, name):
+            return np.array([[getattr(item, name) for item in row]
+                             for row in items], dtype=float)
+
+        # joints
+        joints = [rbs.joint_list for rbs in self.systems]
+        self.joints = RevoluteJointBatch(
+            'joints', self,
+            [body_index[id(j.base_body)] for j in ref.joint_list],
+            [site_index[id(j.base)] for j in ref.joint_list],
+            [body_index[id(j.mate_body)] for j in ref.joint_list],
+            [site_index[id(j.mate)] for j in ref.joint_list],
+            stack(joints, 'q_min'), stack(joints, 'q_max'),
+            stack(joints, 'q_dot_max'), stack(joints, 'k'),
+            stack(joints, 'b'), stack(joints, 'k_lim'))
+
+        for name in ('dist_x', 'dist_z', 'q', 'tau'):  # joint history
+            setattr(self.joints, name, stack(joints, name))
+
+        # ground contacts
+        contacts = [rbs.contact_list for rbs in self.systems]
+        self.contacts = GroundContactBatch(
+            'contacts', self,
+            [body_index[id(c.base_body)] for c in ref.contact_list],
+            [site_index[id(c.base)] for c in ref.contact_list],
+            stack(contacts, 'kx'), stack(contacts, 'max_vx'),
+            stack(contacts, 'kz'), stack(contacts, 'max_vz'),
+            stack(contacts, 'mu_slide'), stack(contacts, 'v_trans'),
+            stack(contacts, 'mu_stick'))
+
+        for name in ('base_x', 'base_z', 'x_stick', 'z_stick',
+                     'ground_height'):
+            setattr(self.contacts, name, stack(contacts, name))
+        self.contacts.contact = stack(contacts, 'contact').astype(bool)
+        self.contacts.sliding_mode = \
+            stack(contacts, 'sliding_mode').astype(bool)
+
+    # build an ensemble from a model function and a list of overrides
+    @classmethod
+    def from_variants(cls, model, variants):
+        return cls([model(**overrides) for overrides in variants])
+
+    # number of variants in the ensemble
+    def __len__(self):
+        return self.x.shape[0]
+
+    # ensure all systems have the same bodies, sites and interactions
+    @staticmethod
+    def check_topology(ref, systems):
+        def layout(rbs):
+            site_names = [[s.name for s in b.sites] for b in rbs.body_list]
+            return (site_names,
+                    [(j.base_body.name, j.base.name,
+                      j.mate_body.name, j.mate.name) for j in rbs.joint_list],
+                    [(c.base_body.name, c.base.name)
+                     for c in rbs.contact_list])
+
+        ref_layout = layout(ref)
+        for ix, rbs in enumerate(systems):
+            if rbs.contact_sets or rbs.muscle_banks:
+                raise ValueError('system %d has contact sets or muscle '
+                                 'banks, which ensembles do not support'
+                                 % ix)
+            if layout(rbs) != ref_layout:
+                raise ValueError('system %d does not match the topology '
+                                 'of the first system' % ix)
+
+    # the topology is fixed by the systems; SystemState.add_body and
+    # add_site would append to the flat arrays of a single system
+    def add_body(self):
+        raise TypeError('bodies cannot be added to an ensemble, add them '
+                        'to the systems and build a new Ensemble')
+
+    def add_site(self, body_ix):
+        raise TypeError('sites cannot be added to an ensemble, add them '
+                        'to the systems and build a new Ensemble')
+
+    # sum site forces and moments into net loads acting on each body
+    def net_loads(self):
+        net_fx = self.fx @ self.incidence
+        net_fz = self.fz @ self.incidence
+        net_tau = (self.tau + self.x_b2w * self.fz
+                   - self.z_b2w * self.fx) @ self.incidence
+
+        return net_fx, net_fz, net_tau
+
+    # advance all variants by one time step, same order as main.py:
+    # contacts, joints (with joint torques of shape (N, joints)), bodies
+    def step(self, dt, tau=0.0, ground_height=0.0):
+        self.contacts.update(self, dt, ground_height)
+        self.joints.update(self, dt, tau)
+        self.integrate(dt)
+
+    # simulate all variants from t_start to t_stop like simulation.run.
+    # If given, the controller (e.g. control.StanceControllerBatch)
+    # provides the joint torques as controller.system_update(t, dt,
+    # ensemble) with shape (N, joints)
+    def run(self, dt, t_stop, controller=None, ground_height=0.0,
+            t_start=0.0):
+        first_step = int(round(t_start / dt))
+        n_steps = int(round(t_stop / dt))
+
+        start_time = time.time()
+        tau = 0.0
+        for step in range(first_step, n_steps + 1):
+            if controller is not None:
+                tau = controller.system_update(step * dt, dt, self)
+            self.step(dt, tau, ground_height)
+
+        return {
+            't_end': n_steps * dt,
+            'steps': n_steps + 1 - first_step,
+            'wall_time': time.time() - start_time,
+            'finite': np.all(np.isfinite(
+                [self.x, self.z, self.p, self.vx, self.vz, self.vp]),
+                axis=(0, 2)),
+            'trunk_x_end': self.x[:, 0].copy(),
+            'trunk_z_end': self.z[:, 0].copy(),
+            'trunk_p_end': self.p[:, 0].copy(),
+        }
+
+    # copy the state of variant ix back into its RigidBodySystem
+    def write_back(self, ix):
+        rbs = self.systems[ix]
+        for jx, body in enumerate(rbs.body_list):
+            for name in ('x', 'z', 'p', 'vx', 'vz', 'vp'):
+                setattr(body, name, float(getattr(self, name)[ix, jx]))
+        sites = [s for b in rbs.body_list for s in b.sites]
+        for jx, site in enumerate(sites):
+            for name in ('x_b2w', 'z_b2w', 'fx', 'fz', 'tau'):
+                setattr(site, name, float(getattr(self, name)[ix, jx]))
+        for jx, joint in enumerate(rbs.joint_list):
+            for name in ('dist_x', 'dist_z', 'q', 'tau'):
+                setattr(joint, name, float(getattr(self.joints, name)[ix, jx]))
+        for jx, contact in enumerate(rbs.contact_list):
+            for name in ('base_x', 'base_z', 'x_stick', 'z_stick',
+                         'ground_height'):
+                setattr(contact, name,
+                        float(getattr(self.contacts, name)[ix, jx]))
+            contact.contact = bool(self.contacts.contact[ix, jx])
+            contact.sliding_mode = bool(self.contacts.sliding_mode[ix, jx])
+
+        return rbs
+
+######################################################################
@@ -0,0 +1,434 @@
+import abc
+import math
+import time
+
+import numpy as np
+
+from bodies import Body
+from snapshot import JOINT_STATE, CONTACT_STATE, SITE_STATE
+
+
+class Integrator(abc.ABC):
+    """
+    Base class of the integration schemes of a rigid body system.
+
+    A scheme advances all bodies at once in the generalized coordinates
+    (x, z, p) of every body. At the start of a step, the loads are
+    those that the interactions have set at the sites (see
+    simulation.run); schemes with further stages evaluate the joints
+    and contacts again on intermediate states (stage_loads).
+
+    Every scheme counts its force evaluations and the simulated and
+    wall-clock time it has integrated, see cost(). A scheme is
+    attached with rbs.set_integrator(name), see SCHEMES.
+    """
+
+    name = None
+    order = 1   # order of accuracy
+    stages = 1  # force evaluations per step
+
+    # constructor
+    def __init__(self, rbs):
+        self.rbs = rbs
+        bodies = rbs.body_list
+
+        # diagonal mass matrix and gravity in generalized coordinates
+        # (x, z, p) of all bodies
+        self.mass = np.array([[b.m, b.m, b.In] for b in bodies]).ravel()
+        self.gravity = np.array([[0.0, -Body.g, 0.0] for b in bodies]).ravel()
+
+        self.evaluations = 0  # force evaluations
+        self.sim_time = 0.0   # integrated simulation time
+        self.wall_time = 0.0  # and time spent on it
+
+    # generalized positions, velocities and site loads of all bodies
+    def gather(self):
+        bodies = self.rbs.body_list
+        state = self.rbs.state
+        if state is not None:
+            pos = np.column_stack((state.x, state.z, state.p)).ravel()
+            vel = np.column_stack((state.vx, state.vz, state.vp)).ravel()
+            load = np.column_stack(state.net_loads()).ravel()
+        else:
+            pos = np.array([(b.x, b.z, b.p) for b in bodies]).ravel()
+            vel = np.array([(b.vx, b.vz, b.vp) for b in bodies]).ravel()
+            load = np.zeros(3 * len(bodies))
+            for ix, body in enumerate(bodies):
+                net_fx, net_fz, net_tau = 0.0, 0.0, 0.0
+                for site in body.sites:
+                    net_fx += site.fx
+                    net_fz += site.fz
+                    net_tau += site.tau \
+                        + site.x_b2w * site.fz - site.z_b2w * site.fx
+                load[3 * ix:3 * ix + 3] = net_fx, net_fz, net_tau
+
+        return pos, vel, load
+
+    # write generalized positions and velocities back to the bodies
+    def scatter(self, pos, vel):
+        state = self.rbs.state
+        if state is not None:
+            state.x[:], state.z[:], state.p[:] = pos.reshape(-1, 3).T
+            state.vx[:], state.vz[:], state.vp[:] = vel.reshape(-1, 3).T
+        else:
+            pos, vel = pos.tolist(), vel.tolist()
+            for ix, body in enumerate(self.rbs.body_list):
+                body.x, body.z, body.p = pos[3 * ix:3 * ix + 3]
+                body.vx, body.vz, body.vp = vel[3 * ix:3 * ix + 3]
+
+        self.rbs.update_site_coords()
+
+    # loads of all bodies on an intermediate state of a step, c_dt
+    # after its start. The interactions are updated on that state; their
+    # contact modes and the site loads are reset to the start of the
+    # step afterwards, <2>
+    def stage_loads(self, pos, vel, c_dt):
+        rbs = self.rbs
+        saved = [(obj, [(name, getattr(obj, name)) for name in names])
+                 for obj, names in self.history()]
+
+        self.scatter(pos, vel)
+        for contact in rbs.contact_list:
+            contact.update(c_dt, contact.ground)
+        for contact_set in rbs.contact_sets:
+            contact_set.update(c_dt, contact_set.ground)
+        for joint in rbs.joint_list:
+            joint.update(c_dt, joint.tau)
+        load = self.gather()[2]
+
+        for obj, values in saved:
+            for name, value in values:
+                setattr(obj, name, value)
+        self.evaluations += 1
+        return load
+
+    # objects and attributes that make up the interaction state
+    def history(self):
+        rbs = self.rbs
+        objects = [(joint, JOINT_STATE) for joint in rbs.joint_list]
+        objects += [(contact, CONTACT_STATE) for contact in rbs.contact_list]
+        objects += [(contact_set.batch, CONTACT_STATE)
+                    for contact_set in rbs.contact_sets]
+        objects += [(site, SITE_STATE) for body in rbs.body_list
+                    for site in body.sites]
+        return objects
+
+    # generalized accelerations from loads
+    def accelerations(self, load):
+        return load / self.mass + self.gravity
+
+    # integrate equations of motion of all bodies by one time step
+    def integrate(self, dt):
+        start_time = time.perf_counter()
+        self.step(dt)
+        self.evaluations += 1  # the loads at the start of the step
+        self.sim_time += dt
+        self.wall_time += time.perf_counter() - start_time
+
+    # advance all bodies by dt, implemented by the schemes
+    @abc.abstractmethod
+    def step(self, dt):
+        pass
+
+    # force evaluations and wall-clock time per simulated second. The
+    # wall time only covers the integrator, not the interaction updates
+    # of the first stage
+    def cost(self):
+        sim_time = max(self.sim_time, 1e-300)
+        return {'scheme': self.name, 'order': self.order,
+                'evaluations_per_sim_second': self.evaluations / sim_time,
+                'wall_time_per_sim_second': self.wall_time / sim_time}
+
+
+######################################################################
+class SemiImplicitEuler(Integrator):
+    """
+    Semi-implicit (symplectic) Euler, the update of Body.integrate:
+    velocities first, then positions with the new velocities.
+    """
+
+    name = 'euler'
+
+    def step(self, dt):
+        pos, vel, load = self.gather()
+        vel = vel + self.accelerations(load) * dt
+        self.scatter(pos + vel * dt, vel)
+
+
+class VelocityVerlet(Integrator):
+    """
+    Velocity Verlet, second order. The loads are evaluated again at the
+    end of the step; the velocity-dependent joint and contact dampers
+    see the end velocities predicted with the initial accelerations.
+    """
+
+    name = 'verlet'
+    order = 2
+    stages = 2
+
+    def step(self, dt):
+        pos, vel, load = self.gather()
+        acc = self.accelerations(load)
+        vel_half = vel + acc * (dt / 2)
+        pos = pos + vel_half * dt
+        load = self.stage_loads(pos, vel + acc * dt, dt)
+        self.scatter(pos, vel_half + self.accelerations(load) * (dt / 2))
+
+
+class RungeKutta4(Integrator):
+    """
+    Classical fourth-order Runge-Kutta scheme.
+    """
+
+    name = 'rk4'
+    order = 4
+    stages = 4
+
+    def step(self, dt):
+        pos, vel, load = self.gather()
+        k1_pos, k1_vel = vel, self.accelerations(load)
+
+        k2_pos = vel + k1_vel * (dt / 2)
+        k2_vel = self.accelerations(self.stage_loads(
+            pos + k1_pos * (dt / 2), k2_pos, dt / 2))
+
+        k3_pos = vel + k2_vel * (dt / 2)
+        k3_vel = self.accelerations(self.stage_loads(
+            pos + k2_pos * (dt / 2), k3_pos, dt / 2))
+
+        k4_pos = vel + k3_vel * dt
+        k4_vel = self.accelerations(self.stage_loads(
+            pos + k3_pos * dt, k4_pos, dt))
+
+        self.scatter(pos + (k1_pos + 2 * k2_pos + 2 * k3_pos + k4_pos) * (dt / 6),
+                     vel + (k1_vel + 2 * k2_vel + 2 * k3_vel + k4_vel) * (dt / 6))
+
+
+class BogackiShampine(Integrator):
+    """
+    Bogacki-Shampine 3(2) embedded Runge-Kutta pair. The step is taken
+    with the third-order solution; the difference to the embedded
+    second-order one is kept as local_error (position and velocity
+    errors of all bodies) for step size control, see adaptive.py.
+    """
+
+    name = 'rk23'
+    order = 3
+    stages = 4
+    error_order = 2  # order of the embedded solution
+
+    def __init__(self, rbs):
+        super().__init__(rbs)
+        self.local_error = None
+
+    def step(self, dt):
+        pos, vel, load = self.gather()
+        k1_pos, k1_vel = vel, self.accelerations(load)
+
+        k2_pos = vel + k1_vel * (dt / 2)
+        k2_vel = self.accelerations(self.stage_loads(
+            pos + k1_pos * (dt / 2), k2_pos, dt / 2))
+
+        k3_pos = vel + k2_vel * (3 * dt / 4)
+        k3_vel = self.accelerations(self.stage_loads(
+            pos + k2_pos * (3 * dt / 4), k3_pos, 3 * dt / 4))
+
+        new_pos = pos + (2 * k1_pos + 3 * k2_pos + 4 * k3_pos) * (dt / 9)
+        new_vel = vel + (2 * k1_vel + 3 * k2_vel + 4 * k3_vel) * (dt / 9)
+        k4_vel = self.accelerations(self.stage_loads(new_pos, new_vel, dt))
+
+        # third-order solution minus the embedded second-order one
+        self.local_error = (
+            ((-5 * k1_pos + 6 * k2_pos + 8 * k3_pos - 9 * new_vel) * (dt / 72)).reshape(-1, 3),
+            ((-5 * k1_vel + 6 * k2_vel + 8 * k3_vel - 9 * k4_vel) * (dt / 72)).reshape(-1, 3))
+        self.scatter(new_pos, new_vel)
+
+
+######################################################################
+class LinearlyImplicitEuler(Integrator):
+    """
+    Linearly implicit Euler integration of a rigid body system.
+
+    The stiff penalty spring-dampers of the revolute joints and of the
+    ground contacts are treated implicitly: their forces are linearized
+    about the current state with the analytic Jacobian of the site
+    distances, and one linear system in the new body velocities v' is
+    solved per step
+
+        (M - dt*D - dt^2*K) v' = M v + dt*(f - D v),   x' = x + dt*v'
+
+    where f are the loads set at the sites by the interactions, and K
+    and D are the derivatives of the spring-damper forces (and of the
+    joint limit torques, which are just as stiff) with respect to body
+    positions and velocities. Applied torques and sliding friction stay
+    explicit. For the linear joint springs this is the backward Euler
+    step, which stays stable far beyond the time step limit of the
+    explicit update in Body.integrate.
+
+    The integrator is attached to a system with
+    rbs.set_integrator('implicit_euler'), after which rbs.integrate(dt)
+    uses it.
+    """
+
+    name = 'implicit_euler'
+
+    # constructor
+    def __init__(self, rbs):
+        super().__init__(rbs)
+        bodies = rbs.body_list
+        n = len(bodies)
+
+        index = {id(body): ix for ix, body in enumerate(bodies)}
+        self.joint_bodies = [(index[id(j.base_body)], index[id(j.mate_body)])
+                             for j in rbs.joint_list]
+        self.contact_bodies = [index[id(c.base_body)]
+                               for c in rbs.contact_list]
+
+        # gravity loads in generalized coordinates
+        self.weight = np.array([[0.0, -b.m * Body.g, 0.0]
+                                for b in bodies]).ravel()
+
+        # one Jacobian row per joint and contact direction, and one per
+        # joint angle for the limit torques. The sparsity pattern is
+        # fixed; only the entries on the pitch columns change with the
+        # site coordinates (self.varying holds their flat indices)
+        joints, contacts = rbs.joint_list, rbs.contact_list
+        n_rows = 3 * len(joints) + 2 * len(contacts)
+        rows = np.zeros((n_rows, 3 * n))
+        varying = []
+
+        for jx, (ib, im) in enumerate(self.joint_bodies):
+            x, z, q = 2 * jx, 2 * jx + 1, 2 * len(joints) + jx
+            rows[x, 3 * ib], rows[x, 3 * im] = -1.0, 1.0
+            rows[z, 3 * ib + 1], rows[z, 3 * im + 1] = -1.0, 1.0
+            rows[q, 3 * ib + 2], rows[q, 3 * im + 2] = -1.0, 1.0
+            varying += [(x, 3 * ib + 2), (x, 3 * im + 2),
+                        (z, 3 * ib + 2), (z, 3 * im + 2)]
+
+        for cx, ib in enumerate(self.contact_bodies):
+            x, z = 3 * len(joints) + 2 * cx, 3 * len(joints) + 2 * cx + 1
+            rows[x, 3 * ib], rows[z, 3 * ib + 1] = 1.0, 1.0
+            varying += [(x, 3 * ib + 2), (z, 3 * ib + 2)]
+
+        self.rows = rows
+        self.varying = np.ravel_multi_index(tuple(np.array(varying).T),
+                                            rows.shape)
+        self.mass_matrix = np.diag(self.mass)
+
+    # update Jacobian rows and force derivatives of the spring-dampers
+    # (c_pos w.r.t. distance, c_vel w.r.t. distance rate), <1>
+    def linearize(self):
+        entries, c_pos, c_vel = [], [], []
+
+        # rows of J in d_dot = J v, d = mate site - base site
+        for joint in self.rbs.joint_list:
+            base, mate = joint.base, joint.mate
+            entries += [base.z_b2w, -mate.z_b2w, -base.x_b2w, mate.x_b2w]
+            c_pos += [-joint.k, -joint.k]
+            c_vel += [-joint.b, -joint.b]
+
+        # limit torques of RevoluteJoint.update acting on the mate, with
+        # rows of q_dot = vp_mate - vp_base
+        for joint in self.rbs.joint_list:
+            q_dot = joint.mate_body.vp - joint.base_body.vp
+            dq, dq_dot = joint.limit_torque_derivatives(joint.q, q_dot)
+            c_pos.append(dq)
+            c_vel.append(dq_dot)
+
+        for contact in self.rbs.contact_list:
+            site = contact.base
+            entries += [-site.z_b2w, site.x_b2w]
+            cx_pos, cx_vel, cz_pos, cz_vel = contact.force_derivatives()
+            c_pos += [cx_pos, cz_pos]
+            c_vel += [cx_vel, cz_vel]
+
+        self.rows.flat[self.varying] = entries
+        return np.array(c_pos), np.array(c_vel)
+
+    # advance all bodies by dt
+    def step(self, dt):
+        pos, vel, load = self.gather()
+        load = load + self.weight
+        c_pos, c_vel = self.linearize()
+
+        # M - dt*D - dt^2*K and M v + dt*(f - D v) with K = J^T c_pos J
+        # and D = J^T c_vel J
+        rows = self.rows
+        matrix = self.mass_matrix \
+            - rows.T @ ((dt * c_vel + dt * dt * c_pos)[:, None] * rows)
+        rhs = self.mass * vel + dt * (load - rows.T @ (c_vel * (rows @ vel)))
+        vel = np.linalg.solve(matrix, rhs)
+
+        self.scatter(pos + dt * vel, vel)
+
+
+# schemes selectable by name, see RigidBodySystem.set_integrator
+SCHEMES = {scheme.name: scheme for scheme in
+           (SemiImplicitEuler, VelocityVerlet, RungeKutta4, BogackiShampine,
+            LinearlyImplicitEuler)}
+
+
+# run the system returned by make_system() with every scheme and time
+# step up to t_stop, and measure the largest deviation of the final body
+# positions from a reference run (the first scheme at reference_dt,
+# by default a quarter of the smallest dt). Returns one row per run
+# with the error and cost of the scheme, and the cheapest row (fewest
+# force evaluations per simulated second) with an error below tol
+def compare_schemes(make_system, t_stop, dts, tol, schemes=None,
+                    reference_dt=None):
+    from simulation import run  # simulation imports the system modules
+
+    schemes = list(SCHEMES) if schemes is None else list(schemes)
+
+    # final body positions, or None if the run diverged
+    def final_positions(scheme, dt):
+        rbs = make_system()
+        integrator = rbs.set_integrator(scheme)
+        try:
+            with np.errstate(all='ignore'):
+                # run() takes a last step from t_stop, so stop one step
+                # early to end all runs at the same time
+                finite = run(rbs, dt, t_stop - dt)['finite']
+        except (ValueError, OverflowError, np.linalg.LinAlgError):
+            finite = False  # e.g. math.cos of an infinite pitch
+        if finite is False:
+            return None, integrator
+        return np.array([(b.x, b.z, b.p) for b in rbs.body_list]), integrator
+
+    if reference_dt is None:
+        reference_dt = min(dts) / 4
+    reference = final_positions(schemes[0], reference_dt)[0]
+    if reference is None:
+        raise ValueError('the reference run diverged, lower reference_dt')
+
+    rows = []
+    for scheme in schemes:
+        for dt in dts:
+            positions, integrator = final_positions(scheme, dt)
+            error = math.inf if positions is None \
+                else float(np.abs(positions - reference).max())
+            row = {'dt': dt, 'error': error}
+            row.update(integrator.cost())
+            rows.append(row)
+
+    accurate = [row for row in rows if row['error'] <= tol]
+    cheapest = min(accurate, key=lambda row: row['evaluations_per_sim_second'],
+                   default=None)
+    return rows, cheapest
+
+
+######################################################################
+
+# <1>: For a site at body coords mapped to world offset (x_b2w, z_b2w)
+# the site velocity is (vx - vp * z_b2w, vz + vp * x_b2w), so each
+# Jacobian row holds (1, 0, -z_b2w) or (0, 1, x_b2w) on the columns of
+# the site's body. The generalized spring-damper load is
+# Q = J^T (c_pos * d + c_vel * d_dot), hence K = J^T c_pos J and
+# D = J^T c_vel J. Terms from the rotation of the site offsets
+# (geometric stiffness) are neglected.
+
+# <2>: Joint and contact forces are functions of the stage state (site
+# velocities are v + w x r of the bodies), so the schemes keep their
+# order on smooth stretches of the motion. Contact modes switched in a
+# stage are reset, such that mode switches happen only at the start of
+# a step.
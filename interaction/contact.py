@@ -1,3 +1,10 @@
+import math
+
+import numpy as np
+
+from terrain import Terrain
+
+
 class GroundContact():
     """
     Class describing ground contacts.
@@ -14,7 +21,8 @@ class GroundContact():
         self.base_x = self.base_body.x + self.base.x_b2w  # contact site location in world frame
         self.base_z = self.base_body.z + self.base.z_b2w
 
-        self.ground_height = 0.0  # ground height
+        self.ground = 0.0         # ground height or terrain
+        self.ground_height = 0.0  # ground height under the contact site
         self.contact = False   # true if in ground contact
         self.kz = stiffness_z  # vertical ground interaction stiffness
         self.max_vz = max_vz   # and maximum relaxation velocity
@@ -24,13 +32,20 @@ class GroundContact():
         self.mu_slide = mu_slide     # sliding friction coefficient
 
         self.x_stick = 0.0        # horiz pos at start of stiction
+        self.z_stick = 0.0        # and vert pos
         self.kx = stiffness_x     # horiz ground interaction stiffness
         self.max_vx = max_vx      # and max relaxation velocity
         self.mu_stick = mu_stick  # stiction coefficient
 
-    # update ground contact
+    # update ground contact. The site velocity is taken from the body
+    # state, so the forces depend on the current state only (dt is not
+    # used). ground_height is a height or a terrain.Terrain; the
+    # contact forces act along the ground normal and tangent under the
+    # contact site, <2>
     def update(self, dt, ground_height):
 
+        self.ground = ground_height
+        ground_height, nx, nz = self.ground_frame(ground_height)
         self.ground_height = ground_height  # not needed (for reporting only) 
 
         # compute current base location in world frame
@@ -41,36 +56,42 @@ class GroundContact():
         if base_z < ground_height:
             self.contact = True
 
-            # compute vertical ground reaction force
-            dist_z = ground_height - base_z
-            base_vz = (base_z - self.base_z) / dt
-
-            self.base.fz = self.kz * dist_z * \
-                (1 - base_vz / self.max_vz) * (base_vz < self.max_vz)
+            # compute normal ground reaction force
+            dist_n = (ground_height - base_z) * nz
+            base_vx, base_vz = self.site_velocity()
+            base_vn = base_vx * nx + base_vz * nz
+            base_vt = base_vx * nz - base_vz * nx
 
-            # compute horizontal ground reaction force
-            base_vx = (base_x - self.base_x) / dt
+            fn = self.kz * dist_n * \
+                (1 - base_vn / self.max_vz) * (base_vn < self.max_vz)
 
+            # compute tangential ground reaction force
             if self.sliding_mode is True: # initialized as true,
                 # compute as sliding mode friction, oppose direction of motion
-                if base_vx > 0:
-                    self.base.fx = - self.mu_slide * self.base.fz
+                if base_vt > 0:
+                    ft = - self.mu_slide * fn
                 else:
-                    self.base.fx = self.mu_slide * self.base.fz
+                    ft = self.mu_slide * fn
 
                 # check for friction mode transition
-                if abs(base_vx) < self.v_trans:
+                if abs(base_vt) < self.v_trans:
                     self.sliding_mode = False
-                    self.x_stick = base_x  # store x position when stiction engages
+                    self.x_stick = base_x  # store position when stiction engages
+                    self.z_stick = base_z
             else:
                 # compute as stiction
-                dist_x = base_x - self.x_stick
-                self.base.fx = self.nonlin_stiction_model(dist_x, base_vx, self.kx, self.max_vx)
-                #self.base.fx = self.lin_stiction_model(dist_x, base_vx, 8000, 100)
+                dist_t = (base_x - self.x_stick) * nz \
+                    - (base_z - self.z_stick) * nx
+                ft = self.nonlin_stiction_model(dist_t, base_vt, self.kx, self.max_vx)
+                #ft = self.lin_stiction_model(dist_t, base_vt, 8000, 100)
 
                 # check for friction mode transition
-                if abs(self.base.fx) > self.mu_stick * self.base.fz:
+                if abs(ft) > self.mu_stick * fn:
                     self.sliding_mode = True
+
+            # ground reaction force in world frame
+            self.base.fx = ft * nz + fn * nx
+            self.base.fz = fn * nz - ft * nx
         else:
             # check for transition out of contact
             if self.contact is True:
@@ -78,8 +99,85 @@ class GroundContact():
                 self.base.fx, self.base.fz = 0.0, 0.0  # reset GRFs
                 self.sliding_mode = True  # preset sliding mode
 
-        # store location to compute base velocity again next time
-        self.base_x, self.base_z = base_x, base_z
+        self.base_x, self.base_z = base_x, base_z  # for reporting
+
+    # ground height and unit normal (nx, nz) under the contact site
+    def ground_frame(self, ground):
+        if isinstance(ground, Terrain):
+            return ground.query(self.base_body.x + self.base.x_b2w)
+        return ground, 0.0, 1.0
+
+    # contact site velocity in world frame, from the body velocity
+    # (v + w x r)
+    def site_velocity(self):
+        return (self.base_body.vx - self.base_body.vp * self.base.z_b2w,
+                self.base_body.vz + self.base_body.vp * self.base.x_b2w)
+
+    # margins to the switching conditions of update(), evaluated on the
+    # current body state: the site height above ground (touchdown and
+    # liftoff), and in contact the site speed above v_trans while
+    # sliding or the stiction reserve mu_stick*fn - |ft| while sticking.
+    # A sign change over a time step means the contact switches mode
+    # within that step (see adaptive.py)
+    def switching_functions(self, ground_height):
+        ground_height, nx, nz = self.ground_frame(ground_height)
+        base_z = self.base_body.z + self.base.z_b2w
+        if self.contact is False:
+            return base_z - ground_height, 1.0
+
+        base_vx, base_vz = self.site_velocity()
+        base_vn = base_vx * nx + base_vz * nz
+        base_vt = base_vx * nz - base_vz * nx
+        if self.sliding_mode is True:
+            return base_z - ground_height, abs(base_vt) - self.v_trans
+
+        fn = self.kz * (ground_height - base_z) * nz * \
+            (1 - base_vn / self.max_vz) * (base_vn < self.max_vz)
+        dist_t = (self.base_body.x + self.base.x_b2w - self.x_stick) * nz \
+            - (base_z - self.z_stick) * nx
+        ft = self.nonlin_stiction_model(dist_t, base_vt, self.kx, self.max_vx)
+        return base_z - ground_height, self.mu_stick * fn - abs(ft)
+
+    # derivatives (dfx/dx, dfx/dvx, dfz/dz, dfz/dvz) of the ground
+    # reaction force of the last update w.r.t. the site position and
+    # velocity, used by implicit integration schemes. The ground slope
+    # is left explicit, and so is sliding friction unless
+    # sliding_friction is True <4>
+    def force_derivatives(self, sliding_friction=False):
+        if self.contact is False:
+            return 0.0, 0.0, 0.0, 0.0
+        base_vx, base_vz = self.site_velocity()
+        dist_x = None if self.sliding_mode is True \
+            else self.base_x - self.x_stick
+        cx_pos, cx_vel, cz_pos, cz_vel = self.spring_damper_derivatives(
+            self.ground_height - self.base_z, base_vz, self.kz, self.max_vz,
+            dist_x, base_vx, self.kx, self.max_vx)
+        if sliding_friction is True and dist_x is None:
+            cx_vel = self.sliding_damper(self.base.fz, base_vx,
+                                         self.mu_slide, self.v_trans)
+        return cx_pos, cx_vel, cz_pos, cz_vel
+
+    # derivatives of the vertical spring-damper fz = kz*dist_z*(1 -
+    # vz/max_vz) and, while sticking (dist_x is not None), of the
+    # nonlinear stiction spring-damper
+    @staticmethod
+    def spring_damper_derivatives(dist_z, vz, kz, max_vz,
+                                  dist_x, vx, kx, max_vx):
+        cx_pos = cx_vel = cz_pos = cz_vel = 0.0
+        if vz < max_vz:
+            cz_pos = -kz * (1 - vz / max_vz)
+            cz_vel = -kz * dist_z / max_vz
+        if dist_x is not None:
+            sign = 1.0 if dist_x >= 0 else -1.0
+            cx_pos = -kx * (1 + sign * vx / max_vx)
+            cx_vel = -kx * abs(dist_x) / max_vx
+        return cx_pos, cx_vel, cz_pos, cz_vel
+
+    # sliding friction -mu_slide*fn*sign(vt) as the damper
+    # -mu_slide*fn*vt/|vt|, cut off at v_trans
+    @staticmethod
+    def sliding_damper(fn, vt, mu_slide, v_trans):
+        return -mu_slide * abs(fn) / max(abs(vt), v_trans)
 
     # compute stiction force as linear spring damper
     @staticmethod
@@ -95,7 +193,449 @@ class GroundContact():
             fx = - k * dist * (1 - v / max_v)  # * (v < max_v)
         return fx
 
+######################################################################
+class GroundContactBatch():
+    """
+    Batched equivalent of GroundContact. A batch updates a set of
+    contact points, e.g. the same contact in every system of an
+    ensemble, in one vectorized pass.
+
+    base_body and base are index arrays into the bodies and sites of an
+    array-backed state (SystemState or Ensemble); all parameters are
+    broadcastable to (batch..., number of contacts). The update
+    reproduces GroundContact.update element by element.
+    """
+
+    # constructor
+    def __init__(self, name, state, base_body, base,
+                 stiffness_x, max_vx, stiffness_z, max_vz,
+                 mu_slide, v_transition, mu_stick):
+        self.name = name
+        self.base_body = np.asarray(base_body, dtype=np.intp)
+        self.base = np.asarray(base, dtype=np.intp)
+
+        self.base_x, self.base_z = self.site_position(state)
+        shape = self.base_x.shape
+
+        self.ground_height = np.zeros(shape)
+        self.contact = np.zeros(shape, dtype=bool)
+        self.kz = np.asarray(stiffness_z, dtype=float)
+        self.max_vz = np.asarray(max_vz, dtype=float)
+
+        self.sliding_mode = np.ones(shape, dtype=bool)
+        self.v_trans = np.asarray(v_transition, dtype=float)
+        self.mu_slide = np.asarray(mu_slide, dtype=float)
+
+        self.x_stick = np.zeros(shape)
+        self.z_stick = np.zeros(shape)
+        self.kx = np.asarray(stiffness_x, dtype=float)
+        self.max_vx = np.asarray(max_vx, dtype=float)
+        self.mu_stick = np.asarray(mu_stick, dtype=float)
+
+    # update all ground contacts of the batch. ground_height is a height
+    # (broadcastable to the batch) or a terrain.Terrain
+    def update(self, state, dt, ground_height):
+        base_x, base_z = self.site_position(state)
+        ground_height, nx, nz = self.ground_frame(base_x, ground_height)
+        self.ground_height = np.broadcast_to(
+            np.asarray(ground_height, dtype=float), self.base_x.shape)
+        contact = base_z < self.ground_height
+
+        # normal ground reaction force
+        dist_n = (self.ground_height - base_z) * nz
+        base_vx, base_vz = self.site_velocity(state)
+        base_vn = base_vx * nx + base_vz * nz
+        base_vt = base_vx * nz - base_vz * nx
+        fn = self.kz * dist_n * (1 - base_vn / self.max_vz) \
+            * (base_vn < self.max_vz)
+
+        # tangential ground reaction force in both friction modes
+        ft_slide = np.where(base_vt > 0, -self.mu_slide * fn,
+                            self.mu_slide * fn)
+        dist_t = (base_x - self.x_stick) * nz - (base_z - self.z_stick) * nx
+        ft_stick = self.nonlin_stiction_model(dist_t, base_vt,
+                                              self.kx, self.max_vx)
+        ft = np.where(self.sliding_mode, ft_slide, ft_stick)
+
+        # friction mode transitions while in contact
+        to_stick = contact & self.sliding_mode \
+            & (np.abs(base_vt) < self.v_trans)
+        to_slide = contact & ~self.sliding_mode \
+            & (np.abs(ft_stick) > self.mu_stick * fn)
+        self.x_stick = np.where(to_stick, base_x, self.x_stick)
+        self.z_stick = np.where(to_stick, base_z, self.z_stick)
+
+        # out of contact, forces vanish and sliding mode is preset
+        self.sliding_mode = ~contact | to_slide \
+            | (self.sliding_mode & ~to_stick)
+        self.contact = contact
+        state.fx[..., self.base] = np.where(contact, ft * nz + fn * nx, 0.0)
+        state.fz[..., self.base] = np.where(contact, fn * nz - ft * nx, 0.0)
+
+        self.base_x, self.base_z = base_x, base_z  # for reporting
+
+    # ground heights and unit normals (nx, nz) under the contact sites
+    @staticmethod
+    def ground_frame(base_x, ground_height):
+        if isinstance(ground_height, Terrain):
+            return ground_height.query_array(base_x)
+        return ground_height, 0.0, 1.0
+
+    # vectorized GroundContact.switching_functions: site heights above
+    # ground and friction margins of all contacts of the batch
+    def switching_functions(self, state, ground_height):
+        base_x, base_z = self.site_position(state)
+        ground_height, nx, nz = self.ground_frame(base_x, ground_height)
+        base_vx, base_vz = self.site_velocity(state)
+        base_vn = base_vx * nx + base_vz * nz
+        base_vt = base_vx * nz - base_vz * nx
+
+        fn = self.kz * (ground_height - base_z) * nz \
+            * (1 - base_vn / self.max_vz) * (base_vn < self.max_vz)
+        dist_t = (base_x - self.x_stick) * nz - (base_z - self.z_stick) * nx
+        ft = self.nonlin_stiction_model(dist_t, base_vt, self.kx, self.max_vx)
+        friction = np.where(self.sliding_mode, np.abs(base_vt) - self.v_trans,
+                            self.mu_stick * fn - np.abs(ft))
+        return base_z - ground_height, np.where(self.contact, friction, 1.0)
+
+    # get contact site location in world frame
+    def site_position(self, state):
+        base_body, base = self.base_body, self.base
+        return (state.x.take(base_body, -1) + state.x_b2w.take(base, -1),
+                state.z.take(base_body, -1) + state.z_b2w.take(base, -1))
+
+    # get contact site velocity in world frame
+    def site_velocity(self, state):
+        base_body, base = self.base_body, self.base
+        vp = state.vp.take(base_body, -1)
+        return (state.vx.take(base_body, -1) - vp * state.z_b2w.take(base, -1),
+                state.vz.take(base_body, -1) + vp * state.x_b2w.take(base, -1))
+
+    # vectorized form of GroundContact.nonlin_stiction_model
+    @staticmethod
+    def nonlin_stiction_model(dist, v, k, max_v):
+        return np.where(dist >= 0, - k * dist * (1 + v / max_v),
+                        - k * dist * (1 - v / max_v))
+
+
+######################################################################
+class ContactSet():
+    """
+    Many ground contact points on the bodies of a RigidBodySystem, e.g.
+    heel and toe or all hull vertices of the bodies, detected and
+    resolved together.
+
+    points is a list of (body, x_b, z_b) in body coordinates; all
+    points share the contact parameters of GroundContact. The loads of
+    the points of a body are summed into one load site that the set
+    adds at the body's center of mass, so the integrators and the
+    articulated body solver see them like any other site load. Contact
+    sets are kept in rbs.contact_sets and have to be created before an
+    integrator is assigned.
+
+    The positions and velocities of all points are one product of the
+    body states with constant per-point weights. Up to SCALAR_CONTACTS
+    points in contact are resolved one by one like GroundContact, more
+    in one vectorized GroundContactBatch update <3>. The set is the
+    array-backed state of its batch with one entry per point: x, z, vx,
+    vz, vp of the point's body and x_b2w, z_b2w, fx, fz of the point.
+    """
+
+    SCALAR_CONTACTS = 32
+
+    # constructor
+    def __init__(self, name, points,
+                 stiffness_x, max_vx, stiffness_z, max_vz,
+                 mu_slide, v_transition, mu_stick):
+        self.name = name
+
+        self.bodies = []  # bodies with contact points
+        for body, _, _ in points:
+            if all(other is not body for other in self.bodies):
+                self.bodies.append(body)
+        index = {id(body): ix for ix, body in enumerate(self.bodies)}
+
+        self.point_body = np.array([index[id(body)] for body, _, _ in points],
+                                   dtype=np.intp)
+        self.x_b = np.array([x_b for _, x_b, _ in points], dtype=float)
+        self.z_b = np.array([z_b for _, _, z_b in points], dtype=float)
+        self.fx = np.zeros(len(points))  # point forces in world frame
+        self.fz = np.zeros(len(points))
+
+        # weights of the states (x, z, vx, vz, cos p, sin p, vp cos p,
+        # vp sin p, vp) of all bodies for base_x, base_z, base_vx,
+        # base_vz, x_b2w and z_b2w of all points
+        n, x_b, z_b = len(points), self.x_b, self.z_b
+        weights = np.zeros((n, 6, len(self.bodies), 9))
+        point, body = np.arange(n), self.point_body
+        weights[point, 0, body, 0] = weights[point, 1, body, 1] = 1.0
+        weights[point, 2, body, 2] = weights[point, 3, body, 3] = 1.0
+        for row in (0, 4):  # x_b2w = cos p x_b - sin p z_b
+            weights[point, row, body, 4] = x_b
+            weights[point, row, body, 5] = -z_b
+        for row in (1, 5):  # z_b2w = sin p x_b + cos p z_b
+            weights[point, row, body, 4] = z_b
+            weights[point, row, body, 5] = x_b
+        weights[point, 2, body, 6] = -z_b  # vx - vp z_b2w
+        weights[point, 2, body, 7] = -x_b
+        weights[point, 3, body, 6] = x_b  # vz + vp x_b2w
+        weights[point, 3, body, 7] = -z_b
+        self.weights = weights.reshape(6 * n, -1)
+        self.point_bodies = self.point_body.tolist()
+
+        # parameters of the points resolved one by one
+        self.kz, self.max_vz = float(stiffness_z), float(max_vz)
+        self.mu_slide, self.v_trans = float(mu_slide), float(v_transition)
+        self.kx, self.max_vx = float(stiffness_x), float(max_vx)
+        self.mu_stick = float(mu_stick)
+
+        # load site of every body
+        self.sites = []
+        for body in self.bodies:
+            body.add_site(name, x_b=0.0, z_b=0.0)
+            self.sites.append(body.sites[-1])
+        self.unloaded = None  # batch.contact of an update without contacts
+
+        self.ground = 0.0  # ground height or terrain of the last update
+        self.height = None  # flat ground height of batch.ground_height
+        self.gather()
+        self.batch = GroundContactBatch(name, self, np.arange(len(points)),
+                                        np.arange(len(points)),
+                                        stiffness_x, max_vx,
+                                        stiffness_z, max_vz,
+                                        mu_slide, v_transition, mu_stick)
+
+    # contact set on the hull vertices of bodies (Body.geometry, a
+    # closed polygon), plus any extra points (body, x_b, z_b)
+    @classmethod
+    def from_hulls(cls, name, bodies, extra_points=(), **params):
+        points = []
+        for body in bodies:
+            vertices = list(zip(*body.geometry))
+            if len(vertices) > 1 and vertices[0] == vertices[-1]:
+                vertices.pop()  # closing point of the polygon
+            points += [(body, x_b, z_b) for x_b, z_b in vertices]
+        return cls(name, points + list(extra_points), **params)
+
+    # number of contact points
+    def __len__(self):
+        return len(self.x_b)
+
+    # states of the bodies (self.state, see weights) and world frame
+    # positions, velocities and offsets of the points (self.points)
+    def gather(self):
+        state = []
+        for body in self.bodies:
+            cp, sp, vp = math.cos(body.p), math.sin(body.p), body.vp
+            state += (body.x, body.z, body.vx, body.vz,
+                      cp, sp, vp * cp, vp * sp, vp)
+        self.state = np.asarray(state, dtype=float)
+        self.points = self.weights.dot(self.state).reshape(-1, 6)
+
+    # per point state of the batch, see GroundContactBatch.site_position
+    # and site_velocity
+    x = property(lambda self: self.state[9 * self.point_body])
+    z = property(lambda self: self.state[9 * self.point_body + 1])
+    vx = property(lambda self: self.state[9 * self.point_body + 2])
+    vz = property(lambda self: self.state[9 * self.point_body + 3])
+    vp = property(lambda self: self.state[9 * self.point_body + 8])
+    x_b2w = property(lambda self: self.points[:, 4])
+    z_b2w = property(lambda self: self.points[:, 5])
+
+    # update all contact points and put their net loads on the load
+    # sites of the bodies
+    def update(self, dt, ground_height):
+        self.ground = ground_height
+        self.gather()
+        batch = self.batch
+        base_x, base_z = self.points[:, 0], self.points[:, 1]
+        terrain = isinstance(ground_height, Terrain)
+        if terrain is True:
+            height, nx, nz = ground_height.query_array(base_x)
+        else:
+            height, nx, nz = ground_height, 0.0, 1.0
+        contact = base_z < height
+        points = contact.nonzero()[0].tolist()
+
+        if len(points) > self.SCALAR_CONTACTS:
+            batch.update(self, dt, ground_height)
+            n = len(self.bodies)
+            net_fx = np.bincount(self.point_body, self.fx, n).tolist()
+            net_fz = np.bincount(self.point_body, self.fz, n).tolist()
+            net_tau = np.bincount(self.point_body,
+                                  self.x_b2w * self.fz - self.z_b2w * self.fx,
+                                  n).tolist()
+            for ix, site in enumerate(self.sites):
+                site.fx, site.fz, site.tau = net_fx[ix], net_fz[ix], net_tau[ix]
+            self.unloaded = None
+            return
+
+        batch.base_x, batch.base_z = base_x, base_z  # for reporting
+        if terrain is True:
+            batch.ground_height, self.height = height, None
+        elif ground_height != self.height:
+            batch.ground_height = np.broadcast_to(
+                np.asarray(height, dtype=float), base_x.shape)
+            self.height = ground_height
+        if not points and batch.contact is self.unloaded:
+            batch.contact = self.unloaded = contact
+            return  # still out of contact, modes preset and no loads
+
+        # out of contact, forces vanish and sliding mode is preset
+        self.fx.fill(0.0)
+        self.fz.fill(0.0)
+        sliding_mode = batch.sliding_mode | ~contact
+        x_stick, z_stick = batch.x_stick, batch.z_stick
+        net = [[0.0, 0.0, 0.0] for _ in self.bodies]
+
+        # the points in contact like GroundContact.update, writing only
+        # to new arrays (see Integrator.stage_loads)
+        if points:
+            if terrain is True:
+                height, nx, nz = (height[points].tolist(), nx[points].tolist(),
+                                  nz[points].tolist())
+            rows = self.points[points].tolist()
+            sliding = sliding_mode.tolist()
+            stuck = False
+            for jx, ix in enumerate(points):
+                base_x, base_z, base_vx, base_vz, x_b2w, z_b2w = rows[jx]
+                if terrain is True:
+                    ground, n_x, n_z = height[jx], nx[jx], nz[jx]
+                else:
+                    ground, n_x, n_z = height, nx, nz
+
+                dist_n = (ground - base_z) * n_z
+                base_vn = base_vx * n_x + base_vz * n_z
+                base_vt = base_vx * n_z - base_vz * n_x
+                fn = self.kz * dist_n * \
+                    (1 - base_vn / self.max_vz) * (base_vn < self.max_vz)
+
+                if sliding[ix] is True:
+                    ft = - self.mu_slide * fn if base_vt > 0 \
+                        else self.mu_slide * fn
+                    if abs(base_vt) < self.v_trans:
+                        if stuck is False:
+                            x_stick, z_stick = x_stick.copy(), z_stick.copy()
+                            stuck = True
+                        sliding_mode[ix] = False
+                        x_stick[ix], z_stick[ix] = base_x, base_z
+                else:
+                    dist_t = (base_x - float(x_stick[ix])) * n_z \
+                        - (base_z - float(z_stick[ix])) * n_x
+                    ft = GroundContact.nonlin_stiction_model(
+                        dist_t, base_vt, self.kx, self.max_vx)
+                    if abs(ft) > self.mu_stick * fn:
+                        sliding_mode[ix] = True
+
+                fx, fz = ft * n_z + fn * n_x, fn * n_z - ft * n_x
+                self.fx[ix], self.fz[ix] = fx, fz
+                load = net[self.point_bodies[ix]]
+                load[0] += fx
+                load[1] += fz
+                load[2] += x_b2w * fz - z_b2w * fx
+
+        batch.contact, batch.sliding_mode = contact, sliding_mode
+        batch.x_stick, batch.z_stick = x_stick, z_stick
+        for site, (fx, fz, tau) in zip(self.sites, net):
+            site.fx, site.fz, site.tau = fx, fz, tau
+        self.unloaded = None if points else contact
+
+    # GroundContact.force_derivatives of the points in contact at the
+    # last update, as (body index, x_b2w, z_b2w, vx, vz, derivatives)
+    # with the index into self.bodies, site offset and velocity of the
+    # point
+    def force_derivatives(self, sliding_friction=False):
+        batch = self.batch
+        points = batch.contact.nonzero()[0].tolist()
+        rows = self.points[points].tolist()
+        derivatives = []
+        for jx, ix in enumerate(points):
+            _, base_z, base_vx, base_vz, x_b2w, z_b2w = rows[jx]
+            dist_x = None if batch.sliding_mode[ix] \
+                else float(batch.base_x[ix] - batch.x_stick[ix])
+            cx_pos, cx_vel, cz_pos, cz_vel = \
+                GroundContact.spring_damper_derivatives(
+                    float(batch.ground_height[ix] - base_z), base_vz,
+                    self.kz, self.max_vz, dist_x, base_vx,
+                    self.kx, self.max_vx)
+            if sliding_friction is True and dist_x is None:
+                cx_vel = GroundContact.sliding_damper(
+                    float(self.fz[ix]), base_vx, self.mu_slide, self.v_trans)
+            derivatives.append((self.point_bodies[ix],
+                                x_b2w, z_b2w, base_vx, base_vz,
+                                (cx_pos, cx_vel, cz_pos, cz_vel)))
+        return derivatives
+
+    # height and friction margins of all points, see
+    # GroundContact.switching_functions
+    def switching_functions(self, ground_height):
+        self.gather()
+        batch = self.batch
+        points = batch.contact.nonzero()[0].tolist()
+        if len(points) > self.SCALAR_CONTACTS:
+            return batch.switching_functions(self, ground_height)
+
+        base_x, base_z = self.points[:, 0], self.points[:, 1]
+        terrain = isinstance(ground_height, Terrain)
+        if terrain is True:
+            height, nx, nz = ground_height.query_array(base_x)
+            nx, nz = nx.tolist(), nz.tolist()
+        else:
+            height, nx, nz = ground_height, 0.0, 1.0
+        margin = base_z - height
+        friction = [1.0] * len(self)
+        if points:
+            heights = margin.tolist()
+            sliding = batch.sliding_mode.tolist()
+            rows = self.points[points].tolist()
+            for jx, ix in enumerate(points):
+                base_x, base_z, base_vx, base_vz, _, _ = rows[jx]
+                n_x, n_z = (nx[ix], nz[ix]) if terrain is True else (nx, nz)
+                base_vn = base_vx * n_x + base_vz * n_z
+                base_vt = base_vx * n_z - base_vz * n_x
+                if sliding[ix] is True:
+                    friction[ix] = abs(base_vt) - self.v_trans
+                    continue
+
+                fn = - self.kz * heights[ix] * n_z * \
+                    (1 - base_vn / self.max_vz) * (base_vn < self.max_vz)
+                dist_t = (base_x - float(batch.x_stick[ix])) * n_z \
+                    - (base_z - float(batch.z_stick[ix])) * n_x
+                ft = GroundContact.nonlin_stiction_model(
+                    dist_t, base_vt, self.kx, self.max_vx)
+                friction[ix] = self.mu_stick * fn - abs(ft)
+        return margin, np.array(friction)
+
+
 ######################################################################
 
 # <1>: Velocity at which horizontal friction switches from sliding
-# to stiction.
\ No newline at end of file
+# to stiction.
+
+# <2>: With the unit ground normal n = (nx, nz) and tangent
+# t = (nz, -nx), the penetration depth is (ground_height - base_z)*nz,
+# the distance to the ground line measured along its normal. The normal
+# force uses the normal site velocity and the friction force the
+# tangential velocity and the displacement from the stiction anchor
+# (x_stick, z_stick) along t. On flat ground, n = (0, 1), this is the
+# original vertical and horizontal contact model. Vertical steps of a
+# Terrain have no normal of their own: a site is pushed onto the tread
+# it is above.
+
+# <3>: numpy calls on arrays of a few dozen entries cost about a
+# microsecond each, regardless of their length, while resolving a point
+# in Python costs little more than a GroundContact update. For the 14
+# hull points of human_model, an update costs about 6 us out of contact
+# (14 GroundContacts: 7.5 us) and about 15 us plus 2 us per point in
+# contact on the ground, against about 100 us for the vectorized
+# update, which only pays off once dozens of points touch the ground.
+# The identity check on batch.contact skips updates that stay out of
+# contact; a restored snapshot brings its own contact array and is
+# resolved in full.
+
+# <4>: Explicit sliding friction flips sign whenever the tangential
+# site velocity crosses zero within a step, which at large time steps
+# rattles light bodies like the foot instead of slowing them down. As
+# a damper of coefficient mu_slide*fn/|vt| treated implicitly, the
+# friction brings the tangential velocity to (near) zero within the
+# step instead of reversing it.
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class RevoluteJoint():
     """
     Class describing a revolute joint between two bodies. 
@@ -40,58 +43,62 @@ class RevoluteJoint():
         self.q_dot_max = q_dot_max
 
     # compute joint forces and torques based on relative position, 
-    # velocity and angle between base and mate bodies
+    # velocity and angle between base and mate bodies. All of them are
+    # taken from the current body states, so the forces are a function
+    # of the system state only (dt is not used)
     def update(self, dt, tau):
 
         dist_x, dist_z = self.site_distance()
+        vel_x, vel_z = self.site_velocity()
 
         # joint forces
-        self.base.fx = self.k * dist_x \
-            + self.b * (dist_x - self.dist_x) / dt
-        self.base.fz = self.k * dist_z \
-            + self.b * (dist_z - self.dist_z) / dt
+        self.base.fx = self.k * dist_x + self.b * vel_x
+        self.base.fz = self.k * dist_z + self.b * vel_z
 
         self.mate.fx = -self.base.fx
         self.mate.fz = -self.base.fz
 
-        # update site distances, 
-        # done to calculate the velocity of the body. This uses prev timesteps positions as input
-        # to compute instantaneous velocity (which helps compute damper force)
-        self.dist_x, self.dist_z = dist_x, dist_z  # <1>
+        self.dist_x, self.dist_z = dist_x, dist_z  # for reporting
 
         # assign joint angle and torque (limit torques ensure joint angle constraints aren't violated)
-        q = self.mate_body.p - self.base_body.p # when we integrate, base body and mate body get updated 
-        # but when we call update(), self.q does not get updated as self.q is in the constructor of this class
-        # q therefore stores the current timesteps (instantaneous) joint angle whereas self.q stores the prev timesteps joint angle
-        # (i keep updating self.q)
-        q_dot = (q - self.q) / dt # joint angular velocity
+        q = self.mate_body.p - self.base_body.p
+        q_dot = self.mate_body.vp - self.base_body.vp  # joint angular velocity
         self.q = q
 
-        self.base.tau = tau
-        self.mate.tau = -tau # here the base and mate sites are updated with the newly computed joint torque and forces!
-
-        # computing joint limit torques
-        if q < self.q_min and q_dot > self.q_dot_max: # joint angle is lower than min but increasing fast to return to safe zone
-            # print('entered 1')
-            tau += 0
-        elif q < self.q_min and q_dot < self.q_dot_max: # joint angle is lower than min 
-                                                        # but increasing v-slowly/decreasing: apply restoring torque
-            self.mate.tau += self.k_lim*(self.q_min - q)*(1 - q_dot/self.q_dot_max)
-            self.base.tau -= self.k_lim*(self.q_min - q)*(1 - q_dot/self.q_dot_max)
-            # print('entered 2')
-            # print(self.mate_body.name)
-        
-        elif q > self.q_max and q_dot < -self.q_dot_max: # joint angle is > max but decreasing fast to return to safe zone
-            tau += 0
-            # print('entered 3')
-        elif q > self.q_max and q_dot > -self.q_dot_max: # joint angle is > max but decreasing slow/increasing: appluy restoring torque
-            self.mate.tau += self.k_lim*(self.q_max - q)*(1 + q_dot/self.q_dot_max)
-            self.base.tau -= self.k_lim*(self.q_max - q)*(1 + q_dot/self.q_dot_max)
-            # print('entered 4')
-            # print(self.mate_body.name)
+        # joint limit torques ensure joint angle constraints aren't violated
+        lim = self.limit_torque(q, q_dot)
+        self.base.tau = tau - lim
+        self.mate.tau = lim - tau # here the base and mate sites are updated with the newly computed joint torque and forces!
 
         self.tau = tau
  
+    # store the applied joint torque only. Used instead of update() when
+    # a reduced-coordinate solver (see articulated.py) enforces the joint
+    def set_torque(self, dt, tau):
+        self.tau = tau
+
+    # limit torque acting on the mate body (the base body gets the
+    # reaction) for joint angle q and rate q_dot
+    def limit_torque(self, q, q_dot):
+        if q < self.q_min and q_dot < self.q_dot_max: # joint angle is lower than min
+                                                      # but increasing v-slowly/decreasing: apply restoring torque
+            return self.k_lim*(self.q_min - q)*(1 - q_dot/self.q_dot_max)
+        elif q > self.q_max and q_dot > -self.q_dot_max: # joint angle is > max but decreasing slow/increasing: apply restoring torque
+            return self.k_lim*(self.q_max - q)*(1 + q_dot/self.q_dot_max)
+        # within limits, or outside but returning fast to the safe zone
+        return 0.0
+
+    # derivatives of limit_torque w.r.t. q and q_dot, used by implicit
+    # integration schemes
+    def limit_torque_derivatives(self, q, q_dot):
+        if q < self.q_min and q_dot < self.q_dot_max:
+            return (-self.k_lim*(1 - q_dot/self.q_dot_max),
+                    -self.k_lim*(self.q_min - q)/self.q_dot_max)
+        elif q > self.q_max and q_dot > -self.q_dot_max:
+            return (-self.k_lim*(1 + q_dot/self.q_dot_max),
+                    self.k_lim*(self.q_max - q)/self.q_dot_max)
+        return 0.0, 0.0
+
     # get position of the joint sites in the world frame coordinates
     def site_distance(self):
         base_x = self.base_body.x + self.base.x_b2w
@@ -99,4 +106,125 @@ class RevoluteJoint():
         mate_x = self.mate_body.x + self.mate.x_b2w
         mate_z = self.mate_body.z + self.mate.z_b2w
 
-        return mate_x - base_x, mate_z - base_z  # deltaX , deltaY
\ No newline at end of file
+        return mate_x - base_x, mate_z - base_z  # deltaX , deltaY
+
+    # relative velocity of the joint sites in the world frame, from the
+    # body velocities (v + w x r)
+    def site_velocity(self):
+        base_vx = self.base_body.vx - self.base_body.vp * self.base.z_b2w
+        base_vz = self.base_body.vz + self.base_body.vp * self.base.x_b2w
+        mate_vx = self.mate_body.vx - self.mate_body.vp * self.mate.z_b2w
+        mate_vz = self.mate_body.vz + self.mate_body.vp * self.mate.x_b2w
+
+        return mate_vx - base_vx, mate_vz - base_vz
+
+######################################################################
+class RevoluteJointBatch():
+    """
+    Batched equivalent of RevoluteJoint. A batch updates a set of
+    joints for all systems of an ensemble in one vectorized pass.
+
+    In:
+    state: array-backed state (SystemState or Ensemble) holding the
+           bodies and sites; arrays may carry a leading batch axis
+    base_body, base, mate_body, mate: index arrays into the bodies
+                                      and sites of the state
+    q_min, q_max, q_dot_max, stiffness, damping, k_lim: joint
+           parameters, broadcastable to (batch..., number of joints)
+
+    Out: n/a
+
+    The update reproduces RevoluteJoint.update element by element.
+    """
+
+    # constructor
+    def __init__(self, name, state, base_body, base, mate_body, mate,
+                 q_min, q_max, q_dot_max, stiffness, damping, k_lim):
+        self.name = name
+        self.base = np.asarray(base, dtype=np.intp)
+        self.mate = np.asarray(mate, dtype=np.intp)
+        self.base_body = np.asarray(base_body, dtype=np.intp)
+        self.mate_body = np.asarray(mate_body, dtype=np.intp)
+
+        self.k = np.asarray(stiffness, dtype=float)
+        self.b = np.asarray(damping, dtype=float)
+        self.k_lim = np.asarray(k_lim, dtype=float)
+        self.dist_x, self.dist_z = self.site_distance(state)
+
+        self.q = state.p.take(self.mate_body, -1) \
+            - state.p.take(self.base_body, -1)
+        self.tau = np.zeros_like(self.q)
+        self.q_min = np.asarray(q_min, dtype=float)
+        self.q_max = np.asarray(q_max, dtype=float)
+        self.q_dot_max = np.asarray(q_dot_max, dtype=float)
+
+    # compute joint forces and torques of all joints in the batch
+    def update(self, state, dt, tau):
+        tau = np.broadcast_to(np.asarray(tau, dtype=float), self.q.shape)
+
+        dist_x, dist_z = self.site_distance(state)
+        vel_x, vel_z = self.site_velocity(state)
+
+        # joint forces
+        fx = self.k * dist_x + self.b * vel_x
+        fz = self.k * dist_z + self.b * vel_z
+        state.fx[..., self.base] = fx
+        state.fz[..., self.base] = fz
+        state.fx[..., self.mate] = -fx
+        state.fz[..., self.mate] = -fz
+
+        self.dist_x, self.dist_z = dist_x, dist_z
+
+        # joint angle and rate
+        base_body, mate_body = self.base_body, self.mate_body
+        q = state.p.take(mate_body, -1) - state.p.take(base_body, -1)
+        q_dot = state.vp.take(mate_body, -1) - state.vp.take(base_body, -1)
+        self.q = q
+
+        # limit torques, same four cases as RevoluteJoint.update
+        lim = np.where((q < self.q_min) & (q_dot < self.q_dot_max),
+                       self.k_lim * (self.q_min - q)
+                       * (1 - q_dot / self.q_dot_max), 0.0)
+        lim = np.where((q > self.q_max) & (q_dot > -self.q_dot_max),
+                       self.k_lim * (self.q_max - q)
+                       * (1 + q_dot / self.q_dot_max), lim)
+
+        state.tau[..., self.base] = tau - lim
+        state.tau[..., self.mate] = lim - tau
+
+        self.tau = tau.copy()
+
+    # copy site distances, joint angles and torques of a batch over a
+    # single system (see SystemState.joint_batch) to its joints, which
+    # controllers, recorders and events read
+    def write_back(self, joints):
+        for joint, dist_x, dist_z, q, tau in zip(
+                joints, self.dist_x.tolist(), self.dist_z.tolist(),
+                self.q.tolist(), self.tau.tolist()):
+            joint.dist_x, joint.dist_z, joint.q, joint.tau = \
+                dist_x, dist_z, q, tau
+
+    # get distance between the joint sites in world frame coordinates.
+    # Entries are gathered with take along the last axis, which costs a
+    # fraction of indexing with [..., index]
+    def site_distance(self, state):
+        base_body, base = self.base_body, self.base
+        mate_body, mate = self.mate_body, self.mate
+        base_x = state.x.take(base_body, -1) + state.x_b2w.take(base, -1)
+        base_z = state.z.take(base_body, -1) + state.z_b2w.take(base, -1)
+        mate_x = state.x.take(mate_body, -1) + state.x_b2w.take(mate, -1)
+        mate_z = state.z.take(mate_body, -1) + state.z_b2w.take(mate, -1)
+
+        return mate_x - base_x, mate_z - base_z
+
+    # relative velocity of the joint sites in world frame coordinates
+    def site_velocity(self, state):
+        base_body, base = self.base_body, self.base
+        mate_body, mate = self.mate_body, self.mate
+        base_vp, mate_vp = state.vp.take(base_body, -1), state.vp.take(mate_body, -1)
+        base_vx = state.vx.take(base_body, -1) - base_vp * state.z_b2w.take(base, -1)
+        base_vz = state.vz.take(base_body, -1) + base_vp * state.x_b2w.take(base, -1)
+        mate_vx = state.vx.take(mate_body, -1) - mate_vp * state.z_b2w.take(mate, -1)
+        mate_vz = state.vz.take(mate_body, -1) + mate_vp * state.x_b2w.take(mate, -1)
+
+        return mate_vx - base_vx, mate_vz - base_vz
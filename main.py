@@ -1,94 +1,91 @@
-import time
+import os
 from config import human_model
+from articulated import ArticulatedBodySolver
 from control import StanceController
-from output import RbsAnimation, plot_joint_angles, plot_joint_torques, plot_grf, plot_figure_2
+from simulation import run, Observer, Stop
+from profiler import Profiler
+from recorder import Recorder
 from trackers import ContactTracker
+from terrain import Terrain
 
 # INTEGRATION PARAMETERS
 dt = 1e-4                  # [s] integration time step
 tStop = 5              # [s] simulation stop time
+SCHEME = None          # integration scheme, e.g. 'rk4' or 'implicit_euler' (stable at dt=1e-3), see integrators.SCHEMES
+REDUCED = False        # exact joints in reduced coordinates instead of penalty springs (stable up to dt=5e-3)
+GROUND = 0.0           # ground height, or uneven ground, e.g. Terrain.steps(0.05, 0.3, 5, x_start=0.2)
+CONTROL_PERIOD = 1e-3  # [s] time between controller updates, None: every step
+MUSCLE_PERIOD = None   # [s] time between muscle updates, None: every step
+STOP = [Stop.non_finite(), Stop.runaway()]  # end the run early, e.g. also Stop.trunk_below(0.5)
+PROFILE = os.environ.get('RBS_PROFILE', '0') == '1'  # print the time spent per component after the run
+
+# RENDERING PARAMETERS
+HEADLESS = os.environ.get('RBS_HEADLESS', '0') == '1'  # no matplotlib at all, e.g. on batch nodes
+RENDER_PERIOD = 0.04   # [s] time between animation frames
+RENDER_CLOCK = 'wall'  # 'wall': frame rate in wall-clock time, 'sim': in simulation time
+
+# RECORDING PARAMETERS
+JOINT_DECIMATION = 1     # record joint angles and torques every n-th step
+CONTACT_DECIMATION = 10  # record contact signals every n-th step
+STREAM_DIR = os.environ.get('RBS_STREAM_DIR')  # if set, stream recordings to this directory instead of RAM
 
 print('\033[H\033[J')  # clear screen (equivalent to Matlab 'clc')
 
 # create rigid body system
-rbs = human_model()
-
-# bodies stored in variables
-trunk = rbs.body_list[0]
-foot = rbs.body_list[3]
+rbs = human_model(array_state=False)  # True: vectorized body states (slower for small models)
+if REDUCED is True:
+    rbs.integrator = ArticulatedBodySolver(rbs)
+else:
+    rbs.set_integrator(SCHEME)
 
 ball = rbs.contact_list[0]
-ball_tracker = ContactTracker(ball)
 
-# joints stored in variables
-hip = rbs.joint_list[0]
-knee = rbs.joint_list[1]
-ankle = rbs.joint_list[2]
+# stance_ctrl = StanceController.from_system(rbs)  # pass as controller to apply stance torques
+stance_ctrl = None
 
-# stance_ctrl = StanceController(trunk.p, ankle.q, knee.q, hip.q)
+# signals recorded into preallocated buffers (or streamed to disk)
+if STREAM_DIR:
+    from stream import StreamingRecorder
+    recorder = StreamingRecorder(STREAM_DIR, dt)
+else:
+    recorder = Recorder(dt, tStop)
+recorder.add_joints(rbs, decimate=JOINT_DECIMATION)
+recorder.add_contacts(rbs, decimate=CONTACT_DECIMATION)
 
-qh, qk, qa = [hip.q], [knee.q], [ankle.q] # joint angles list, used for plotting
-tauh, tauk, taua = [hip.tau], [knee.tau], [ankle.tau] # joint torques list, used for plotting
+# the renderer observes the simulation at its own rate
+observers = []
+if HEADLESS is False:
+    from output import RbsAnimation, plot_joint_angles, plot_joint_torques, plot_grf, plot_figure_2
 
-rbs_anim = RbsAnimation(update_time_step=0.04, rigid_body_system=rbs, adaptive=True, ratio=0.1)
+    rbs_anim = RbsAnimation(update_time_step=RENDER_PERIOD, rigid_body_system=rbs,
+                            terrain=GROUND if isinstance(GROUND, Terrain) else None)
+    observers.append(Observer(rbs_anim.draw, period=RENDER_PERIOD, clock=RENDER_CLOCK))
 
 # print('moving on')
 
-start_time = time.time()
-
-t = [0.0]
-
-while t[-1] <= tStop:
-
-    # animate rbs
-    # print('going to updATE THE ANIMATION')
-    rbs_anim.update_animation(t[-1], rigid_body_system=rbs)
-
-    # append joint angles to a list for plotting
-    qh.append(hip.q)
-    qk.append(knee.q)
-    qa.append(ankle.q)
-
-    # apply controller is the foot is in stance
-    if ball.contact is True:
-        # tau_h, tau_k, tau_a = stance_ctrl.update(t[-1], dt, trunk.p, ankle.q, knee.q, hip.q)
-        tau_h, tau_k, tau_a = 0.0, 0.0, 0.0
-    else:
-        tau_h, tau_k, tau_a = 0.0, 0.0, 0.0
-
-    # print('tau_h: %4.2f, tau_k: %4.2f, tau_a: %4.2f\n' % (tau_h, tau_k, tau_a))
-
-    # Store joint torques in a list for plotting
-    tauh.append(hip.tau)
-    tauk.append(knee.tau)
-    taua.append(ankle.tau)
-
-    # update contact point
-    ball.update(dt, ground_height=0)
-    ball_tracker.append()
-
-    # print(tau_h)
-
-    # Need to update the mtc as well as the activation here!!!!!
+profiler = Profiler() if PROFILE is True else None
 
-    # update forces and torques acting at all joints
-    hip.update(dt, tau_h)
-    knee.update(dt, tau_k)
-    ankle.update(dt, tau_a)
+result = run(rbs, dt, tStop, controller=stance_ctrl, ground_height=GROUND,
+             observers=observers, recorder=recorder,
+             control_period=CONTROL_PERIOD, muscle_period=MUSCLE_PERIOD,
+             until=STOP, profiler=profiler)
 
-    # integrate a single timestep
-    for body in rbs.body_list:
-        body.integrate(dt)
-        # print('integrated')
+print('Integration time: %f sec.' % result['wall_time'])
+if result['stopped'] is True:
+    print('Stopped at t = %.4f s: %s' % (result['t_end'], result['stop_reason']))
+if profiler is not None:
+    print(profiler.table())
 
-    # print(t)
-    t.append(t[-1] + dt)
+if STREAM_DIR:
+    recorder.close()
 
-print('Integration time: %f sec.' % (time.time() - start_time))
+t = recorder.times('q_hip')
+ball_tracker = ContactTracker.from_recorder(ball, recorder)
 
-plot_joint_angles(t, qa, qk, qh)
-plot_joint_torques(t, taua, tauk, tauh)
+if HEADLESS is False:
+    plot_joint_angles(t, recorder['q_ankle'], recorder['q_knee'], recorder['q_hip'])
+    plot_joint_torques(t, recorder['tau_ankle'], recorder['tau_knee'], recorder['tau_hip'])
 
 # plot_figure_2(t, x, z, p)
 
-# ball_tracker.plot(t=t, fig_num='Ball contact point of foot segment')
\ No newline at end of file
+# ball_tracker.plot(t=recorder.times('fx_ball_contact'), fig_num='Ball contact point of foot segment')
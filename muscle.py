@@ -1,4 +1,13 @@
 import math
+from dataclasses import fields
+
+import numpy as np
+
+from interaction.params_storage import muscle_params, nervous_params
+from delay import DelayLines
+from muscle_tables import MuscleTables
+
+A_MIN = 0.01  # lower bound of the muscle activation
 
 class muscle_tendon_unit():
     """
@@ -158,4 +167,169 @@ class muscle_tendon_unit():
     
     def activation_dynamics(self, A, S, tau):
 
-        return (1/tau)*(S - A)
\ No newline at end of file
+        return (1/tau)*(S - A)
+
+
+######################################################################
+class MuscleBank():
+    """
+    Bank of muscle tendon units, all updated in one vectorized pass.
+
+    muscles is a list of (joint, muscle_params, nervous_params), one
+    entry per muscle spanning the revolute joint with joint angle
+    q = p_mate - p_base [rad]. The parameters of all muscles are stored
+    as arrays under their muscle_params and nervous_params names.
+
+    Every update computes the MTC length from the joint angles, the MTC
+    force from the series elastic element, the contractile element
+    velocity from the inverse force-velocity relationship and the
+    stimulation from force feedback, and integrates l_ce and the
+    activation A by forward Euler.
+
+    The feedback reaches the muscles after their delay delP: the MTC
+    force, the normalized length l_ce/l_opt and the normalized velocity
+    v_ce/v_max of every muscle are written to delay lines sampled every
+    feedback_period [s] (see delay.py), and their delayed values are
+    kept in F_delayed, l_delayed and v_delayed, e.g. for reflex
+    controllers. The stimulation uses F_delayed. The muscle moments d*F_mtc act on
+    the mate body and, reversed, on the base body of their joint; they
+    are summed per body onto one load site that the bank adds at the
+    body's center of mass. Muscle banks are kept in rbs.muscle_banks.
+
+    With tabulated=True the muscle curves are interpolated from lookup
+    tables with error tol instead of evaluated (see muscle_tables.py).
+    """
+
+    STATE = ('l_ce', 'A', 'dt_last')  # see snapshot.py
+
+    # constructor
+    def __init__(self, name, muscles, tabulated=False, tol=1e-6,
+                 cache_dir=None, feedback_period=1e-4):
+        self.name = name
+
+        self.bodies = []  # bodies the muscles act on
+        for joint, _, _ in muscles:
+            for body in (joint.base_body, joint.mate_body):
+                if all(other is not body for other in self.bodies):
+                    self.bodies.append(body)
+        index = {id(body): ix for ix, body in enumerate(self.bodies)}
+        self.base_ix = np.array([index[id(joint.base_body)]
+                                 for joint, _, _ in muscles], dtype=np.intp)
+        self.mate_ix = np.array([index[id(joint.mate_body)]
+                                 for joint, _, _ in muscles], dtype=np.intp)
+
+        # parameters, one entry per muscle
+        for field in fields(muscle_params):
+            setattr(self, field.name, np.array(
+                [getattr(params, field.name) for _, params, _ in muscles],
+                dtype=float))
+        for field in fields(nervous_params):
+            setattr(self, field.name, np.array(
+                [getattr(params, field.name) for _, _, params in muscles],
+                dtype=float))
+
+        # exact or tabulated muscle curves
+        self.curves = self
+        if tabulated is True:
+            self.curves = MuscleTables(self, tol, cache_dir)
+
+        # load site of every body
+        self.sites = []
+        for body in self.bodies:
+            body.add_site(name, x_b=0.0, z_b=0.0)
+            self.sites.append(body.sites[-1])
+
+        # tendon at rest length, activation at the constant stimulation
+        self.q = self.joint_angles()
+        self.l_ce = self.mtc_length(self.q) - self.l_rest
+        self.A = np.clip(self.stim0, A_MIN, 1.0)
+        self.F_mtc = np.zeros(len(muscles))
+        self.moment = np.zeros(len(muscles))  # joint moments, for logging
+
+        # delayed force, length and velocity feedback, at rest before
+        # the first update
+        self.feedback = DelayLines(
+            self.delP, feedback_period, channels=3,
+            initial=[self.F_mtc, self.l_ce / self.l_opt, np.zeros(len(muscles))])
+        self.F_delayed, self.l_delayed, self.v_delayed = \
+            self.feedback.read()
+        self.dt_last = 0.0  # time since the previous update
+
+    # number of muscles
+    def __len__(self):
+        return len(self.F_max)
+
+    # joint angles of all muscles
+    def joint_angles(self):
+        p = np.array([body.p for body in self.bodies])
+        return p[self.mate_ix] - p[self.base_ix]
+
+    # MTC lengths at joint angles q
+    def mtc_length(self, q):
+        return self.l_ref_mtc - self.d * (q - self.q_ref_mtc)
+
+    # update all muscles by one time step and apply their moments
+    def update(self, dt):
+        q = self.joint_angles()
+        l_se = self.mtc_length(q) - self.l_ce  # series elastic element
+
+        # series elastic element force (= mtc force)
+        curves = self.curves
+        self.F_mtc = self.F_max * curves.f_se(l_se / self.l_rest, self.e_ref_see)
+
+        # contractile element velocity from the force-length and the
+        # inverse force-velocity relationship
+        f_l = curves.f_l_relationship(self.l_ce / self.l_opt, self.c, self.w)
+        f_v = self.F_mtc / (self.F_max * f_l * self.A)
+        v_ce_norm = curves.f_v_inverse(f_v, self.K, self.N)
+        v_ce = self.v_max * v_ce_norm
+
+        # stimulation from delayed force feedback
+        self.feedback.push([self.F_mtc, self.l_ce / self.l_opt, v_ce_norm],
+                           self.dt_last)
+        self.F_delayed, self.l_delayed, self.v_delayed = \
+            self.feedback.read()
+        S = np.clip(self.stim0 + self.G * self.F_delayed, 0.0, 1.0)
+
+        # integrate using forward euler
+        self.l_ce = self.l_ce + v_ce * dt
+        self.A = np.maximum(
+            self.A + self.activation_dynamics(self.A, S, self.tau) * dt, A_MIN)
+        self.q = q
+        self.dt_last = dt
+
+        self.apply_moments()
+
+    # sum the muscle moments per body onto the load sites
+    def apply_moments(self):
+        n = len(self.bodies)
+        self.moment = self.d * self.F_mtc
+        net_tau = (np.bincount(self.mate_ix, self.moment, n)
+                   - np.bincount(self.base_ix, self.moment, n)).tolist()
+        for ix, site in enumerate(self.sites):
+            site.tau = net_tau[ix]
+
+    # vectorized muscle_tendon_unit.f_se
+    @staticmethod
+    def f_se(l_se_norm, e_ref_see):
+        e = l_se_norm - 1
+        return np.where(e > 0, (e / e_ref_see) ** 2, 0.0)
+
+    # vectorized muscle_tendon_unit.f_l_relationship
+    @staticmethod
+    def f_l_relationship(l_ce_norm, c, w):
+        return np.exp(c * np.abs((l_ce_norm - 1) / w) ** 3)
+
+    # vectorized muscle_tendon_unit.f_v_inverse
+    @staticmethod
+    def f_v_inverse(f_v, K, N):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            concentric = (f_v - 1) / (1 + K * f_v)
+            eccentric = (1 - f_v) / ((1 - N) + 7.56 * K * (f_v - N))
+        return np.where(f_v < 1, concentric,
+                        np.where(f_v < N, eccentric, 1.0))
+
+    # activation derivative
+    @staticmethod
+    def activation_dynamics(A, S, tau):
+        return (1 / tau) * (S - A)
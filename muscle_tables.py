@@ -0,0 +1,203 @@
+"""
+Muscle Lookup Tables
+
+Tabulated muscle curves for muscle.MuscleBank: the tendon force f_se,
+the force-length relationship f_l and the inverse force-velocity
+relationship f_v_inverse are sampled on uniform grids per set of curve
+parameters and evaluated by linear interpolation, e.g.
+
+    bank = MuscleBank('leg muscles', muscles, tabulated=True, tol=1e-6)
+
+Each table is refined until its interpolation error, measured against
+the exact curve on a grid eight times finer, is at most half the
+tolerance <1>. f_se and f_v_inverse are held to tol in absolute terms,
+f_l relative to its value, since f_v divides by it. Arguments outside
+a table fall back to the exact curve, or to the constant value the
+curve takes there.
+
+Tables are stored in a cache directory (RBS_TABLE_DIR, by default in
+the temporary directory) under a hash of the curve, its parameters and
+the tolerance, so sweeps over many models build each table once.
+
+"""
+
+import hashlib
+import math
+import os
+import tempfile
+
+import numpy as np
+
+TABLE_VERSION = 1  # part of the cache key, bump when tables change
+MIN_NODES, MAX_NODES = 257, 2**20 + 1
+REFINE = 8  # check grid per table interval
+F_L_MIN = 1e-3  # f_l is tabulated where it is at least F_L_MIN
+
+
+def default_cache_dir():
+    return os.environ.get('RBS_TABLE_DIR',
+                          os.path.join(tempfile.gettempdir(), 'rbs_tables'))
+
+
+# values of curve(x, *params) on n nodes from lo to hi such that linear
+# interpolation is within tol (relative to the curve if relative is
+# True), and the measured interpolation error
+def build_table(curve, params, lo, hi, tol, relative=False):
+    n = MIN_NODES
+    while n <= MAX_NODES:
+        x = np.linspace(lo, hi, n)
+        values = curve(x, *params)
+
+        x_check = np.linspace(lo, hi, (n - 1) * REFINE + 1)
+        exact = curve(x_check, *params)
+        error = np.abs(np.interp(x_check, x, values) - exact)
+        if relative is True:
+            error = error / np.abs(exact)
+        max_error = float(error.max())
+        if max_error <= 0.5 * tol:
+            return values, max_error
+        n = 2 * n - 1  # keeps the nodes
+
+    raise ValueError('%s: no table with %d nodes meets tol=%g'
+                     % (curve.__name__, MAX_NODES, tol))
+
+
+# table from the cache directory, built and stored if missing
+def cached_table(curve, params, lo, hi, tol, relative=False, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    key = repr((TABLE_VERSION, curve.__name__, tuple(float(p) for p in params),
+                float(lo), float(hi), float(tol), relative))
+    path = os.path.join(cache_dir, '%s_%s.npy' % (
+        curve.__name__, hashlib.sha1(key.encode()).hexdigest()[:16]))
+
+    if os.path.exists(path):
+        return np.load(path)
+
+    values, _ = build_table(curve, params, lo, hi, tol, relative)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = '%s.%d.tmp.npy' % (path[:-4], os.getpid())
+    np.save(tmp_path, values)
+    os.replace(tmp_path, path)  # atomic, for parallel sweep workers
+    return values
+
+
+######################################################################
+class CurveTable():
+    """
+    Tables of one curve for a set of muscles, stacked into one array so
+    all muscles are interpolated in one pass.
+
+    params holds one parameter array per curve argument, with one entry
+    per muscle; lo and hi give the table range per muscle. Arguments
+    below lo (above hi) take the curve value at lo (hi) if clamp_lo
+    (clamp_hi) is set, otherwise the exact curve.
+    """
+
+    # constructor
+    def __init__(self, curve, params, lo, hi, tol, relative=False,
+                 clamp_lo=False, clamp_hi=False, cache_dir=None):
+        self.curve = curve
+        self.params = [np.asarray(p, dtype=float) for p in params]
+        self.lo, self.hi = [np.array(bound, dtype=float) for bound in
+                            np.broadcast_arrays(lo, hi, self.params[0])[:2]]
+        self.clamp_lo, self.clamp_hi = clamp_lo, clamp_hi
+
+        # one table per distinct parameter set, all in one flat array
+        # with the slope of every interval; a zero slope after the last
+        # node absorbs u = n - 1
+        start = {}
+        tables, offset, n = [], [], []
+        size = 0
+        for ix in range(len(self.lo)):
+            key = (tuple(float(p[ix]) for p in self.params),
+                   float(self.lo[ix]), float(self.hi[ix]))
+            if key not in start:
+                table = cached_table(curve, key[0], key[1], key[2], tol,
+                                     relative, cache_dir)
+                start[key] = (size, len(table))
+                tables.append(table)
+                size += len(table)
+            offset.append(start[key][0])
+            n.append(start[key][1])
+
+        self.offset = np.array(offset, dtype=np.intp)
+        self.n = np.array(n)
+        self.values = np.concatenate(tables)
+        self.slopes = np.concatenate([np.append(np.diff(table), 0.0)
+                                      for table in tables])
+        self.inv_h = (self.n - 1) / (self.hi - self.lo)
+        self.u_max = (self.n - 1).astype(float)
+
+    # curve values of all muscles at x (one entry per muscle)
+    def __call__(self, x):
+        u = (x - self.lo) * self.inv_h
+        u_table = np.clip(u, 0.0, self.u_max)
+        ix = u_table.astype(np.intp)
+        flat = self.offset + ix
+        value = self.values.take(flat) + (u_table - ix) * self.slopes.take(flat)
+
+        # clamped or exact curve outside the tables
+        if self.clamp_lo is False or self.clamp_hi is False:
+            outside = ((u < 0.0) & (self.clamp_lo is False)) \
+                | ((u > self.u_max) & (self.clamp_hi is False))
+            if outside.any():
+                params = [p[outside] for p in self.params]
+                value[outside] = self.curve(x[outside], *params)
+        return value
+
+
+######################################################################
+class MuscleTables():
+    """
+    Lookup tables of f_se, f_l and f_v_inverse for the muscles of a
+    muscle.MuscleBank, with the signatures of its exact curves (the
+    curve parameters are taken from the bank).
+    """
+
+    # constructor
+    def __init__(self, bank, tol=1e-6, cache_dir=None):
+        self.tol = tol
+
+        # tendon strain up to 3 e_ref_see (9 F_max), zero when slack
+        self.se_table = CurveTable(
+            bank.f_se, [bank.e_ref_see], 1.0, 1.0 + 3.0 * bank.e_ref_see,
+            tol, clamp_lo=True, cache_dir=cache_dir)
+
+        # force-length relationship down to F_L_MIN, <2>
+        reach = bank.w * (math.log(F_L_MIN) / bank.c) ** (1.0 / 3.0)
+        self.l_table = CurveTable(
+            bank.f_l_relationship, [bank.c, bank.w], 1.0 - reach, 1.0 + reach,
+            tol, relative=True, cache_dir=cache_dir)
+
+        # inverse force-velocity relationship, constant 1 from f_v = N
+        self.v_table = CurveTable(
+            bank.f_v_inverse, [bank.K, bank.N], 0.0, bank.N, tol,
+            clamp_lo=True, clamp_hi=True, cache_dir=cache_dir)
+
+    # tabulated MuscleBank.f_se
+    def f_se(self, l_se_norm, e_ref_see):
+        return self.se_table(l_se_norm)
+
+    # tabulated MuscleBank.f_l_relationship
+    def f_l_relationship(self, l_ce_norm, c, w):
+        return self.l_table(l_ce_norm)
+
+    # tabulated MuscleBank.f_v_inverse
+    def f_v_inverse(self, f_v, K, N):
+        return self.v_table(f_v)
+
+
+######################################################################
+
+# <1>: Linear interpolation of a smooth curve errs by at most
+# h^2/8*max|f''| within an interval, so the error found on the check
+# grid is close to the true maximum, and the factor of two covers the
+# rest. At the kinks of f_se (slack tendon) and f_v_inverse (f_v = 1,
+# concentric to eccentric) the error is piecewise linear around the
+# kink and the check grid comes within 1/REFINE of an interval of it.
+
+# <2>: Below F_L_MIN the relative error of a clamped table would be
+# unbounded and f_v = F_mtc/(F_max*f_l*A) very sensitive to it, so the
+# exact curve is used there. Contractile lengths that far from l_opt
+# are rare.
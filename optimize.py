@@ -0,0 +1,279 @@
+"""
+Gain Optimization
+
+Tunes StanceController gains (and any other sweep parameter, see
+sweep.split_overrides) with CMA-ES. Every generation of candidates is
+simulated in parallel on a process pool and scored by an objective
+over the recorded trajectories, e.g.
+
+    result = optimize(['k_a', 'k_k', 'k_lean', 'qa_ref', 'qk_ref'],
+                      generations=30, t_stop=3.0)
+    controller = StanceController.from_system(rbs, **result['best'])
+
+Rollouts stop as soon as the model has fallen (see FallDetector), so
+bad candidates cost only the time until their fall. The objective is
+called in the worker as objective(result, t_stop) with the summary of
+simulation.run, including 'fallen' and, unless decimate is None,
+'trajectory'; it must be a module-level function so it can be sent to
+the workers. The default objective upright_time reads the trajectory,
+so it needs a decimate.
+
+"""
+
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from config import human_model, HUMAN_MODEL_PARAMS
+from control import StanceController
+from simulation import run, Observer
+from sweep import split_overrides
+
+
+######################################################################
+class FallDetector():
+    """
+    Observer callback (see simulation.Observer) that stops a run once a
+    human_model system has fallen: trunk center below min_trunk_z above
+    the ground, trunk lean |p| above max_lean [rad], a joint more than
+    joint_margin [rad] beyond its limits, or a non-finite body state.
+    The cause and time of the fall are kept in reason and t_fall.
+    """
+
+    def __init__(self, min_trunk_z=0.6, max_lean=1.0, joint_margin=0.5,
+                 ground_height=0.0):
+        self.min_trunk_z = min_trunk_z
+        self.max_lean = max_lean
+        self.joint_margin = joint_margin
+        self.ground_height = ground_height  # height or terrain.Terrain
+
+        self.reason = None
+        self.t_fall = None
+
+    # True if the system has fallen at time t
+    def __call__(self, t, rbs):
+        trunk = rbs.body_list[0]
+        ground = self.ground_height
+        if hasattr(ground, 'height'):
+            ground = ground.height(trunk.x)
+
+        if not all(math.isfinite(v) for b in rbs.body_list
+                   for v in (b.x, b.z, b.p, b.vx, b.vz, b.vp)):
+            self.reason = 'non-finite state'
+        elif trunk.z - ground < self.min_trunk_z:
+            self.reason = 'trunk height'
+        elif abs(trunk.p) > self.max_lean:
+            self.reason = 'trunk lean'
+        else:
+            margin = self.joint_margin
+            for joint in rbs.joint_list:
+                if joint.q < joint.q_min - margin \
+                        or joint.q > joint.q_max + margin:
+                    self.reason = joint.name + ' limit'
+                    break
+
+        if self.reason is not None:
+            self.t_fall = t
+            return True
+        return False
+
+
+######################################################################
+class CMAES():
+    """
+    Covariance matrix adaptation evolution strategy, (mu/mu_w, lambda)
+    with rank-one and rank-mu updates <1>. ask() returns a population
+    of candidates as rows, tell() takes their costs (lower is better).
+    """
+
+    def __init__(self, mean, sigma, popsize=None, seed=None):
+        self.mean = np.array(mean, dtype=float)
+        self.sigma = float(sigma)
+        n = len(self.mean)
+        self.popsize = popsize or 4 + int(3 * math.log(n))
+        self.rng = np.random.default_rng(seed)
+
+        # recombination weights of the mu best candidates
+        mu = self.popsize // 2
+        weights = math.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+        self.weights = weights / weights.sum()
+        self.mu_eff = 1.0 / np.sum(self.weights ** 2)
+
+        # learning rates and damping
+        mu_eff = self.mu_eff
+        self.cc = (4 + mu_eff / n) / (n + 4 + 2 * mu_eff / n)
+        self.cs = (mu_eff + 2) / (n + mu_eff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + mu_eff)
+        self.cmu = min(1 - self.c1, 2 * (mu_eff - 2 + 1 / mu_eff)
+                       / ((n + 2) ** 2 + mu_eff))
+        self.damps = 1 + 2 * max(0.0, math.sqrt((mu_eff - 1) / (n + 1)) - 1) \
+            + self.cs
+        self.chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+        # evolution paths and covariance C = B diag(D^2) B^T
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.C = np.eye(n)
+        self.B = np.eye(n)
+        self.D = np.ones(n)
+        self.generation = 0
+
+    # population of candidates, shape (popsize, n)
+    def ask(self):
+        z = self.rng.standard_normal((self.popsize, len(self.mean)))
+        return self.mean + self.sigma * (z * self.D) @ self.B.T
+
+    # update the distribution from candidates and their costs
+    def tell(self, candidates, costs):
+        n = len(self.mean)
+        best = np.argsort(costs)[:len(self.weights)]
+        y = (np.asarray(candidates)[best] - self.mean) / self.sigma
+        y_w = self.weights @ y
+        self.mean = self.mean + self.sigma * y_w
+        self.generation += 1
+
+        # step size path and cumulative step size adaptation
+        inv_sqrt_C = self.B @ np.diag(1 / self.D) @ self.B.T
+        self.ps = (1 - self.cs) * self.ps \
+            + math.sqrt(self.cs * (2 - self.cs) * self.mu_eff) * inv_sqrt_C @ y_w
+        ps_norm = np.linalg.norm(self.ps)
+        h_sig = ps_norm / math.sqrt(1 - (1 - self.cs) ** (2 * self.generation)) \
+            / self.chi_n < 1.4 + 2 / (n + 1)
+
+        # covariance path, rank-one and rank-mu update
+        self.pc = (1 - self.cc) * self.pc \
+            + h_sig * math.sqrt(self.cc * (2 - self.cc) * self.mu_eff) * y_w
+        self.C = (1 - self.c1 - self.cmu) * self.C \
+            + self.c1 * (np.outer(self.pc, self.pc)
+                         + (1 - h_sig) * self.cc * (2 - self.cc) * self.C) \
+            + self.cmu * (y.T * self.weights) @ y
+        self.sigma *= math.exp(self.cs / self.damps * (ps_norm / self.chi_n - 1))
+
+        C = (self.C + self.C.T) / 2
+        D2, self.B = np.linalg.eigh(C)
+        self.D = np.sqrt(np.maximum(D2, 1e-20))
+
+
+# default objective: time lost to a fall plus the mean squared trunk
+# lean, so candidates first learn not to fall and then to stay upright
+def upright_time(result, t_stop):
+    lost = t_stop - result['t_end'] if result['fallen'] else 0.0
+    return lost + float(np.mean(result['trajectory']['trunk_p'] ** 2))
+
+
+# default value of a sweep parameter
+def default_value(name):
+    if name in HUMAN_MODEL_PARAMS:
+        return HUMAN_MODEL_PARAMS[name]
+    return getattr(StanceController, name)
+
+
+# simulate and score one candidate (runs in a worker process)
+def rollout(job):
+    index, overrides, settings = job
+    model, gains = split_overrides(overrides)
+
+    rbs = human_model(**model)
+    controller = StanceController.from_system(rbs, **gains)
+    detector = FallDetector(ground_height=settings['ground_height'],
+                            **settings['fall'])
+
+    result = run(rbs, settings['dt'], settings['t_stop'],
+                 controller=controller,
+                 ground_height=settings['ground_height'],
+                 decimate=settings['decimate'],
+                 observers=[Observer(detector, period=settings['check_period'])],
+                 control_period=settings['control_period'])
+    result['fallen'] = result['stopped']
+    result['fall_reason'] = detector.reason
+
+    cost = settings['objective'](result, settings['t_stop'])
+    result.pop('trajectory', None)
+    return index, cost, result
+
+
+# minimize the objective over the parameters names (StanceController
+# gains or human_model parameters) with CMA-ES, starting from start
+# (defaults: the current values) with step size sigma relative to the
+# start values. fall holds FallDetector settings, checked every
+# check_period [s]. The trajectory is recorded every decimate steps
+# (None: not recorded, for objectives that do not need it). Returns
+# the best overrides and cost and a history of the generations
+def optimize(names, objective=upright_time, start=None, sigma=0.2,
+             generations=30, popsize=None, dt=1e-4, t_stop=3.0,
+             ground_height=0.0, decimate=10, fall=None, check_period=1e-3,
+             control_period=None, max_workers=None, seed=None, verbose=False):
+
+    if objective is upright_time and not decimate:
+        raise ValueError('upright_time needs the trajectory, set decimate')
+
+    names = list(names)
+    unknown = [name for name in names if name not in HUMAN_MODEL_PARAMS
+               and name not in StanceController.GAINS]
+    if unknown:
+        raise ValueError('unknown parameters: %s' % ', '.join(unknown))
+
+    start = dict(start or {})
+    x0 = np.array([start.get(name, default_value(name)) for name in names],
+                  dtype=float)
+
+    # search in coordinates scaled by the start values
+    scale = np.where(x0 != 0.0, np.abs(x0), 1.0)
+    es = CMAES(np.zeros(len(names)), sigma, popsize, seed)
+
+    settings = {'dt': dt, 't_stop': t_stop, 'ground_height': ground_height,
+                'decimate': decimate, 'fall': dict(fall or {}),
+                'check_period': check_period,
+                'control_period': control_period, 'objective': objective}
+
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    max_workers = max(1, min(max_workers, es.popsize))
+
+    best, best_cost = dict(zip(names, x0.tolist())), math.inf
+    history = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for generation in range(generations):
+            start_time = time.time()
+            population = es.ask()
+            candidates = [dict(zip(names, (x0 + scale * z).tolist()))
+                          for z in population]
+            jobs = [(ix, overrides, settings)
+                    for ix, overrides in enumerate(candidates)]
+
+            costs = np.empty(len(jobs))
+            sim_time, falls = 0.0, 0
+            for ix, cost, result in pool.map(rollout, jobs):
+                costs[ix] = cost
+                sim_time += result['t_end']
+                falls += result['fallen']
+            es.tell(population, costs)
+
+            ix = int(np.argmin(costs))
+            if costs[ix] < best_cost:
+                best, best_cost = candidates[ix], float(costs[ix])
+
+            history.append({'generation': generation,
+                            'best_cost': float(costs[ix]),
+                            'mean_cost': float(costs.mean()),
+                            'sigma': es.sigma, 'falls': falls,
+                            'sim_time': sim_time,
+                            'wall_time': time.time() - start_time})
+            if verbose:
+                print('generation %d: best %.4g, mean %.4g, %d falls, '
+                      '%.1f s simulated in %.1f s'
+                      % (generation, costs[ix], costs.mean(), falls,
+                         sim_time, history[-1]['wall_time']))
+
+    return {'best': best, 'best_cost': best_cost, 'history': history}
+
+
+######################################################################
+
+# <1>: After N. Hansen, The CMA Evolution Strategy: A Tutorial
+# (arXiv:1604.00772), with the default population size and weights.
+# The search runs in coordinates x = x0 + scale * z, so one sigma
+# covers gains and reference angles of very different magnitudes.
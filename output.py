@@ -1,5 +1,5 @@
 import time
-import math
+import numpy as np
 import matplotlib.pyplot as plt
 
 
@@ -7,7 +7,8 @@ class RbsAnimation:
     """Rigid Body System Simulation"""
 
     # constructor
-    def __init__(self, update_time_step, rigid_body_system, adaptive=False, ratio=1):
+    def __init__(self, update_time_step, rigid_body_system, adaptive=False, ratio=1,
+                 terrain=None):
 
         self.time_step = update_time_step
         self.next_time = 0.0
@@ -30,8 +31,11 @@ class RbsAnimation:
 
         # fig.tight_layout()
 
-        # add horizontal line
-        ax.plot([-1000, 1000], [0, 0], color=[0.5, 0.5, 0.5], lw=1)
+        # add horizontal line, or the profile of an uneven terrain
+        if terrain is None:
+            ax.plot([-1000, 1000], [0, 0], color=[0.5, 0.5, 0.5], lw=1)
+        else:
+            ax.plot(*terrain.profile(-1000, 1000), color=[0.5, 0.5, 0.5], lw=1)
         self.ax = ax
 
         # add ground and rigid body line objects
@@ -50,18 +54,7 @@ class RbsAnimation:
 
         if t >= self.next_time:
 
-            for ix in range(len(self.body_lines)):
-                body = rigid_body_system.body_list[ix]
-                x_w, z_w = body.update_body_geometry()
-
-                line = self.body_lines[ix]
-                # print(line)
-                line.set_data(x_w, z_w)
-
-            # force figure update
-            self.fig.canvas.draw_idle()  # schedule gui to redraw
-            self.fig.canvas.flush_events()  # flush gui events
-            # time.sleep(0.00005)  # Simulate a delay
+            self.draw(t, rigid_body_system)
 
             # update next time
             if self.adaptive is True:
@@ -76,6 +69,23 @@ class RbsAnimation:
 
             self.next_time = t + self.time_step
 
+    # draw the current configuration unconditionally. Used as the
+    # callback of a simulation.Observer, which decides when to render
+    def draw(self, t, rigid_body_system):
+
+        for ix in range(len(self.body_lines)):
+            body = rigid_body_system.body_list[ix]
+            x_w, z_w = body.update_body_geometry()
+
+            line = self.body_lines[ix]
+            # print(line)
+            line.set_data(x_w, z_w)
+
+        # force figure update
+        self.fig.canvas.draw_idle()  # schedule gui to redraw
+        self.fig.canvas.flush_events()  # flush gui events
+        # time.sleep(0.00005)  # Simulate a delay
+
 ######################################################################
 
 def plot_figure_2(t, x, z, p):
@@ -90,7 +100,7 @@ def plot_figure_2(t, x, z, p):
     axs[0].set(xlabel='x (m)', ylabel='z (m)')
 
     # plot orientation
-    p_deg = [angle * 180 / math.pi for angle in p]
+    p_deg = np.degrees(p)
     axs[1].plot(t, p_deg, 'k', linewidth=2)
     axs[1].set(xlabel='time (s)', ylabel='pitch (deg)')
 
@@ -105,7 +115,7 @@ def plot_grf(t, grf_x, grf_z, slide_flag):
     ax = plt.axes(xlabel='t (s)', ylabel='GRF (N)')
     ax.plot(t, grf_x, 'k', lw=2)
     ax.plot(t, grf_z, 'r', lw=2)
-    slide_flag_100 = [flag * 100 for flag in slide_flag]
+    slide_flag_100 = np.asarray(slide_flag) * 100
     ax.plot(t, slide_flag_100, 'b', lw=1)
 
     ax.set(ylim=(-200, 2000))
@@ -122,15 +132,15 @@ def plot_joint_angles(t, qa, qk, qh):
     _, axs = plt.subplots(3, 1, num=4)
 
     # hip angle
-    qh_deg = [angle * 180 / math.pi for angle in qh]
+    qh_deg = np.degrees(qh)
     axs[0].plot(t, qh_deg, 'k', lw=2)
     axs[0].set(ylabel='hip angle (deg)')
 
-    qk_deg = [angle * 180 / math.pi for angle in qk]
+    qk_deg = np.degrees(qk)
     axs[1].plot(t, qk_deg, 'k', lw=2)
     axs[1].set(ylabel='knee angle (deg)')
 
-    qa_deg = [angle * 180 / math.pi for angle in qa]
+    qa_deg = np.degrees(qa)
     axs[2].plot(t, qa_deg, 'k', lw=2)
     axs[2].set(xlabel='time (s)', ylabel='ankle angle (deg)')
 
@@ -154,4 +164,12 @@ def plot_joint_torques(t, taua, tauk, tauh):
     axs[2].plot(t, taua, 'k', lw=2)
     axs[2].set(xlabel='time (s)', ylabel='ankle torque (Nm)')
 
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+
+# plot joint angles and torques from a recorder.Recorder, or lazily
+# from a stream.Recording or RecordingView
+def plot_recorded_joints(recording):
+    t = recording.times('q_hip')
+    plot_joint_angles(t, recording['q_ankle'], recording['q_knee'], recording['q_hip'])
+    plot_joint_torques(t, recording['tau_ankle'], recording['tau_knee'], recording['tau_hip'])
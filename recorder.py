@@ -0,0 +1,141 @@
+"""
+Trajectory Recorder
+
+Records selected signals of a running simulation into preallocated
+NumPy buffers. Every channel has its own decimation factor; channels
+with the same factor are sampled together by one simulation.Observer
+(see simulation.run), so the physics loop only breaks out when a
+sample is due. The buffers are sized from the simulated time span,
+e.g.
+
+    recorder = Recorder(dt=1e-4, t_stop=5.0)
+    recorder.add_joints(rbs, decimate=10)
+    recorder.add_contacts(rbs)
+    run(rbs, dt, t_stop, recorder=recorder)
+    q_hip = recorder['q_hip']
+    t = recorder.times('q_hip')
+
+"""
+
+import numpy as np
+
+
+class Recorder():
+    """
+    Channel-based trajectory recorder.
+
+    A channel is a name, a getter called without arguments that
+    returns the current value (a scalar, or a sequence of fixed width),
+    and a decimation factor: the channel is sampled on every
+    decimate-th physics step.
+    """
+
+    def __init__(self, dt, t_stop):
+        self.dt = dt
+        self.n_steps = int(round(t_stop / dt)) + 1  # steps taken by run()
+
+        self.channels = {}  # name -> [getter, buffer, decimate]
+        self.groups = {}    # decimate -> names of channels sampled together
+        self.t = {}         # decimate -> buffer of sample times
+        self.count = {}     # decimate -> number of samples recorded
+
+    # register a channel. width=None records scalars, otherwise rows
+    # of width values
+    def add_channel(self, name, getter, decimate=1, width=None, dtype=float):
+        if name in self.channels:
+            raise ValueError('channel %s already exists' % name)
+
+        n = self.buffer_length(decimate)
+        shape = (n,) if width is None else (n, width)
+        self.channels[name] = [getter, np.zeros(shape, dtype=dtype), decimate]
+
+        if decimate not in self.groups:
+            self.groups[decimate] = []
+            self.t[decimate] = np.zeros(n)
+            self.count[decimate] = 0
+        self.groups[decimate].append(name)
+
+    # number of samples buffered for a decimation factor
+    def buffer_length(self, decimate):
+        return (self.n_steps - 1) // decimate + 1
+
+    # joint angle and torque of every joint: q_<joint>, tau_<joint>
+    def add_joints(self, rbs, decimate=1):
+        for joint in rbs.joint_list:
+            self.add_channel('q_' + joint.name,
+                             lambda joint=joint: joint.q, decimate)
+            self.add_channel('tau_' + joint.name,
+                             lambda joint=joint: joint.tau, decimate)
+
+    # state (x, z, p, vx, vz, vp) of every body: <body>
+    def add_bodies(self, rbs, decimate=1):
+        for body in rbs.body_list:
+            self.add_channel(body.name,
+                             lambda b=body: (b.x, b.z, b.p, b.vx, b.vz, b.vp),
+                             decimate, width=6)
+
+    # ground reaction forces, contact and sliding flags, stiction
+    # distance, site height and ground height of every contact (the
+    # signals of trackers.ContactTracker): fx_<contact>, fz_<contact>, ...
+    def add_contacts(self, rbs, decimate=1):
+        for contact in rbs.contact_list:
+            name = contact.name.replace(' ', '_')
+            for channel, getter, dtype in (
+                    ('fx_', lambda c=contact: c.base.fx, float),
+                    ('fz_', lambda c=contact: c.base.fz, float),
+                    ('contact_', lambda c=contact: c.contact, bool),
+                    ('sliding_', lambda c=contact: c.sliding_mode, bool),
+                    ('dist_x_', lambda c=contact: c.base_x - c.x_stick, float),
+                    ('base_z_', lambda c=contact: c.base_z, float),
+                    ('ground_height_', lambda c=contact: c.ground_height,
+                     float)):
+                self.add_channel(channel + name, getter, decimate, dtype=dtype)
+
+    # (decimate, callback) pairs, one per decimation factor, which
+    # simulation.run attaches as observers
+    def samplers(self):
+        return [(decimate, self.sampler(decimate)) for decimate in self.groups]
+
+    # sampling callback for all channels sharing a decimation factor
+    def sampler(self, decimate):
+        channels = [self.channels[name] for name in self.groups[decimate]]
+
+        def sample(t, rbs):
+            k = self.count[decimate]
+            if k == len(self.t[decimate]):
+                self.grow(decimate)
+                k = self.count[decimate]
+            self.t[decimate][k] = t
+            for channel in channels:
+                channel[1][k] = channel[0]()
+            self.count[decimate] = k + 1
+
+        return sample
+
+    # double the buffers of a group if a run lasts longer than planned
+    def grow(self, decimate):
+        self.t[decimate] = np.concatenate(
+            (self.t[decimate], np.zeros_like(self.t[decimate])))
+        for name in self.groups[decimate]:
+            channel = self.channels[name]
+            channel[1] = np.concatenate((channel[1], np.zeros_like(channel[1])))
+
+    # recorded samples of a channel
+    def __getitem__(self, name):
+        _, buffer, decimate = self.channels[name]
+        return buffer[:self.count[decimate]]
+
+    # sample times of a channel
+    def times(self, name):
+        decimate = self.channels[name][2]
+        return self.t[decimate][:self.count[decimate]]
+
+    # all recorded channels as a dict of arrays
+    def arrays(self):
+        return {name: self[name] for name in self.channels}
+
+    # memory held by the buffers in bytes
+    @property
+    def nbytes(self):
+        return sum(channel[1].nbytes for channel in self.channels.values()) \
+            + sum(t.nbytes for t in self.t.values())
@@ -0,0 +1,612 @@
+"""
+Headless Simulation
+
+Runs the physics loop of main.py without any plotting or animation,
+e.g. for batch jobs and parameter sweeps. A run returns summary
+metrics and, optionally, decimated trajectories. Arbitrary signals
+can be recorded by passing a recorder.Recorder.
+
+Anything that has to look at the system while it runs (animation,
+trackers, ...) is attached as an Observer. Observers are called at
+their own rate; in between, run() advances the physics in tight blocks
+of steps without any per-step checks for them.
+
+The controller and the muscle banks can be scheduled the same way, e.g.
+at 1 kHz while the physics runs at 10 kHz:
+
+    run(rbs, 1e-4, 5.0, controller=ctrl, control_period=1e-3,
+        muscle_period=1e-3, observers=[Observer(draw, period=0.04)])
+
+Between their updates, the moments of scheduled muscle banks are held
+and the torques of a scheduled controller follow its torque rates if
+it has any (system_rates, e.g. the ramp of StanceController), else
+they are held too. Without a period both are updated at every physics
+step.
+
+A run ends early when one of its Stop conditions holds, or when an
+event callback (touchdown, liftoff, joint limit entry) returns True:
+
+    run(rbs, dt, 5.0, until=[Stop.non_finite(), Stop.trunk_below(0.5),
+                             Stop.touchdowns(3)],
+        events={'touchdown': lambda t, rbs, contact: print(t)})
+
+A Simulator keeps a system together with its time step and the
+options of run(), and advances it step by step or in runs that
+continue from the current time:
+
+    sim = Simulator(rbs, dt, controller=ctrl, recorder=recorder,
+                    control_period=1e-3, until=[Stop.trunk_below(0.5)])
+    sim.step(1000)                        # 1000 steps in a tight loop
+    summary = sim.run(2.0)
+
+"""
+
+import copy
+import math
+import time
+
+from recorder import Recorder
+
+
+class Observer():
+    """
+    Callback invoked by run() as callback(t, rigid_body_system). A
+    callback that returns True ends the run before the step at t.
+
+    The rate is given either as a number of physics steps (every), or
+    as a period in simulation time (clock='sim') or in wall-clock time
+    (clock='wall'). For the wall clock, the number of steps until the
+    next call is estimated from the measured simulation speed.
+    """
+
+    def __init__(self, callback, period=None, clock='sim', every=None):
+        if (period is None) == (every is None):
+            raise ValueError('give either period or every')
+        if clock not in ('sim', 'wall'):
+            raise ValueError("clock must be 'sim' or 'wall'")
+
+        self.callback = callback
+        self.period = period
+        self.clock = clock
+        self.every = every
+
+        self.next_step = 0  # step index at which the next call is due
+        self.last_step = 0
+        self.last_wall_time = None
+
+    # call the observer and schedule its next call. Returns the result
+    # of the callback
+    def notify(self, step, dt, rigid_body_system):
+        result = self.callback(step * dt, rigid_body_system)
+
+        if self.every is not None:
+            steps = self.every
+        elif self.clock == 'sim':
+            steps = round(self.period / dt)
+        else:
+            wall_time = time.time()
+            if self.last_wall_time is None or step == self.last_step:
+                steps = 100  # first guess until the speed is known
+            else:
+                steps_per_sec = (step - self.last_step) \
+                    / max(wall_time - self.last_wall_time, 1e-9)
+                steps = self.period * steps_per_sec
+            self.last_wall_time = wall_time
+
+        self.last_step = step
+        self.next_step = step + max(1, int(steps))
+        return result
+
+
+class Stop():
+    """
+    Termination condition for run(until=...). predicate(t, rigid_body_system)
+    is checked after every step and ends the run when it returns True;
+    start(rigid_body_system), if given, is called once before the run.
+    The run summary names the condition in 'stop_reason'.
+    """
+
+    def __init__(self, name, predicate, start=None):
+        self.name = name
+        self.predicate = predicate
+        self.start = start
+
+    # trunk center below height above the ground (a height or a
+    # terrain.Terrain)
+    @classmethod
+    def trunk_below(cls, height, ground_height=0.0):
+        if hasattr(ground_height, 'height'):
+            def predicate(t, rbs):
+                trunk = rbs.body_list[0]
+                return trunk.z - ground_height.height(trunk.x) < height
+        else:
+            limit = ground_height + height
+
+            def predicate(t, rbs):
+                return rbs.body_list[0].z < limit
+        return cls('trunk below %g' % height, predicate)
+
+    # n touchdowns of a contact point (index into rbs.contact_list)
+    # since the start of the run
+    @classmethod
+    def touchdowns(cls, n, contact=0):
+        state = {'count': 0, 'contact': None}
+
+        def start(rbs):
+            state['count'] = 0
+            state['contact'] = rbs.contact_list[contact].contact
+
+        def predicate(t, rbs):
+            in_contact = rbs.contact_list[contact].contact
+            if in_contact is True and state['contact'] is False:
+                state['count'] += 1
+            state['contact'] = in_contact
+            return state['count'] >= n
+        return cls('%d touchdowns' % n, predicate, start)
+
+    # NaN or infinite body state
+    @classmethod
+    def non_finite(cls):
+        bodies = []
+
+        def start(rbs):
+            bodies[:] = rbs.body_list
+
+        # a NaN or infinity anywhere makes the sum non-finite
+        def predicate(t, rbs):
+            total = 0.0
+            for b in bodies:
+                total += b.x + b.z + b.p + b.vx + b.vz + b.vp
+            return not math.isfinite(total)
+        return cls('non-finite state', predicate, start)
+
+    # runaway body speed [m/s] or angular rate [rad/s]
+    @classmethod
+    def runaway(cls, max_speed=100.0, max_rate=1000.0):
+        max_speed_2 = max_speed * max_speed
+        bodies = []
+
+        def start(rbs):
+            bodies[:] = rbs.body_list
+
+        def predicate(t, rbs):
+            for b in bodies:
+                if b.vx * b.vx + b.vz * b.vz > max_speed_2 \
+                        or abs(b.vp) > max_rate:
+                    return True
+            return False
+        return cls('runaway velocity', predicate, start)
+
+
+EVENTS = ('touchdown', 'liftoff', 'joint_limit')  # see run()
+
+
+# compile the physics loop of a rigid body system into advance(first,
+# last), which takes steps first, ..., last - 1 and returns the next
+# step and the reason if a Stop condition or an event ended it early.
+# Returns the observers to call between blocks of steps (the scheduled
+# controller and muscle banks first), advance and the summary metrics
+# it keeps up to date. Options as for run(); shared by run() and
+# Simulator, so both take steps the same way
+def compile_steps(rbs, dt, controller=None, ground_height=0.0, observers=(),
+                  broadphase=None, control_period=None, muscle_period=None,
+                  until=(), events=None, profiler=None):
+
+    trunk = rbs.body_list[0]
+    joints = rbs.joint_list
+    contacts = rbs.contact_list
+    contact_sets = rbs.contact_sets
+    muscle_banks = rbs.muscle_banks
+    zero_torques = [0.0] * len(joints)
+
+    # a reduced-coordinate solver (articulated.py) enforces the joints
+    # itself and only needs the applied torques. With an array state
+    # (RigidBodySystem(array_state=True)) all joints are updated in one
+    # batch over the state arrays instead, <1>
+    joint_batch = None
+    if getattr(rbs.integrator, 'reduced_coordinates', False):
+        joint_updates = [joint.set_torque for joint in joints]
+    elif rbs.state is not None and joints:
+        joint_batch = rbs.state.joint_batch(joints)
+        joint_updates = []
+    else:
+        joint_updates = [joint.update for joint in joints]
+    contact_updates = [contact.update for contact in contacts] \
+        + [contact_set.update for contact_set in contact_sets]
+    integrate = rbs.integrate
+
+    if joint_batch is not None:
+        def update_joints(dt, torques, state=rbs.state):
+            joint_batch.update(state, dt, torques)
+            joint_batch.write_back(joints)
+
+    # summary metrics
+    metrics = {'min_trunk_z': trunk.z, 'max_trunk_z': trunk.z,
+               'max_grf_z': 0.0, 'touchdowns': 0}
+    in_contact = [c.contact for c in contacts]
+
+    # termination conditions and event callbacks
+    stops = list(until)
+    for condition in stops:
+        if condition.start is not None:
+            condition.start(rbs)
+    events = dict(events or {})
+    unknown = set(events) - set(EVENTS)
+    if unknown:
+        raise ValueError('unknown events: %s' % ', '.join(sorted(unknown)))
+    on_touchdown = events.get('touchdown')
+    on_liftoff = events.get('liftoff')
+    on_joint_limit = events.get('joint_limit')
+    in_range = [joint.q_min <= joint.q <= joint.q_max for joint in joints]
+
+    # scheduled controller and muscle banks, called before the observers
+    # of the same step so those see the updated torques and moments
+    held_torques = zero_torques
+    held_rates = None  # torque rates [Nm/s] from held_time on
+    held_time = [0.0]
+    system_update = None if controller is None else controller.system_update
+    scheduled = []
+    if controller is not None and control_period is not None:
+        held_torques = list(zero_torques)
+        system_update = None
+        system_rates = getattr(controller, 'system_rates', None)
+        if system_rates is not None:
+            held_rates = list(zero_torques)
+
+        control_steps = max(1, round(control_period / dt))
+
+        def control(t, rbs, period=control_steps * dt):
+            held_torques[:] = controller.system_update(t, period, rbs)
+            if held_rates is not None:
+                held_rates[:] = system_rates(rbs)
+                held_time[0] = t
+        scheduled.append(Observer(control, every=control_steps))
+
+    if muscle_banks and muscle_period is not None:
+        muscle_steps = max(1, round(muscle_period / dt))
+
+        def update_muscles(t, rbs, banks=muscle_banks,
+                           period=muscle_steps * dt):
+            for muscle_bank in banks:
+                muscle_bank.update(period)
+        scheduled.append(Observer(update_muscles, every=muscle_steps))
+        muscle_banks = []  # not updated at every step
+    muscle_updates = [muscle_bank.update for muscle_bank in muscle_banks]
+
+    observers = scheduled + list(observers)
+
+    # time every component by wrapping its update, on copies of the
+    # observers and conditions
+    broadphase_update = None if broadphase is None else broadphase.update
+    if profiler is not None:
+        timed = profiler.timed
+        if broadphase_update is None:
+            names = [c.name for c in contacts] + [c.name for c in contact_sets]
+            contact_updates = [timed('contact/' + name, update)
+                               for name, update in zip(names, contact_updates)]
+        else:
+            # the contacts the broadphase does not skip, by name; its
+            # culling counts as loop overhead
+            timed_updates = [timed('contact/' + c.name, c.update)
+                             for c in broadphase.contacts]
+
+            def broadphase_update(t, dt, ground_height,
+                                  update=broadphase.update):
+                update(t, dt, ground_height, timed_updates)
+        joint_updates = [timed('joint/' + joint.name, update)
+                         for joint, update in zip(joints, joint_updates)]
+        if joint_batch is not None:
+            update_joints = timed('joint/' + joint_batch.name, update_joints)
+        muscle_updates = [timed('muscles/' + bank.name, update)
+                          for bank, update in zip(muscle_banks, muscle_updates)]
+        integrate = timed('integrate', integrate)
+        if system_update is not None:
+            system_update = timed('controller', system_update)
+
+        for ix, observer in enumerate(observers):
+            observer = observers[ix] = copy.copy(observer)
+            name = getattr(observer.callback, '__qualname__',
+                           type(observer.callback).__name__)
+            name = {'compile_steps.<locals>.control': 'controller/scheduled',
+                    'compile_steps.<locals>.update_muscles': 'muscles/scheduled',
+                    'Recorder.sampler.<locals>.sample': 'recorder/every %s'
+                    % observer.every}.get(name, 'observer/' + name)
+            observer.callback = timed(name, observer.callback)
+        stops = [Stop(condition.name,
+                      timed('stop/' + condition.name, condition.predicate))
+                 for condition in stops]
+        for name, callback in events.items():
+            events[name] = timed('event/' + name, callback)
+        on_touchdown = events.get('touchdown')
+        on_liftoff = events.get('liftoff')
+        on_joint_limit = events.get('joint_limit')
+
+    # advance the physics over steps first, ..., last - 1. Returns the
+    # next step and the reason if a condition or event ended the run
+    def advance(first, last):
+        min_trunk_z, max_trunk_z = metrics['min_trunk_z'], metrics['max_trunk_z']
+        max_grf_z, touchdowns = metrics['max_grf_z'], metrics['touchdowns']
+        reason = None
+
+        for step in range(first, last):
+            t = step * dt
+
+            # joint torques from the controller, or held (or ramped)
+            # from its last scheduled update
+            if system_update is not None:
+                torques = system_update(t, dt, rbs)
+            elif held_rates is None:
+                torques = held_torques
+            else:
+                delta_t = t - held_time[0]
+                torques = [tau + delta_t * rate
+                           for tau, rate in zip(held_torques, held_rates)]
+
+            # update contact points and joints, then integrate
+            if broadphase_update is None:
+                for update in contact_updates:
+                    update(dt, ground_height)
+            else:
+                broadphase_update(t, dt, ground_height)
+
+            for ix, contact in enumerate(contacts):
+                if contact.contact is True:
+                    if in_contact[ix] is False:
+                        touchdowns += 1
+                        if on_touchdown is not None \
+                                and on_touchdown(t, rbs, contact) is True:
+                            reason = 'touchdown'
+                    max_grf_z = max(max_grf_z, contact.base.fz)
+                elif in_contact[ix] is True and on_liftoff is not None \
+                        and on_liftoff(t, rbs, contact) is True:
+                    reason = 'liftoff'
+                in_contact[ix] = contact.contact
+
+            if joint_batch is None:
+                for update, tau in zip(joint_updates, torques):
+                    update(dt, tau)
+            else:
+                update_joints(dt, torques)
+            for update in muscle_updates:
+                update(dt)
+
+            if on_joint_limit is not None:
+                for ix, joint in enumerate(joints):
+                    inside = joint.q_min <= joint.q <= joint.q_max
+                    if inside is False and in_range[ix] is True \
+                            and on_joint_limit(t, rbs, joint) is True:
+                        reason = 'joint_limit'
+                    in_range[ix] = inside
+
+            integrate(dt)
+
+            min_trunk_z = min(min_trunk_z, trunk.z)
+            max_trunk_z = max(max_trunk_z, trunk.z)
+
+            for condition in stops:
+                if condition.predicate(t + dt, rbs) is True:
+                    reason = condition.name
+            if reason is not None:
+                last = step + 1
+                break
+
+        metrics.update(min_trunk_z=min_trunk_z, max_trunk_z=max_trunk_z,
+                       max_grf_z=max_grf_z, touchdowns=touchdowns)
+        return last, reason
+
+    return observers, advance, metrics
+
+
+# simulate a rigid body system from t_start to t_stop. If given, the
+# controller (see StanceController.system_update) provides the joint
+# torques and the recorder samples its channels. ground_height is a
+# height or a terrain.Terrain. Every decimate-th step of trunk state,
+# joint angles and torques and vertical GRFs is returned as
+# 'trajectory' when decimate is set. A broadphase (see broadphase.py)
+# skips contact updates in flight and adds its counters to the summary.
+# control_period and muscle_period [s] schedule the controller and the
+# muscle banks at a lower rate than the physics (multiples of dt); in
+# between, controller torques are ramped with controller.system_rates
+# if it has that method, otherwise held like the muscle moments. An
+# observer returning True stops the run early ('stopped' in the summary),
+# as do the Stop conditions in until, checked after every step. events
+# maps names of EVENTS to callbacks(t, rbs, contact or joint) called at
+# the step where a contact touches down or lifts off or a joint leaves
+# its range [q_min, q_max]; a callback returning True ends the run after
+# that step. A profiler.Profiler times every component of the run.
+# Steps are taken at t_start, t_start + dt, ..., t_stop, so a run
+# continues where an earlier one to t_stop ended with t_start=t_stop + dt
+def run(rbs, dt, t_stop, controller=None, ground_height=0.0, decimate=None,
+        observers=(), recorder=None, t_start=0.0, broadphase=None,
+        control_period=None, muscle_period=None, until=(), events=None,
+        profiler=None):
+
+    trunk = rbs.body_list[0]
+    first_step = int(round(t_start / dt))
+    n_steps = int(round(t_stop / dt))
+
+    observers = list(observers)
+    if decimate:
+        trajectory = Recorder(dt, t_stop)
+        for name in ('x', 'z', 'p'):
+            trajectory.add_channel('trunk_' + name,
+                                   lambda name=name: getattr(trunk, name),
+                                   decimate)
+        trajectory.add_joints(rbs, decimate)
+        for contact in rbs.contact_list:
+            trajectory.add_channel('fz_' + contact.name.replace(' ', '_'),
+                                   lambda c=contact: c.base.fz, decimate)
+
+    for rec in (recorder, trajectory if decimate else None):
+        if rec is not None:
+            observers += [Observer(callback, every=every)
+                          for every, callback in rec.samplers()]
+
+    observers, advance, metrics = compile_steps(
+        rbs, dt, controller, ground_height, observers, broadphase,
+        control_period, muscle_period, until, events, profiler)
+    for observer in observers:
+        observer.next_step = first_step
+
+    start_time = time.time()
+    step = first_step
+    stop_reason = None
+    while step <= n_steps and stop_reason is None:
+        # call observers that are due, then run up to the next one
+        stop = n_steps + 1
+        for observer in observers:
+            if observer.next_step <= step \
+                    and observer.notify(step, dt, rbs) is True:
+                stop_reason = 'observer'
+            stop = min(stop, observer.next_step)
+
+        if stop_reason is None:
+            step, stop_reason = advance(step, stop)
+
+    if profiler is not None:
+        profiler.add_run(step - first_step, time.time() - start_time)
+
+    summary = {
+        't_end': (step - 1) * dt,
+        'steps': step - first_step,
+        'stopped': stop_reason is not None,
+        'stop_reason': stop_reason,
+        'wall_time': time.time() - start_time,
+        'finite': all(math.isfinite(v) for b in rbs.body_list
+                      for v in (b.x, b.z, b.p, b.vx, b.vz, b.vp)),
+        'trunk_x_end': trunk.x,
+        'trunk_z_end': trunk.z,
+        'trunk_p_end': trunk.p,
+    }
+    summary.update(metrics)
+    if broadphase is not None:
+        summary.update(broadphase.summary())
+
+    if decimate:
+        summary['trajectory'] = dict(t=trajectory.times('trunk_x'),
+                                     **trajectory.arrays())
+
+    return summary
+
+
+######################################################################
+class Simulator():
+    """
+    Stateful entry point to a rigid body system stepped with time step
+    dt, starting at time t, with the options of run() (controller,
+    ground, broadphase, scheduling, stop conditions, events, profiler).
+
+    compile() builds the physics loop with compile_steps(), the same
+    one run() uses, so step(n) takes n steps exactly like run() would,
+    breaking out of its tight loop only when an observer (or recorder
+    sample) is due, and honours all options. run() simulates up to a
+    time and returns the summary of simulation.run.
+
+    After changing the system (bodies, joints, contacts, muscle banks
+    or the integrator) call compile() again; the hooks (set_controller,
+    add_observer, add_recorder) do so themselves. Compiling restarts
+    the observers, the stop conditions and the summary metrics at the
+    current step.
+    """
+
+    def __init__(self, rbs, dt, controller=None, ground_height=0.0,
+                 recorder=None, observers=(), broadphase=None, t=0.0,
+                 control_period=None, muscle_period=None, until=(),
+                 events=None, profiler=None):
+        self.rbs = rbs
+        self.dt = dt
+        self.controller = controller
+        self.ground_height = ground_height  # height or terrain.Terrain
+        self.broadphase = broadphase
+        self.observers = list(observers)
+        self.options = dict(control_period=control_period,
+                            muscle_period=muscle_period, until=list(until),
+                            events=events, profiler=profiler)
+        self.steps = int(round(t / dt))  # index of the next step
+        self.stop_reason = None  # why the last step() ended early
+
+        if recorder is not None:
+            for every, callback in recorder.samplers():
+                self.observers.append(Observer(callback, every=every))
+        self.compile()
+
+    # time of the next step
+    @property
+    def t(self):
+        return self.steps * self.dt
+
+    # physics loop and observers from the current system and options
+    def compile(self):
+        self.scheduled, self.advance, self.metrics = compile_steps(
+            self.rbs, self.dt, self.controller, self.ground_height,
+            self.observers, self.broadphase, **self.options)
+        for observer in self.scheduled:
+            observer.next_step = self.steps
+
+    # controller hook, see StanceController.system_update (None: no
+    # joint torques)
+    def set_controller(self, controller):
+        self.controller = controller
+        self.compile()
+
+    # observer hook, called from the current step on
+    def add_observer(self, observer):
+        self.observers.append(observer)
+        self.compile()
+
+    # recorder hook: its channels are sampled from the current step on
+    def add_recorder(self, recorder):
+        for every, callback in recorder.samplers():
+            self.observers.append(Observer(callback, every=every))
+        self.compile()
+
+    # advance by n steps. Returns the number of steps taken, fewer if an
+    # observer returned True, a Stop condition held or an event callback
+    # returned True (the reason is kept in stop_reason)
+    def step(self, n=1):
+        start_time = time.time()
+        first = step = self.steps
+        last = first + n
+        stop_reason = None
+        while step < last and stop_reason is None:
+            # call observers that are due, then run up to the next one
+            stop = last
+            for observer in self.scheduled:
+                if observer.next_step <= step \
+                        and observer.notify(step, self.dt, self.rbs) is True:
+                    stop_reason = 'observer'
+                stop = min(stop, observer.next_step)
+
+            if stop_reason is None:
+                step, stop_reason = self.advance(step, stop)
+
+        profiler = self.options['profiler']
+        if profiler is not None:
+            profiler.add_run(step - first, time.time() - start_time)
+        self.steps = step
+        self.stop_reason = stop_reason
+        return step - first
+
+    # simulate from the current time up to t_stop (inclusive, like
+    # run()) and return the summary of run(), which compiles its own
+    # loop with the options of this simulator. Keyword arguments are
+    # passed on to run() and override those options, e.g. decimate
+    def run(self, t_stop, **options):
+        options = dict(self.options, **options)
+        summary = run(self.rbs, self.dt, t_stop, controller=self.controller,
+                      ground_height=self.ground_height,
+                      observers=self.observers, t_start=self.t,
+                      broadphase=self.broadphase, **options)
+        self.steps += summary['steps']
+        self.stop_reason = summary['stop_reason']
+        return summary
+
+
+######################################################################
+
+# <1>: The batch costs a fixed ~100 us per step in numpy call overhead,
+# the scalar updates grow with the number of bodies. Measured per step
+# (scalar vs array state, benchmark.chain_system with n bodies): human
+# model 9 vs 80 us, n=4 14 vs 110 us, n=16 47 vs 115 us, n=64 190 vs
+# 155 us, n=256 820 vs 195 us. The array state only pays off for systems
+# of some 50 bodies and more, small models run faster with scalar bodies.
@@ -0,0 +1,173 @@
+"""
+System Snapshots
+
+Saves and restores the complete state of a running rigid body system:
+body states, site loads, the joint and contact variables (contact and
+friction modes, stiction anchor, ...), the state of the integrator and
+of the controller. A snapshot is a compact binary string of float64
+values, e.g.
+
+    snap = Snapshot(rbs, controller)
+    data = snap.capture()                 # bytes, can be stored or sent
+    run(rbs, dt, 1.0, controller=controller)
+    snap.restore(data)                    # back to the captured state
+
+A snapshot can be restored into any system of the same topology, e.g.
+a fresh human_model() in a worker process. fork() clones a running
+system into independent branches that continue from its current state,
+e.g. to try different controllers from the same pre-touchdown state
+without simulating the shared prefix again.
+
+"""
+
+import copy
+import struct
+from array import array
+
+import numpy as np
+
+# attributes that make up the state of a system between two steps
+BODY_STATE = ('x', 'z', 'p', 'vx', 'vz', 'vp')
+SITE_STATE = ('fx', 'fz', 'tau')
+JOINT_STATE = ('dist_x', 'dist_z', 'q', 'tau')
+CONTACT_STATE = ('base_x', 'base_z', 'ground_height', 'contact',
+                 'sliding_mode', 'x_stick', 'z_stick')
+
+MAGIC = b'RBS1'
+HEADER = struct.Struct('<4sI')  # magic and number of values
+
+
+# objects of a system and its controller with the names of their state
+# attributes. Integrators, muscle banks, delay lines and controllers
+# list theirs in STATE
+def state_layout(rbs, controller=None):
+    layout = [(body, BODY_STATE) for body in rbs.body_list]
+    layout += [(site, SITE_STATE) for body in rbs.body_list
+               for site in body.sites]
+    layout += [(joint, JOINT_STATE) for joint in rbs.joint_list]
+    layout += [(contact, CONTACT_STATE) for contact in rbs.contact_list]
+    layout += [(contact_set.batch, CONTACT_STATE)
+               for contact_set in rbs.contact_sets]
+    layout += [(muscle_bank, muscle_bank.STATE)
+               for muscle_bank in rbs.muscle_banks]
+    layout += [(muscle_bank.feedback, muscle_bank.feedback.STATE)
+               for muscle_bank in rbs.muscle_banks]
+    if rbs.integrator is not None:
+        layout.append((rbs.integrator, getattr(rbs.integrator, 'STATE', ())))
+    if controller is not None:
+        names = getattr(controller, 'STATE', None)
+        if names is None:  # all scalar attributes
+            names = tuple(name for name, value in vars(controller).items()
+                          if isinstance(value, (bool, int, float)))
+        layout.append((controller, names))
+    return layout
+
+
+# copy of a state value; lists and arrays are copied element by element
+def copy_value(value):
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    return value
+
+
+# in-memory copy of the state of a system, and of its controller, that
+# restore_state can return to
+def save_state(rbs, controller=None):
+    return [(obj, [(name, copy_value(getattr(obj, name))) for name in names])
+            for obj, names in state_layout(rbs, controller)]
+
+
+# return a system (and controller) to a state from save_state
+def restore_state(rbs, saved):
+    for obj, values in saved:
+        for name, value in values:
+            setattr(obj, name, copy_value(value))
+    rbs.update_site_coords()
+
+
+# clone a system (and its controller) into k independent copies that
+# continue from its current state. Returns a list of (rbs, controller)
+def fork(rbs, k, controller=None):
+    return [copy.deepcopy((rbs, controller)) for _ in range(k)]
+
+
+######################################################################
+class Snapshot():
+    """
+    Binary snapshots of a system and its controller.
+
+    The layout of the values (see state_layout) is fixed when the
+    Snapshot is created; capture() returns the current state as bytes
+    and restore() writes such bytes back. Flags are stored as 0.0/1.0,
+    integers (e.g. the head of a delay line) as exact floats, lists
+    (e.g. the joint rates of articulated.ArticulatedBodySolver) and
+    arrays (e.g. the points of a contact set) element by element.
+    """
+
+    def __init__(self, rbs, controller=None):
+        self.rbs = rbs
+        self.layout = state_layout(rbs, controller)
+
+        # per attribute: None for a float, bool for a flag, int for an
+        # integer, the length of a list, or (shape, dtype) of an array
+        self.kinds = [[bool if isinstance(value, bool)
+                       else int if isinstance(value, int)
+                       else len(value) if isinstance(value, list)
+                       else (value.shape, value.dtype)
+                       if isinstance(value, np.ndarray) else None
+                       for value in (getattr(obj, name) for name in names)]
+                      for obj, names in self.layout]
+        self.size = sum(1 if kind is None or kind is bool or kind is int
+                        else int(np.prod(kind[0])) if isinstance(kind, tuple)
+                        else kind
+                        for kinds in self.kinds for kind in kinds)
+
+    # current state as bytes
+    def capture(self):
+        values = array('d')
+        for obj, names in self.layout:
+            for name in names:
+                value = getattr(obj, name)
+                if isinstance(value, list):
+                    values.extend(value)
+                elif isinstance(value, np.ndarray):
+                    values.extend(value.astype(float).ravel().tolist())
+                else:
+                    values.append(value)
+
+        return HEADER.pack(MAGIC, len(values)) + values.tobytes()
+
+    # set the system (and controller) to the state in data
+    def restore(self, data):
+        magic, size = HEADER.unpack_from(data)
+        if magic != MAGIC or size != self.size:
+            raise ValueError('snapshot does not match the layout of %s'
+                             % self.rbs.name)
+        values = array('d')
+        values.frombytes(data[HEADER.size:])
+
+        ix = 0
+        for (obj, names), kinds in zip(self.layout, self.kinds):
+            for name, kind in zip(names, kinds):
+                if kind is None:
+                    setattr(obj, name, values[ix])
+                    ix += 1
+                elif kind is bool:
+                    setattr(obj, name, values[ix] != 0.0)
+                    ix += 1
+                elif kind is int:
+                    setattr(obj, name, int(values[ix]))
+                    ix += 1
+                elif isinstance(kind, tuple):
+                    shape, dtype = kind
+                    size = int(np.prod(shape))
+                    setattr(obj, name, np.array(values[ix:ix + size])
+                            .reshape(shape).astype(dtype))
+                    ix += size
+                else:
+                    setattr(obj, name, values[ix:ix + kind].tolist())
+                    ix += kind
+
+        self.rbs.update_site_coords()
@@ -0,0 +1,116 @@
+import numpy as np
+from bodies import Body
+from interaction.revolute import RevoluteJointBatch
+
+
+class SystemState():
+    """
+    Structure-of-arrays store for the states of all bodies of a rigid
+    body system. Positions, velocities, masses and inertias of the
+    bodies, as well as the coordinates and loads of their connection
+    sites, are kept in contiguous arrays such that the equations of
+    motion of the whole system can be integrated in one vectorized
+    update.
+
+    Bodies and sites created through the store are views into these
+    arrays (see BodyView and SiteView in bodies.py), so interaction
+    classes can keep reading and writing their attributes as usual.
+    """
+
+    # constructor
+    def __init__(self):
+        # body states and inertial properties (one entry per body)
+        self.x = np.zeros(0)  # (x, z, p): CoM pos and body pitch
+        self.z = np.zeros(0)
+        self.p = np.zeros(0)
+        self.vx = np.zeros(0)  # corresponding velocities
+        self.vz = np.zeros(0)
+        self.vp = np.zeros(0)
+        self.m = np.zeros(0)
+        self.In = np.zeros(0)
+
+        # site coordinates and loads (one entry per site)
+        self.site_body = np.zeros(0, dtype=np.intp)  # index of home body
+        self.x_b = np.zeros(0)  # coords in body frame
+        self.z_b = np.zeros(0)
+        self.x_b2w = np.zeros(0)  # coords mapped to world frame
+        self.z_b2w = np.zeros(0)
+        self.fx = np.zeros(0)  # forces and moments acting at site
+        self.fz = np.zeros(0)
+        self.tau = np.zeros(0)
+
+    @property
+    def number_of_bodies(self):
+        return self.m.shape[-1]
+
+    # reserve storage for a new body and return its index
+    def add_body(self):
+        for name in ('x', 'z', 'p', 'vx', 'vz', 'vp', 'm', 'In'):
+            setattr(self, name, np.append(getattr(self, name), 0.0))  # <1>
+
+        return self.number_of_bodies - 1
+
+    # reserve storage for a new site of body ix and return its index
+    def add_site(self, body_ix):
+        self.site_body = np.append(self.site_body, body_ix)
+        for name in ('x_b', 'z_b', 'x_b2w', 'z_b2w', 'fx', 'fz', 'tau'):
+            setattr(self, name, np.append(getattr(self, name), 0.0))
+
+        return len(self.site_body) - 1
+
+    # RevoluteJointBatch of joints between bodies and sites of this
+    # state, with the joint parameters at the time of the call
+    def joint_batch(self, joints, name='joints'):
+        def stack(name):
+            return np.array([getattr(joint, name) for joint in joints],
+                            dtype=float)
+
+        batch = RevoluteJointBatch(
+            name, self, [joint.base_body._ix for joint in joints],
+            [joint.base._ix for joint in joints],
+            [joint.mate_body._ix for joint in joints],
+            [joint.mate._ix for joint in joints],
+            stack('q_min'), stack('q_max'), stack('q_dot_max'),
+            stack('k'), stack('b'), stack('k_lim'))
+        batch.tau = stack('tau')
+        return batch
+
+    # map body coords of all sites into world frame coords
+    def update_site_coords(self):
+        p = self.p.take(self.site_body, -1)
+        cp, sp = np.cos(p), np.sin(p)
+
+        self.x_b2w[:] = cp * self.x_b - sp * self.z_b
+        self.z_b2w[:] = sp * self.x_b + cp * self.z_b
+
+    # sum site forces and moments into net loads acting on each body
+    def net_loads(self):
+        n = self.number_of_bodies
+        net_fx = np.bincount(self.site_body, weights=self.fx, minlength=n)
+        net_fz = np.bincount(self.site_body, weights=self.fz, minlength=n)
+        net_tau = np.bincount(self.site_body, minlength=n, weights=self.tau
+                              + self.x_b2w * self.fz - self.z_b2w * self.fx)
+
+        return net_fx, net_fz, net_tau
+
+    # integrate equations of motion of all bodies at once
+    def integrate(self, dt):
+        net_fx, net_fz, net_tau = self.net_loads()
+
+        # same symplectic euler update as Body.integrate, in place so
+        # that body and site views stay attached to the arrays
+        self.vx += net_fx / self.m * dt
+        self.x += self.vx * dt
+        self.vz += (net_fz / self.m - Body.g) * dt
+        self.z += self.vz * dt
+        self.vp += net_tau / self.In * dt
+        self.p += self.vp * dt
+
+        self.update_site_coords()
+
+
+######################################################################
+
+# <1>: Storage grows by reallocation. This only happens while the
+# system is assembled; views look up the current array by name on
+# every access and therefore never hold on to a stale buffer.
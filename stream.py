@@ -0,0 +1,230 @@
+"""
+Streaming Trajectory Output
+
+StreamingRecorder records the same channels as recorder.Recorder, but
+keeps only one fixed-size chunk per channel in memory and appends full
+chunks to disk, so memory use stays constant however long a run lasts.
+
+A recording is a directory holding one .npy file per channel, one .npy
+file of sample times per decimation factor and an index.json that
+describes all of them. The .npy headers are rewritten after every
+chunk, so the files are valid (and readable with numpy.load) while the
+run is still going. Recording opens such a directory lazily through
+memory maps, e.g.
+
+    recording = Recording('runs/hop')
+    view = recording.view(t_start=100.0, t_stop=110.0, stride=10)
+    plot_recorded_joints(view)  # see output.py
+
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from recorder import Recorder
+
+HEADER_SIZE = 128  # fixed .npy header size, so it can be rewritten in place
+
+
+# write a .npy (version 1.0) header for an array of dtype and shape,
+# padded to HEADER_SIZE bytes
+def write_npy_header(file, dtype, shape):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" \
+        % (np.dtype(dtype).str, tuple(shape))
+    header = header.ljust(HEADER_SIZE - 10 - 1) + '\n'
+    if len(header) != HEADER_SIZE - 10:
+        raise ValueError('shape %r does not fit the .npy header' % (shape,))
+
+    file.seek(0)
+    file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header))
+               + header.encode('latin1'))
+
+
+######################################################################
+class StreamingRecorder(Recorder):
+    """
+    Recorder that streams its channels to a recording directory in
+    chunks of chunk_size samples. Call close() (or use the recorder as
+    a context manager) after the run to write the last partial chunks.
+    """
+
+    def __init__(self, directory, dt, chunk_size=4096):
+        super().__init__(dt, t_stop=0.0)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+
+        self.files = {}    # file name -> open file
+        self.flushed = {}  # decimate -> number of samples on disk
+
+    # every group buffers one chunk only
+    def buffer_length(self, decimate):
+        return self.chunk_size
+
+    # register a channel and create its file
+    def add_channel(self, name, getter, decimate=1, width=None, dtype=float):
+        super().add_channel(name, getter, decimate, width, dtype)
+
+        if decimate not in self.flushed:
+            self.flushed[decimate] = 0
+            self.open_file(self.time_file(decimate), self.t[decimate])
+        self.open_file(name + '.npy', self.channels[name][1])
+        self.write_index()
+
+    # create an empty .npy file with the dtype and row shape of buffer
+    def open_file(self, file_name, buffer):
+        file = open(os.path.join(self.directory, file_name), 'w+b')
+        write_npy_header(file, buffer.dtype, (0,) + buffer.shape[1:])
+        self.files[file_name] = file
+
+    # name of the file of sample times of a decimation factor
+    @staticmethod
+    def time_file(decimate):
+        return 't_%d.npy' % decimate
+
+    # a full chunk is written to disk instead of growing the buffers
+    def grow(self, decimate):
+        self.flush(decimate)
+
+    # append the buffered samples of a group to its files
+    def flush(self, decimate):
+        n = self.count[decimate]
+        if n == 0:
+            return
+        total = self.flushed[decimate] + n
+
+        files = [(self.time_file(decimate), self.t[decimate])]
+        files += [(name + '.npy', self.channels[name][1])
+                  for name in self.groups[decimate]]
+        for file_name, buffer in files:
+            file = self.files[file_name]
+            file.seek(0, os.SEEK_END)
+            file.write(np.ascontiguousarray(buffer[:n]).tobytes())
+            write_npy_header(file, buffer.dtype, (total,) + buffer.shape[1:])
+            file.flush()
+
+        self.flushed[decimate] = total
+        self.count[decimate] = 0
+        self.write_index()
+
+    # describe all files of the recording in index.json
+    def write_index(self):
+        index = {
+            'version': 1,
+            'dt': self.dt,
+            'chunk_size': self.chunk_size,
+            'groups': {str(decimate): {'time_file': self.time_file(decimate),
+                                       'count': self.flushed[decimate]}
+                       for decimate in self.groups},
+            'channels': {name: {'file': name + '.npy',
+                                'decimate': channel[2],
+                                'dtype': channel[1].dtype.str,
+                                'shape': list(channel[1].shape[1:])}
+                         for name, channel in self.channels.items()},
+        }
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w') as file:
+            json.dump(index, file, indent=1)
+        os.replace(path + '.tmp', path)  # readers never see a partial index
+
+    # write the remaining samples and close all files
+    def close(self):
+        for decimate in self.groups:
+            self.flush(decimate)
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # recorded samples of a channel, read back from disk
+    def __getitem__(self, name):
+        self.flush(self.channels[name][2])
+        return Recording(self.directory)[name]
+
+    # sample times of a channel, read back from disk
+    def times(self, name):
+        self.flush(self.channels[name][2])
+        return Recording(self.directory).times(name)
+
+
+######################################################################
+class Recording():
+    """
+    Read access to a recording directory. Channels are opened as
+    read-only memory maps, so nothing is loaded until it is used.
+    Supports the same item access and times() as a Recorder, e.g. for
+    trackers.ContactTracker.from_recorder.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json')) as file:
+            self.index = json.load(file)
+        self.channels = self.index['channels']
+
+    # open a file of the recording as a memory map
+    def load(self, file_name, count, dtype, shape):
+        if count == 0:
+            return np.zeros([0] + shape, dtype=dtype)
+        array = np.load(os.path.join(self.directory, file_name),
+                        mmap_mode='r')
+        return array[:count]  # samples covered by the index
+
+    # recorded samples of a channel
+    def __getitem__(self, name):
+        channel = self.channels[name]
+        count = self.index['groups'][str(channel['decimate'])]['count']
+        return self.load(channel['file'], count, channel['dtype'],
+                         channel['shape'])
+
+    # sample times of a channel
+    def times(self, name):
+        group = self.index['groups'][str(self.channels[name]['decimate'])]
+        return self.load(group['time_file'], group['count'], '<f8', [])
+
+    # names of all channels
+    def keys(self):
+        return self.channels.keys()
+
+    # lazy view of a time window, keeping every stride-th sample
+    def view(self, t_start=None, t_stop=None, stride=1):
+        return RecordingView(self, t_start, t_stop, stride)
+
+
+class RecordingView():
+    """
+    Time window of a Recording. Channels are sliced memory maps, so
+    only the samples that are actually used are read from disk.
+    """
+
+    def __init__(self, recording, t_start=None, t_stop=None, stride=1):
+        self.recording = recording
+        self.t_start = t_start
+        self.t_stop = t_stop
+        self.stride = stride
+
+    # index range of the window in the samples of a channel
+    def window(self, name):
+        t = self.recording.times(name)
+        first = 0 if self.t_start is None \
+            else int(np.searchsorted(t, self.t_start, 'left'))
+        last = len(t) if self.t_stop is None \
+            else int(np.searchsorted(t, self.t_stop, 'right'))
+        return slice(first, last, self.stride)
+
+    def __getitem__(self, name):
+        return self.recording[name][self.window(name)]
+
+    def times(self, name):
+        return self.recording.times(name)[self.window(name)]
+
+    def keys(self):
+        return self.recording.keys()
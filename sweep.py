@@ -0,0 +1,123 @@
+"""
+Parameter Sweeps
+
+Runs many headless simulations of the hopping model with different
+parameter overrides in a process pool and collects the results in one
+table. An override set may contain any human_model parameter (see
+config.HUMAN_MODEL_PARAMS) and any StanceController gain (see
+StanceController.GAINS), e.g.
+
+    runs = grid(k_lim=[30, 60, 120], mu_slide=[0.4, 0.6], k_a=[2, 4])
+    table = run_sweep(runs, dt=1e-4, t_stop=2.0)
+
+The table is a list of rows (dicts), one per run, holding the overrides
+and the summary metrics of simulation.run(). to_columns() turns it into
+a dict of arrays.
+
+"""
+
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from config import human_model, HUMAN_MODEL_PARAMS
+from control import StanceController
+from simulation import run
+
+
+# cartesian product of parameter values, e.g.
+# grid(k_lim=[30, 60], mu_slide=[0.4, 0.6]) gives four override sets
+def grid(**axes):
+    names = list(axes)
+    return [dict(zip(names, values))
+            for values in itertools.product(*axes.values())]
+
+
+# split an override set into model parameters and controller gains
+def split_overrides(overrides):
+    model, gains = {}, {}
+    for name, value in overrides.items():
+        if name in HUMAN_MODEL_PARAMS:
+            model[name] = value
+        elif name in StanceController.GAINS:
+            gains[name] = value
+        else:
+            raise KeyError('unknown sweep parameter: %s' % name)
+    return model, gains
+
+
+# build and simulate a single configuration (runs in a worker process)
+def run_one(job):
+    index, overrides, settings = job
+    model, gains = split_overrides(overrides)
+
+    rbs = human_model(**model)
+    controller = None
+    if settings['controller'] is True:
+        controller = StanceController.from_system(rbs, **gains)
+
+    result = run(rbs, settings['dt'], settings['t_stop'],
+                 controller=controller,
+                 ground_height=settings['ground_height'],
+                 decimate=settings['decimate'],
+                 control_period=settings['control_period'])
+
+    row = {'run': index}
+    row.update(overrides)
+    row.update(result)
+    return row
+
+
+# simulate all override sets on a process pool and return the table of
+# results, ordered like runs. decimate=k adds every k-th sample of the
+# trajectories to each row, control_period schedules the controller
+# (see simulation.run)
+def run_sweep(runs, dt=1e-4, t_stop=5.0, controller=True, ground_height=0.0,
+              decimate=None, max_workers=None, chunksize=1,
+              control_period=None):
+
+    runs = list(runs)
+    for overrides in runs:
+        split_overrides(overrides)  # fail early on typos
+
+    settings = {'dt': dt, 't_stop': t_stop, 'controller': controller,
+                'ground_height': ground_height, 'decimate': decimate,
+                'control_period': control_period}
+    jobs = [(ix, overrides, settings) for ix, overrides in enumerate(runs)]
+
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    max_workers = max(1, min(max_workers, len(jobs)))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(run_one, jobs, chunksize=chunksize))
+
+
+# convert the rows of a sweep table into a dict of column arrays. Runs
+# that do not set a parameter get its human_model default (or NaN)
+def to_columns(table):
+    names = []
+    for row in table:
+        names += [name for name in row
+                  if name not in names and name != 'trajectory']
+
+    columns = {}
+    for name in names:
+        default = HUMAN_MODEL_PARAMS.get(name)
+        if default is None:
+            default = getattr(StanceController, name, float('nan'))
+        columns[name] = np.array([row.get(name, default) for row in table])
+
+    return columns
+
+
+# write the summary columns of a sweep table to a csv file
+def write_csv(table, path):
+    columns = to_columns(table)
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerows(zip(*columns.values()))
@@ -0,0 +1,159 @@
+"""
+Terrain
+
+Uneven ground for GroundContact: a piecewise linear height profile
+z = h(x) through sampled breakpoints. Beyond the first and last
+breakpoint the ground continues flat. Equal x of two neighbouring
+breakpoints give a vertical step.
+
+Height and normal queries locate the segment under a point through a
+uniform grid over the profile, so a query costs O(1) however many
+breakpoints there are (or O(log n) by bisection if the breakpoints are
+too unevenly spaced for a grid), e.g.
+
+    ground = Terrain.rough(length=20.0, spacing=0.05, amplitude=0.02)
+    run(rbs, dt, t_stop, ground_height=ground)
+
+Anything that takes a ground height (GroundContact.update,
+simulation.run, sweep.run_sweep, ...) also accepts a Terrain.
+
+"""
+
+import bisect
+import math
+
+import numpy as np
+
+MAX_GRID_CELLS = 1000000  # larger grids fall back to bisection
+
+
+class Terrain():
+    """
+    Piecewise linear ground profile through the breakpoints (x, z),
+    with x non-decreasing.
+    """
+
+    # constructor
+    def __init__(self, x, z):
+        x, z = [float(v) for v in x], [float(v) for v in z]
+        if len(x) != len(z) or len(x) < 1:
+            raise ValueError('terrain needs matching, non-empty x and z')
+        if any(b < a for a, b in zip(x, x[1:])):
+            raise ValueError('terrain breakpoints must be sorted by x')
+        self.x, self.z = x, z
+        self.z_max = max(z)  # upper bound of the ground height
+
+        # start, height, slope and unit normal (nx, nz) of every
+        # segment, segment k runs from x[k - 1] to x[k]; the flat
+        # extensions are the first and last segment
+        self.x_seg = [-math.inf] + x
+        self.z0, self.slope, self.nx, self.nz = [z[0]], [0.0], [0.0], [1.0]
+        for k in range(len(x)):
+            if k + 1 < len(x) and x[k + 1] > x[k]:
+                slope = (z[k + 1] - z[k]) / (x[k + 1] - x[k])
+            else:
+                slope = 0.0  # vertical step or flat end
+            norm = math.sqrt(1.0 + slope * slope)
+            self.z0.append(z[k])
+            self.slope.append(slope)
+            self.nx.append(-slope / norm)
+            self.nz.append(1.0 / norm)
+
+        # uniform grid: first segment of every cell, <1>
+        spacing = [b - a for a, b in zip(x, x[1:]) if b > a]
+        self.cell = min(spacing) if spacing else 1.0
+        n_cells = int(math.ceil((x[-1] - x[0]) / self.cell)) + 1
+        if n_cells <= MAX_GRID_CELLS:
+            self.grid = [bisect.bisect_right(x, x[0] + ix * self.cell)
+                         for ix in range(n_cells)]
+        else:
+            self.grid = None
+
+        # for vectorized queries: breakpoints, and z0, slope, nx, nz and
+        # start of every segment as rows (the start of the flat first
+        # segment does not matter)
+        self.x_array = np.array(x)
+        self.segments = np.array([self.z0, self.slope, self.nx, self.nz,
+                                  [0.0] + x])
+
+    # flat ground at a given height
+    @classmethod
+    def flat(cls, height=0.0):
+        return cls([0.0], [height])
+
+    # straight slope of angle [rad] starting at x_start
+    @classmethod
+    def slope(cls, angle, x_start=0.0, length=100.0, height=0.0):
+        return cls([x_start, x_start + length],
+                   [height, height + length * math.tan(angle)])
+
+    # stairs of n steps of given rise and run, starting at x_start
+    @classmethod
+    def steps(cls, rise, run, n, x_start=0.0, height=0.0):
+        x, z = [], []
+        for ix in range(n):
+            x += [x_start + ix * run] * 2
+            z += [height + ix * rise, height + (ix + 1) * rise]
+        return cls(x, z)
+
+    # random rough ground with heights uniform in +-amplitude at every
+    # spacing, starting at x_start
+    @classmethod
+    def rough(cls, length, spacing, amplitude, x_start=0.0, height=0.0,
+              seed=None):
+        rng = np.random.default_rng(seed)
+        x = x_start + spacing * np.arange(int(round(length / spacing)) + 1)
+        z = height + rng.uniform(-amplitude, amplitude, len(x))
+        z[0] = height
+        return cls(x, z)
+
+    # index of the segment under x
+    def segment(self, x):
+        if self.grid is None or x < self.x[0]:
+            return bisect.bisect_right(self.x, x)
+        ix = int((x - self.x[0]) / self.cell)
+        if ix >= len(self.grid):
+            return len(self.x)
+        k = self.grid[ix]
+        x_seg = self.x_seg
+        while k + 1 < len(x_seg) and x_seg[k + 1] <= x:
+            k += 1
+        return k
+
+    # ground height at x
+    def height(self, x):
+        k = self.segment(x)
+        return self.z0[k] + self.slope[k] * (x - self.x_seg[k]) if k > 0 \
+            else self.z0[0]
+
+    # ground height and unit normal (nx, nz) at x
+    def query(self, x):
+        k = self.segment(x)
+        if k == 0:
+            return self.z0[0], 0.0, 1.0
+        return (self.z0[k] + self.slope[k] * (x - self.x_seg[k]),
+                self.nx[k], self.nz[k])
+
+    # vectorized query for an array of x: heights, nx and nz
+    def query_array(self, x):
+        x = np.asarray(x, dtype=float)
+        k = np.searchsorted(self.x_array, x, side='right')
+        z0, slope, nx, nz, x_seg = self.segments[:, k]
+        return z0 + slope * (x - x_seg), nx, nz
+
+    # profile points between x_min and x_max, e.g. for plotting
+    def profile(self, x_min, x_max):
+        inner = [(x, z) for x, z in zip(self.x, self.z) if x_min < x < x_max]
+        return ([x_min] + [x for x, _ in inner] + [x_max],
+                [self.height(x_min)] + [z for _, z in inner]
+                + [self.height(x_max)])
+
+
+######################################################################
+
+# <1>: The grid cell is the shortest segment, so at most one breakpoint
+# lies inside a cell and a query advances at most one segment past the
+# one stored for its cell (segments of zero length, i.e. vertical
+# steps, are skipped on the way). The stored index is that of the last
+# breakpoint at or left of the cell start, which is the segment index
+# since segment 0 is the flat extension to the left.
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import benchmark
+from body_system import RigidBodySystem
+from config import human_model
+from control import StanceController
+from integrators import SCHEMES
+from profiler import Profiler
+from simulation import run
+
+DT = 1e-4
+
+
+def body_states(rbs):
+    return np.array([[b.x, b.z, b.p, b.vx, b.vz, b.vp] for b in rbs.body_list])
+
+
+# human_model with scalar and array state, final body states after t_stop
+def human_states(t_stop, scheme=None, controller=False, **options):
+    states = []
+    for array_state in (False, True):
+        rbs = human_model(array_state=array_state)
+        if scheme is not None:
+            rbs.set_integrator(scheme)
+        if controller is True:
+            options['controller'] = StanceController.from_system(rbs)
+        run(rbs, DT, t_stop, **options)
+        states.append(body_states(rbs))
+    return states
+
+
+def test_human_model_matches_scalar_bodies():
+    scalar, array = human_states(0.3)
+    assert np.array_equal(scalar, array)
+
+
+@pytest.mark.parametrize('scheme', sorted(SCHEMES))
+def test_schemes_match_scalar_bodies(scheme):
+    scalar, array = human_states(0.1, scheme)
+    assert np.array_equal(scalar, array)
+
+
+def test_controller_and_profiler_match_scalar_bodies():
+    scalar, array = human_states(0.3, controller=True)
+    assert np.array_equal(scalar, array)
+    scalar, array = human_states(0.2, profiler=Profiler())
+    assert np.array_equal(scalar, array)
+
+
+def test_joints_written_back():
+    scalar, array = human_model(), human_model(array_state=True)
+    for rbs in (scalar, array):
+        run(rbs, DT, 0.2)
+    for a, b in zip(scalar.joint_list, array.joint_list):
+        assert (a.q, a.tau, a.dist_x, a.dist_z) == (b.q, b.tau, b.dist_x, b.dist_z)
+
+
+@pytest.mark.parametrize('n', [3, 20])
+def test_chain_matches_scalar_bodies(n, monkeypatch):
+    states = []
+    for array_state in (False, True):
+        monkeypatch.setattr(benchmark, 'RigidBodySystem', lambda name:
+                            RigidBodySystem(name=name, array_state=array_state))
+        rbs = benchmark.chain_system(n, grounded=True)
+        run(rbs, DT, 0.05)
+        states.append(body_states(rbs))
+    assert np.array_equal(*states)
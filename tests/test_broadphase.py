@@ -0,0 +1,37 @@
+import pytest
+
+from broadphase import ImpactBroadphase
+from config import human_model
+from control import StanceController
+from simulation import run
+
+DT = 1e-4
+
+
+def body_states(rbs):
+    return [(b.x, b.z, b.p, b.vx, b.vz, b.vp) for b in rbs.body_list]
+
+
+# hop with the stance controller, with a broadphase of the given
+# options or, for None, without one
+def hop(hull_contacts, options):
+    rbs = human_model(hull_contacts=hull_contacts)
+    broadphase = None if options is None else ImpactBroadphase(rbs, **options)
+    summary = run(rbs, DT, 1.5, controller=StanceController.from_system(rbs),
+                  broadphase=broadphase)
+    return body_states(rbs), summary
+
+
+@pytest.mark.parametrize('hull_contacts', [False, True])
+@pytest.mark.parametrize('options', [{}, {'max_skip': 0.1}])
+def test_broadphase_does_not_change_trajectory(hull_contacts, options):
+    expected, summary = hop(hull_contacts, None)
+    assert summary['touchdowns'] > 0
+    states, summary = hop(hull_contacts, options)
+    assert summary['skipped_fraction'] > 0.0
+    assert states == expected
+
+
+def test_max_accel_must_be_positive():
+    with pytest.raises(ValueError):
+        ImpactBroadphase(human_model(), max_accel=0.0)
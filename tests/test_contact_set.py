@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from config import human_model, HUMAN_MODEL_PARAMS
+from interaction.contact import GroundContact, ContactSet
+from simulation import Observer, run
+from terrain import Terrain
+
+DT = 1e-4
+CONTACT_PARAMS = {name: HUMAN_MODEL_PARAMS[name] for name in
+                  ('stiffness_x', 'max_vx', 'stiffness_z', 'max_vz',
+                   'mu_slide', 'v_transition', 'mu_stick')}
+
+
+def body_states(rbs):
+    return np.array([[b.x, b.z, b.p, b.vx, b.vz, b.vp] for b in rbs.body_list])
+
+
+# one GroundContact per point of a contact set, on sites of the bodies
+# of rbs with the same names
+def add_scalar_contacts(rbs, contact_set):
+    bodies = {body.name: body for body in rbs.body_list}
+    for ix, x_b, z_b in zip(contact_set.point_body, contact_set.x_b.tolist(),
+                            contact_set.z_b.tolist()):
+        body = bodies[contact_set.bodies[ix].name]
+        body.add_site('point', x_b, z_b)
+        body.update_site_coords()
+        rbs.contact_list.append(GroundContact('point', body, body.sites[-1],
+                                              **CONTACT_PARAMS))
+
+
+def test_hull_contacts_match_scalar_contacts():
+    # dropped low and tilted, so the trunk falls onto a slope
+    options = dict(h0=1.0, initial_trunk_lean=-1.2)
+    ground = Terrain.slope(0.1, x_start=-2.0, length=5.0, height=-0.3)
+    with_set = human_model(hull_contacts=True, **options)
+    scalar = human_model(**options)
+    add_scalar_contacts(scalar, with_set.contact_sets[0])
+    for rbs in (with_set, scalar):
+        run(rbs, DT, 1.5, ground_height=ground)
+
+    assert with_set.contact_sets[0].batch.contact.sum() > 0
+    assert np.allclose(body_states(with_set), body_states(scalar),
+                       rtol=0.0, atol=1e-9)
+
+
+@pytest.mark.parametrize('n', [4, 2 * ContactSet.SCALAR_CONTACTS])
+def test_foot_points_match_scalar_contacts(n):
+    with_set, scalar = human_model(), human_model()
+    foot = with_set.body_list[3]
+    points = [(foot, 0.0, z) for z in np.linspace(-0.125, 0.125, n).tolist()]
+    with_set.contact_sets = [ContactSet('foot points', points,
+                                        **CONTACT_PARAMS)]
+    add_scalar_contacts(scalar, with_set.contact_sets[0])
+
+    # all points touch down, so the set takes its vectorized update for
+    # more than SCALAR_CONTACTS points and the scalar one otherwise
+    in_contact = [0]
+
+    def count(t, rbs):
+        in_contact[0] = max(in_contact[0],
+                            int(rbs.contact_sets[0].batch.contact.sum()))
+
+    run(with_set, DT, 0.8, observers=[Observer(count, every=1)])
+    run(scalar, DT, 0.8)
+
+    assert in_contact[0] == n
+    assert np.allclose(body_states(with_set), body_states(scalar),
+                       rtol=0.0, atol=1e-9)
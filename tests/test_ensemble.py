@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from config import human_model
+from control import StanceController, StanceControllerBatch
+from ensemble import Ensemble
+from simulation import run
+from terrain import Terrain
+
+DT = 1e-4
+VARIANTS = [dict(initial_hip_angle=0.45, damping=5200.0, mu_slide=0.6),
+            dict(stiffness_z=120000.0, mu_slide=0.4),
+            dict(initial_hip_angle=0.55, stiffness_z=90000.0)]
+GAINS = {'k_a': [2.0, 3.0, 4.0]}
+
+
+def body_states(rbs):
+    return np.array([[b.x, b.z, b.p, b.vx, b.vz, b.vp] for b in rbs.body_list])
+
+
+def ensemble_states(ensemble, ix):
+    return np.stack([ensemble.x[ix], ensemble.z[ix], ensemble.p[ix],
+                     ensemble.vx[ix], ensemble.vz[ix], ensemble.vp[ix]], 1)
+
+
+@pytest.mark.parametrize('ground', [0.0, Terrain.slope(-0.2, x_start=-1.0,
+                                                       length=5.0,
+                                                       height=-0.05)])
+def test_variants_match_scalar_runs(ground):
+    ensemble = Ensemble.from_variants(human_model, VARIANTS)
+    ensemble.run(DT, 1.0, ground_height=ground)
+    for ix, overrides in enumerate(VARIANTS):
+        rbs = human_model(**overrides)
+        run(rbs, DT, 1.0, ground_height=ground)
+        assert np.array_equal(ensemble_states(ensemble, ix), body_states(rbs))
+        assert ensemble.contacts.contact[ix, 0] == rbs.contact_list[0].contact
+
+
+def test_controller_batch_matches_scalar_controllers():
+    ensemble = Ensemble.from_variants(human_model, VARIANTS)
+    batch = StanceControllerBatch.from_ensemble(ensemble, **GAINS)
+    ensemble.run(DT, 1.0, controller=batch)
+    for ix, overrides in enumerate(VARIANTS):
+        rbs = human_model(**overrides)
+        controller = StanceController.from_system(rbs)
+        controller.k_a = GAINS['k_a'][ix]
+        run(rbs, DT, 1.0, controller=controller)
+        assert np.array_equal(ensemble_states(ensemble, ix), body_states(rbs))
+
+
+def test_write_back_restores_system():
+    ensemble = Ensemble.from_variants(human_model, VARIANTS)
+    ensemble.run(DT, 0.5)
+    rbs = ensemble.write_back(1)
+    assert np.array_equal(body_states(rbs), ensemble_states(ensemble, 1))
+    assert [joint.q for joint in rbs.joint_list] \
+        == ensemble.joints.q[1].tolist()
+
+
+def test_topology_must_match():
+    with pytest.raises(ValueError):
+        Ensemble([human_model(), human_model(hull_contacts=True)])
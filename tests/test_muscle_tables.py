@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from config import human_model
+from muscle import MuscleBank
+from muscle_tables import MuscleTables
+
+TOL = 1e-5
+
+
+# muscle bank of the human model with curve parameters varied per
+# muscle, so every muscle gets tables of its own
+@pytest.fixture(scope='module')
+def bank():
+    bank = human_model(muscles=True).muscle_banks[0]
+    spread = np.linspace(0.8, 1.2, len(bank.c))
+    for name in ('e_ref_see', 'c', 'w', 'K', 'N'):
+        setattr(bank, name, getattr(bank, name) * spread)
+    return bank
+
+
+# largest error of a table of n muscles over random arguments from lo
+# to hi, which extend beyond the table ranges
+def max_error(table, exact, n, lo, hi, relative=False):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(lo, hi, size=(2000, n))
+    error = 0.0
+    for row in x:
+        difference = np.abs(table(row) - exact(row))
+        if relative is True:
+            difference = difference / exact(row)
+        error = max(error, float(difference.max()))
+    return error
+
+
+def test_tables_within_tolerance(bank, tmp_path):
+    tables = MuscleTables(bank, TOL, str(tmp_path))
+    assert max_error(lambda x: tables.f_se(x, bank.e_ref_see),
+                     lambda x: MuscleBank.f_se(x, bank.e_ref_see),
+                     len(bank.c), 0.9, 1.5) <= TOL
+    assert max_error(lambda x: tables.f_l_relationship(x, bank.c, bank.w),
+                     lambda x: MuscleBank.f_l_relationship(x, bank.c, bank.w),
+                     len(bank.c), 0.3, 1.7, relative=True) <= TOL
+    assert max_error(lambda x: tables.f_v_inverse(x, bank.K, bank.N),
+                     lambda x: MuscleBank.f_v_inverse(x, bank.K, bank.N),
+                     len(bank.c), 0.0, 3.0) <= TOL
+
+
+def test_cached_tables_are_reused(bank, tmp_path):
+    built = MuscleTables(bank, TOL, str(tmp_path))
+    files = sorted(path.name for path in tmp_path.iterdir())
+    cached = MuscleTables(bank, TOL, str(tmp_path))
+    assert sorted(path.name for path in tmp_path.iterdir()) == files
+    for name in ('se_table', 'l_table', 'v_table'):
+        assert np.array_equal(getattr(cached, name).values,
+                              getattr(built, name).values)
@@ -0,0 +1,60 @@
+import pytest
+
+from articulated import ArticulatedBodySolver
+from config import human_model
+from control import StanceController
+from simulation import run
+from snapshot import Snapshot, fork
+
+DT = 1e-4
+T_SNAP, T_STOP = 0.5, 0.8
+
+
+def body_states(rbs):
+    return [(b.x, b.z, b.p, b.vx, b.vz, b.vp) for b in rbs.body_list]
+
+
+def make(mode):
+    rbs = human_model(array_state=(mode == 'array_state'),
+                      hull_contacts=(mode == 'hull_contacts'))
+    if mode == 'reduced':
+        rbs.integrator = ArticulatedBodySolver(rbs)
+    elif mode == 'rk4':
+        rbs.set_integrator('rk4')
+    return rbs, StanceController.from_system(rbs)
+
+
+def resume(rbs, controller):
+    run(rbs, DT, T_STOP, controller=controller, t_start=T_SNAP + DT)
+    return body_states(rbs)
+
+
+@pytest.mark.parametrize('mode', ['plain', 'array_state', 'hull_contacts',
+                                  'reduced', 'rk4'])
+def test_restore_and_fork_continue_identically(mode):
+    rbs, controller = make(mode)
+    run(rbs, DT, T_STOP, controller=controller)
+    expected = body_states(rbs)
+
+    rbs, controller = make(mode)
+    run(rbs, DT, T_SNAP, controller=controller)
+    snap = Snapshot(rbs, controller)
+    data = snap.capture()
+    branches = fork(rbs, 2, controller)
+    assert resume(rbs, controller) == expected
+
+    # back into the same system, and into a fresh one
+    snap.restore(data)
+    assert resume(rbs, controller) == expected
+    fresh, fresh_controller = make(mode)
+    Snapshot(fresh, fresh_controller).restore(data)
+    assert resume(fresh, fresh_controller) == expected
+
+    for branch, branch_controller in branches:
+        assert resume(branch, branch_controller) == expected
+
+
+def test_restore_rejects_other_layout():
+    data = Snapshot(human_model()).capture()
+    with pytest.raises(ValueError):
+        Snapshot(human_model(hull_contacts=True)).restore(data)
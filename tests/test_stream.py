@@ -0,0 +1,53 @@
+import numpy as np
+
+from config import human_model
+from recorder import Recorder
+from simulation import run
+from stream import Recording, StreamingRecorder
+
+DT = 1e-4
+T_STOP = 0.8
+
+
+# the same channels as main.py: joints, bodies and contacts at
+# different decimation factors
+def add_channels(recorder, rbs):
+    recorder.add_joints(rbs)
+    recorder.add_bodies(rbs, decimate=7)
+    recorder.add_contacts(rbs, decimate=10)
+
+
+def test_streamed_recording_matches_recorder(tmp_path):
+    rbs = human_model()
+    recorder = Recorder(DT, T_STOP)
+    add_channels(recorder, rbs)
+    run(rbs, DT, T_STOP, recorder=recorder)
+
+    # the chunks do not divide the number of samples
+    rbs = human_model()
+    directory = str(tmp_path / 'hop')
+    with StreamingRecorder(directory, DT, chunk_size=100) as streaming:
+        add_channels(streaming, rbs)
+        run(rbs, DT, T_STOP, recorder=streaming)
+
+    recording = Recording(directory)
+    assert set(recording.keys()) == set(recorder.channels)
+    for name in recorder.channels:
+        assert recording[name].dtype == recorder[name].dtype
+        assert np.array_equal(recording[name], recorder[name])
+        assert np.array_equal(recording.times(name), recorder.times(name))
+
+    view = recording.view(t_start=0.2, t_stop=0.6, stride=3)
+    t = recorder.times('q_hip')
+    window = (t >= 0.2) & (t <= 0.6)
+    assert np.array_equal(view.times('q_hip'), t[window][::3])
+    assert np.array_equal(view['q_hip'], recorder['q_hip'][window][::3])
+
+
+def test_streaming_recorder_reads_back_while_running(tmp_path):
+    rbs = human_model()
+    streaming = StreamingRecorder(str(tmp_path), DT, chunk_size=64)
+    streaming.add_joints(rbs)
+    run(rbs, DT, 0.1, recorder=streaming)
+    assert len(streaming['q_hip']) == len(streaming.times('q_hip')) == 1001
+    streaming.close()
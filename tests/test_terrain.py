@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import terrain
+from terrain import Terrain
+
+TERRAINS = {
+    'flat': Terrain.flat(0.1),
+    'slope': Terrain.slope(0.1, x_start=-0.5, length=3.0),
+    'steps': Terrain.steps(0.05, 0.3, 5, x_start=-0.2),
+    'rough': Terrain.rough(5.0, 0.05, 0.02, x_start=-1.0, seed=2),
+    'uneven': Terrain([0.0, 0.1, 0.1, 1e5], [0.0, 0.1, 0.3, 0.2]),
+}
+
+
+# height by linear search over the breakpoints
+def reference_height(ground, x):
+    xs, zs = ground.x, ground.z
+    if x < xs[0]:
+        return zs[0]
+    for k in range(len(xs) - 1):
+        if xs[k] <= x < xs[k + 1]:
+            return zs[k] + (zs[k + 1] - zs[k]) * (x - xs[k]) / (xs[k + 1] - xs[k])
+    return zs[-1]
+
+
+# random points and all breakpoints, where the segment changes
+def sample_points(ground):
+    rng = np.random.default_rng(1)
+    return np.concatenate([rng.uniform(-2.0, 6.0, 2000), ground.x])
+
+
+@pytest.mark.parametrize('name', sorted(TERRAINS))
+def test_height_matches_reference(name):
+    ground = TERRAINS[name]
+    for x in sample_points(ground).tolist():
+        assert ground.height(x) == pytest.approx(reference_height(ground, x),
+                                                 rel=0.0, abs=1e-12)
+
+
+@pytest.mark.parametrize('name', sorted(TERRAINS))
+def test_query_array_matches_query(name):
+    ground = TERRAINS[name]
+    x = sample_points(ground)
+    expected = np.array([ground.query(value) for value in x.tolist()])
+    assert np.array_equal(np.stack(ground.query_array(x), 1), expected)
+
+
+def test_bisection_fallback_matches_grid(monkeypatch):
+    grid = TERRAINS['rough']
+    monkeypatch.setattr(terrain, 'MAX_GRID_CELLS', 0)
+    bisection = Terrain(grid.x, grid.z)
+    assert bisection.grid is None
+    for x in sample_points(grid).tolist():
+        assert bisection.query(x) == grid.query(x)
@@ -1,4 +1,4 @@
-import matplotlib.pyplot as plt
+import numpy as np
 
 
 class ContactTracker():
@@ -24,6 +24,24 @@ class ContactTracker():
         self.base_z = [contact_point.base_z]
         self.ground_height = [contact_point.ground_height]
 
+    # create a tracker whose data are the channels recorded for the
+    # contact point by recorder.Recorder.add_contacts
+    @classmethod
+    def from_recorder(cls, contact_point, recorder):
+        tracker = cls.__new__(cls)
+        tracker.contact_point = contact_point
+
+        name = contact_point.name.replace(' ', '_')
+        tracker.fx = recorder['fx_' + name]
+        tracker.fz = recorder['fz_' + name]
+        tracker.contact_flag = recorder['contact_' + name]
+        tracker.slide_flag = recorder['sliding_' + name]
+        tracker.dist_x = recorder['dist_x_' + name]
+        tracker.base_z = recorder['base_z_' + name]
+        tracker.ground_height = recorder['ground_height_' + name]
+
+        return tracker
+
     # append data
     def append(self):
         self.fx.append(self.contact_point.base.fx)
@@ -35,6 +53,8 @@ class ContactTracker():
         self.ground_height.append(self.contact_point.ground_height)
 
     def plot(self, t, fig_num):
+        import matplotlib.pyplot as plt  # only needed for plotting
+
         fig = plt.figure(fig_num)
         fig.clear()
         fig.set_size_inches(6, 12)
@@ -45,29 +65,31 @@ class ContactTracker():
         axs[0].plot(t, self.fx, 'k', lw=2)
         axs[0].plot(t, self.fz, 'r', lw=2)
 
-        t_cntct = [t[i] for i in range(len(t)) if self.contact_flag[i] == 1]
+        t = np.asarray(t)
+        in_contact = np.asarray(self.contact_flag) == 1
+        t_cntct = t[in_contact]
 
-        slide_flag = [self.slide_flag[i] for i in range(len(t)) if self.contact_flag[i] == 1]
+        slide_flag = np.asarray(self.slide_flag)[in_contact]
         axs[1].set(ylabel='stiction / sliding', ylim=(-0.05, 1.05))
         axs[1].plot(t_cntct, slide_flag, 'b', lw=2)
 
-        dist_x = [self.dist_x[i] for i in range(len(t)) if self.contact_flag[i] == 1]
+        dist_x = np.asarray(self.dist_x)[in_contact]
         axs[2].set(ylabel='x position')
         axs[2].plot(t_cntct, dist_x, 'k', lw=2)
 
-        deriv_x = [(dist_x[i] - dist_x[i - 1]) / (t_cntct[i] - t_cntct[i - 1]) for i in range(1, len(t_cntct))]
+        deriv_x = np.diff(dist_x) / np.diff(t_cntct)
         axs[3].set(ylabel='x velocity')
         axs[3].plot(t_cntct[1:], deriv_x, 'k', lw=2)
 
         axs[4].set(ylabel='contact flag', ylim=(-0.05, 1.05))
         axs[4].plot(t, self.contact_flag, 'k', lw=2)
 
-        base_z = [self.base_z[i] for i in range(len(t)) if self.contact_flag[i] == 1]
+        base_z = np.asarray(self.base_z)[in_contact]
         axs[5].set(ylabel='z position', xlabel='time (s)')
         axs[5].plot(t_cntct, base_z, 'k', lw=2)
         axs[5].plot(t, self.ground_height, 'k', lw=1)
 
-        deriv_z = [(base_z[i] - base_z[i - 1]) / (t_cntct[i] - t_cntct[i - 1]) for i in range(1, len(t_cntct))]
+        deriv_z = np.diff(base_z) / np.diff(t_cntct)
         axs[6].set(ylabel='z velocity')
         axs[6].plot(t_cntct[1:], deriv_z, 'k', lw=2)
         axs[6].plot((t[0], t[-1]), (self.contact_point.max_vz, self.contact_point.max_vz), 'r', lw=1)